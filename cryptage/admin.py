@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import Departement, Membres, Stock, CardTemplate
+from .models import Departement, Membres, Stock, CardTemplate, CardJob
+from .thumbnails import thumbnail_url
 
 
 @admin.register(Departement)
@@ -12,32 +13,34 @@ class DepartementAdmin(admin.ModelAdmin):
 @admin.register(Membres)
 class MembresAdmin(admin.ModelAdmin):
     list_display = ['nom', 'prenom', 'departement', 'email', 'telephone', 'profession']
+    list_select_related = ['departement']
     list_filter = ['departement']
-    search_fields = ['nom', 'prenom', 'email']
+    search_fields = ['nom', 'prenom', 'email', 'profession']
 
 
 @admin.register(Stock)
 class StockAdmin(admin.ModelAdmin):
     list_display = ['membre', 'template_utilise', 'date_generation', 'preview_qr']
+    list_select_related = ['membre', 'template_utilise']
     list_filter = ['date_generation', 'template_utilise']
     search_fields = ['membre__nom', 'membre__prenom']
     readonly_fields = ['preview_recto', 'preview_verso', 'preview_qr', 'date_generation']
     
     def preview_qr(self, obj):
-        if obj.qr_code:
-            return format_html('<img src="{}" width="100" height="100" />', obj.qr_code.url)
+        if obj.qr_code_url:
+            return format_html('<img src="{}" width="100" height="100" />', thumbnail_url(obj, 'qr', 'xs'))
         return "Pas de QR code"
     preview_qr.short_description = "Aperçu QR"
     
     def preview_recto(self, obj):
-        if obj.carte_recto:
-            return format_html('<img src="{}" width="300" />', obj.carte_recto.url)
+        if obj.recto_url:
+            return format_html('<img src="{}" width="300" />', thumbnail_url(obj, 'recto', 'sm'))
         return "Pas de carte recto"
     preview_recto.short_description = "Aperçu Recto"
     
     def preview_verso(self, obj):
-        if obj.carte_verso:
-            return format_html('<img src="{}" width="300" />', obj.carte_verso.url)
+        if obj.verso_url:
+            return format_html('<img src="{}" width="300" />', thumbnail_url(obj, 'verso', 'sm'))
         return "Pas de carte verso"
     preview_verso.short_description = "Aperçu Verso"
 
@@ -60,25 +63,25 @@ class CardTemplateAdmin(admin.ModelAdmin):
     
     def preview_recto_thumb(self, obj):
         if obj.template_recto:
-            return format_html('<img src="{}" width="100" />', obj.template_recto.url)
+            return format_html('<img src="{}" width="100" />', thumbnail_url(obj, 'recto', 'xs'))
         return "Pas d'image"
     preview_recto_thumb.short_description = "Recto"
     
     def preview_verso_thumb(self, obj):
         if obj.template_verso:
-            return format_html('<img src="{}" width="100" />', obj.template_verso.url)
+            return format_html('<img src="{}" width="100" />', thumbnail_url(obj, 'verso', 'xs'))
         return "Pas d'image"
     preview_verso_thumb.short_description = "Verso"
     
     def preview_recto_large(self, obj):
         if obj.template_recto:
-            return format_html('<img src="{}" width="400" />', obj.template_recto.url)
+            return format_html('<img src="{}" width="400" />', thumbnail_url(obj, 'recto', 'md'))
         return "Pas d'image"
     preview_recto_large.short_description = "Aperçu Recto"
     
     def preview_verso_large(self, obj):
         if obj.template_verso:
-            return format_html('<img src="{}" width="400" />', obj.template_verso.url)
+            return format_html('<img src="{}" width="400" />', thumbnail_url(obj, 'verso', 'md'))
         return "Pas d'image"
     preview_verso_large.short_description = "Aperçu Verso"
     
@@ -88,3 +91,10 @@ class CardTemplateAdmin(admin.ModelAdmin):
             CardTemplate.objects.exclude(pk=obj.pk).update(actif=False)
         super().save_model(request, obj, form, change)
 
+
+@admin.register(CardJob)
+class CardJobAdmin(admin.ModelAdmin):
+    list_display = ['id', 'statut', 'template', 'total', 'traites', 'echecs', 'date_creation', 'date_fin']
+    list_filter = ['statut']
+    search_fields = ['cle_idempotence']
+    readonly_fields = ['total', 'traites', 'echecs', 'cle_idempotence', 'empreinte_sources', 'date_creation', 'date_debut', 'date_activite', 'date_fin']
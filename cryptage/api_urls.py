@@ -6,13 +6,20 @@ app_name = 'api'
 urlpatterns = [
     # Health check
     path('health/', api_views.health_check, name='health_check'),
+    path('metrics/', api_views.metrics, name='metrics'),
     
     # Card generation
     path('cards/generate/', api_views.generate_card, name='generate_card'),
     path('cards/generate-bulk/', api_views.generate_bulk_cards, name='generate_bulk_cards'),
     path('cards/<int:card_id>/', api_views.get_card, name='get_card'),
+    path('cards/<int:card_id>/<slug:artefact>/', api_views.card_artefact, name='card_artefact'),
     path('cards/list/', api_views.list_cards, name='list_cards'),
     path('cards/download-all/', api_views.download_all_cards, name='download_all_cards'),
+    path('cards/jobs/<int:job_id>/', api_views.get_card_job, name='get_card_job'),
+    
+    # Thumbnails
+    path('thumbnails/<slug:source>/<int:pk>/<slug:image>/<slug:size>.<slug:fmt>',
+         api_views.thumbnail, name='thumbnail'),
     
     # Templates
     path('templates/', api_views.list_templates, name='list_templates'),
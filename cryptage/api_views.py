@@ -3,17 +3,73 @@ from rest_framework.decorators import api_view, action, permission_classes, auth
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from django.shortcuts import get_object_or_404
-from django.http import FileResponse
+from django.urls import reverse
+from django.http import HttpResponse, StreamingHttpResponse
+import logging
 import os
 
-from cryptage.models import Membres, Departement, Stock, CardTemplate
+from cryptage.models import Membres, Departement, Stock, CardTemplate, CardJob, CardJobItem
 from cryptage.serializers import (
     MembreSerializer, DepartementSerializer, CardTemplateSerializer,
     StockSerializer, CardGenerationRequestSerializer,
     CardGenerationResponseSerializer, BulkCardGenerationRequestSerializer,
-    BulkCardGenerationResponseSerializer, MembreCreateSerializer
+    BulkCardGenerationResponseSerializer, MembreCreateSerializer,
+    CardJobSerializer, CardJobItemSerializer
 )
-from cryptage.card_generator import CardGenerator
+from cryptage.card_generator import assets
+from cryptage.http_cache import file_version, serve_file
+from cryptage.jobs import IdempotencyConflict, JobInProgress, enqueue_card_job, run_job_now
+from cryptage.metrics import exported_snapshots, prometheus_text
+from cryptage.pagination import InvalidCursor, approximate_count, keyset_page
+from cryptage.pdf_stream import StreamingPDFWriter
+from cryptage.search import search_members
+from cryptage.thumbnails import SOURCE_IMAGES, THUMBNAIL_FORMATS, THUMBNAIL_SIZES, get_thumbnail
+from cryptage.rendering import (
+    TemplateUnavailable, card_fingerprint, ensure_artefact, find_reusable_cards, generate_cards,
+    render_card_artefacts, reuse_card, store_card
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+def _is_async(request):
+    """La génération doit-elle être confiée au worker (?async=true) ?"""
+    return request.query_params.get('async', '').lower() in ('1', 'true', 'yes')
+
+
+def _is_forced(request):
+    """Faut-il régénérer les cartes déjà à jour (?force=true) ?"""
+    return request.query_params.get('force', '').lower() in ('1', 'true', 'yes')
+
+
+def _is_lazy(request):
+    """
+    Faut-il différer le rendu des fichiers (?lazy=true) ?
+    None sans paramètre : settings.CARD_LAZY_ARTEFACTS s'applique.
+    """
+    value = request.query_params.get('lazy')
+    if value is None:
+        return None
+    return value.lower() in ('1', 'true', 'yes')
+
+
+def _enqueue_response(request, sources, template, idempotency_key=None):
+    """Planifie la génération et renvoie l'identifiant de la tâche (202)."""
+    try:
+        job = enqueue_card_job(sources, template, force=_is_forced(request), idempotency_key=idempotency_key)
+    except IdempotencyConflict as e:
+        return Response({
+            'success': False,
+            'message': str(e)
+        }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    return Response({
+        'success': True,
+        'message': 'Génération planifiée',
+        'job_id': job.id,
+        'job_url': request.build_absolute_uri(reverse('api:get_card_job', args=[job.id])),
+        'job': CardJobSerializer(job).data
+    }, status=status.HTTP_202_ACCEPTED)
 
 
 @api_view(['POST'])
@@ -35,6 +91,12 @@ def generate_card(request):
         "photo_url": "https://...",
         "template_id": 1  // optionnel
     }
+    
+    Avec ?async=true, la carte est générée par le worker : la réponse (202)
+    contient l'identifiant de la tâche à suivre sur /api/cards/jobs/:id
+    
+    Une carte déjà à jour (même empreinte de rendu) est renvoyée sans être
+    régénérée, sauf avec ?force=true
     """
     # Pré-traitement des données pour éviter les erreurs de longueur
     mutable_data = request.data.copy()
@@ -58,6 +120,24 @@ def generate_card(request):
     
     data = serializer.validated_data
     
+    if _is_async(request):
+        if data.get('template_id'):
+            template = get_object_or_404(CardTemplate, id=data['template_id'])
+        else:
+            template = CardTemplate.get_active_template()
+            if not template:
+                return Response({
+                    'success': False,
+                    'message': 'Aucun template actif trouvé'
+                }, status=status.HTTP_400_BAD_REQUEST)
+        
+        if data.get('member_id'):
+            source = {'member_id': data['member_id']}
+        else:
+            fields = ['first_name', 'last_name', 'email', 'phone', 'profession', 'department']
+            source = {'member_data': {f: data[f] for f in fields if f in data}}
+        return _enqueue_response(request, [source], template)
+    
     try:
         # Récupérer ou créer le membre
         if data.get('member_id'):
@@ -90,78 +170,34 @@ def generate_card(request):
                     'message': 'Aucun template actif trouvé'
                 }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Générer la carte
-        generator = CardGenerator(membre, template=template)
-        
-        # Générer QR code
-        qr_img = generator.generate_qr_code()
-        
-        # Générer carte recto
-        carte_recto = generator.generate_card_front()
-        
-        # Générer carte verso
-        carte_verso = generator.generate_card_back()
-        
-        # Générer PDF
-        pdf_buffer = generator.generate_pdf()
-        
-        # Créer l'objet Stock d'abord
-        # NETTOYAGE: Supprimer les anciennes cartes de ce membre pour éviter les doublons
-        Stock.objects.filter(membre=membre).delete()
-        
-        stock = Stock(
-            membre=membre,
-            template_utilise=template
-        )
-        
-        # Sauvegarder les fichiers
-        from django.core.files.base import ContentFile
-        import uuid
-        
-        # QR Code
-        qr_buffer = generator.save_to_bytes(qr_img)
-        stock.qr_code.save(
-            f"{membre.prenom}_{membre.nom}_qr_{uuid.uuid4().hex[:8]}.png",
-            ContentFile(qr_buffer.read()),
-            save=False
-        )
-        
-        # Recto
-        recto_buffer = generator.save_to_bytes(carte_recto)
-        stock.carte_recto.save(
-            f"{membre.prenom}_{membre.nom}_recto_{uuid.uuid4().hex[:8]}.png",
-            ContentFile(recto_buffer.read()),
-            save=False
-        )
-        
-        # Verso
-        verso_buffer = generator.save_to_bytes(carte_verso)
-        stock.carte_verso.save(
-            f"{membre.prenom}_{membre.nom}_verso_{uuid.uuid4().hex[:8]}.png",
-            ContentFile(verso_buffer.read()),
-            save=False
-        )
-        
-        # PDF
-        stock.carte_pdf.save(
-            f"{membre.prenom}_{membre.nom}_carte_{uuid.uuid4().hex[:8]}.pdf",
-            ContentFile(pdf_buffer.read()),
-            save=False
-        )
+        # Réutiliser la carte existante si rien n'a changé depuis sa génération
+        fingerprint = card_fingerprint(membre, template)
+        stock = None
+        if not _is_forced(request):
+            stock = find_reusable_cards([membre], [fingerprint]).get(membre.pk)
+        reused = stock is not None
         
-        stock.save()
+        if reused:
+            reuse_card(stock)
+        else:
+            # Générer la carte
+            artefacts = render_card_artefacts(membre, template)
+            
+            # Enregistrer les fichiers (les anciennes cartes du membre sont supprimées)
+            stock = store_card(membre, template, artefacts, fingerprint)
         
         # Construire les URLs complètes
         base_url = request.build_absolute_uri('/')[:-1]
         
         return Response({
             'success': True,
-            'message': 'Carte générée avec succès',
+            'message': 'Carte déjà à jour' if reused else 'Carte générée avec succès',
             'card_id': stock.id,
-            'qr_code_url': base_url + stock.qr_code.url if stock.qr_code else None,
-            'card_front_url': base_url + stock.carte_recto.url if stock.carte_recto else None,
-            'card_back_url': base_url + stock.carte_verso.url if stock.carte_verso else None,
-            'pdf_url': base_url + stock.carte_pdf.url if stock.carte_pdf else None,
+            'reused': reused,
+            'qr_code_url': base_url + stock.qr_code_url if stock.qr_code_url else None,
+            'card_front_url': base_url + stock.recto_url if stock.recto_url else None,
+            'card_back_url': base_url + stock.verso_url if stock.verso_url else None,
+            'pdf_url': base_url + stock.pdf_url if stock.pdf_url else None,
             'member': MembreSerializer(membre).data
         }, status=status.HTTP_201_CREATED)
         
@@ -185,6 +221,20 @@ def generate_bulk_cards(request):
         "members_data": [{...}, {...}, ...],
         "template_id": 1  // optionnel
     }
+    
+    Avec ?async=true, le lot est généré par le worker : la réponse (202)
+    contient l'identifiant de la tâche à suivre sur /api/cards/jobs/:id
+    
+    Les cartes déjà à jour (même empreinte de rendu) ne sont pas régénérées,
+    sauf avec ?force=true
+    
+    Avec ?lazy=true, les cartes sont enregistrées sans leurs fichiers : chacun
+    est généré à sa première demande (voir /api/cards/:id/:artefact)
+    
+    Avec une clé d'idempotence (en-tête Idempotency-Key ou champ
+    idempotency_key), chaque membre est marqué traité dès que sa carte est
+    enregistrée : renvoyer le même lot avec la même clé après une
+    interruption reprend aux membres restants.
     """
     # Pré-traitement des données pour éviter les erreurs de longueur
     mutable_data = request.data.copy()
@@ -217,153 +267,59 @@ def generate_bulk_cards(request):
                 'message': 'Aucun template actif trouvé'
             }, status=status.HTTP_400_BAD_REQUEST)
     
+    # Chaque entrée du lot, telle qu'elle sera rappelée en cas d'erreur
+    sources = (
+        [{'member_id': member_id} for member_id in data.get('member_ids', [])] +
+        [{'member_data': member_data} for member_data in data.get('members_data', [])]
+    )
+    
+    idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotency_key')
+    
+    if _is_async(request):
+        return _enqueue_response(request, sources, template, idempotency_key)
+    
+    job = None
     generated_cards = []
     errors = []
     
-    # Imports
-    from django.core.files.base import ContentFile
-    import uuid
-    
-    # Générer pour les member_ids
-    if data.get('member_ids'):
-        for member_id in data['member_ids']:
-            try:
-                membre = Membres.objects.get(id=member_id)
-                
-                # Générer la carte
-                generator = CardGenerator(membre, template=template)
-                qr_img = generator.generate_qr_code()
-                carte_recto = generator.generate_card_front()
-                carte_verso = generator.generate_card_back()
-                pdf_buffer = generator.generate_pdf()
-                
-                # Créer l'objet Stock d'abord
-                # NETTOYAGE: Supprimer les anciennes cartes
-                Stock.objects.filter(membre=membre).delete()
-                
-                stock = Stock(
-                    membre=membre,
-                    template_utilise=template
-                )
-                
-                # Sauvegarder les fichiers
-                qr_buffer = generator.save_to_bytes(qr_img)
-                stock.qr_code.save(
-                    f"{membre.prenom}_{membre.nom}_qr_{uuid.uuid4().hex[:8]}.png",
-                    ContentFile(qr_buffer.read()),
-                    save=False
-                )
-                
-                recto_buffer = generator.save_to_bytes(carte_recto)
-                stock.carte_recto.save(
-                    f"{membre.prenom}_{membre.nom}_recto_{uuid.uuid4().hex[:8]}.png",
-                    ContentFile(recto_buffer.read()),
-                    save=False
-                )
-                
-                verso_buffer = generator.save_to_bytes(carte_verso)
-                stock.carte_verso.save(
-                    f"{membre.prenom}_{membre.nom}_verso_{uuid.uuid4().hex[:8]}.png",
-                    ContentFile(verso_buffer.read()),
-                    save=False
-                )
-                
-                stock.carte_pdf.save(
-                    f"{membre.prenom}_{membre.nom}_carte_{uuid.uuid4().hex[:8]}.pdf",
-                    ContentFile(pdf_buffer.read()),
-                    save=False
-                )
-                
-                stock.save()
-                
-                generated_cards.append(stock)
-                
-            except Exception as e:
-                import traceback
-                traceback.print_exc()
-                errors.append({
-                    'member_id': member_id,
-                    'error': str(e)
-                })
-    
-    # Générer pour les members_data
-    if data.get('members_data'):
-        for member_data in data['members_data']:
-            try:
-                # Créer ou récupérer le membre
-                dept_name = member_data.get('department', 'Non spécifié')
-                departement, _ = Departement.objects.get_or_create(nom_depart=dept_name)
-                
-                membre, _ = Membres.objects.get_or_create(
-                    email=member_data['email'],
-                    defaults={
-                        'prenom': member_data.get('first_name', ''),
-                        'nom': member_data.get('last_name', ''),
-                        'telephone': member_data.get('phone', ''),
-                        'profession': member_data.get('profession', ''),
-                        'departement': departement
-                    }
-                )
-                
-                # Générer la carte
-                generator = CardGenerator(membre, template=template)
-                qr_img = generator.generate_qr_code()
-                carte_recto = generator.generate_card_front()
-                carte_verso = generator.generate_card_back()
-                pdf_buffer = generator.generate_pdf()
-                
-                # Créer l'objet Stock d'abord
-                # NETTOYAGE: Supprimer les anciennes cartes
-                Stock.objects.filter(membre=membre).delete()
-                
-                stock = Stock(
-                    membre=membre,
-                    template_utilise=template
-                )
-                
-                # Sauvegarder les fichiers
-                qr_buffer = generator.save_to_bytes(qr_img)
-                stock.qr_code.save(
-                    f"{membre.prenom}_{membre.nom}_qr_{uuid.uuid4().hex[:8]}.png",
-                    ContentFile(qr_buffer.read()),
-                    save=False
-                )
-                
-                recto_buffer = generator.save_to_bytes(carte_recto)
-                stock.carte_recto.save(
-                    f"{membre.prenom}_{membre.nom}_recto_{uuid.uuid4().hex[:8]}.png",
-                    ContentFile(recto_buffer.read()),
-                    save=False
-                )
-                
-                verso_buffer = generator.save_to_bytes(carte_verso)
-                stock.carte_verso.save(
-                    f"{membre.prenom}_{membre.nom}_verso_{uuid.uuid4().hex[:8]}.png",
-                    ContentFile(verso_buffer.read()),
-                    save=False
-                )
-                
-                stock.carte_pdf.save(
-                    f"{membre.prenom}_{membre.nom}_carte_{uuid.uuid4().hex[:8]}.pdf",
-                    ContentFile(pdf_buffer.read()),
-                    save=False
-                )
-                
-                stock.save()
-                
+    if idempotency_key:
+        # Lot repris : les membres déjà traités ne sont pas régénérés
+        try:
+            job = run_job_now(
+                sources, template, force=_is_forced(request),
+                idempotency_key=idempotency_key, lazy=_is_lazy(request)
+            )
+        except IdempotencyConflict as e:
+            return Response({
+                'success': False,
+                'message': str(e)
+            }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        except JobInProgress as e:
+            return Response({
+                'success': False,
+                'message': str(e)
+            }, status=status.HTTP_409_CONFLICT)
+        
+        items = job.items.select_related('stock__membre__departement', 'stock__template_utilise')
+        for item in items.order_by('position'):
+            if item.statut != CardJobItem.TERMINE:
+                errors.append({**item.source, 'error': item.erreur or job.message})
+            elif item.stock is None:
+                # Carte supprimée depuis sa génération (lot renvoyé avec la même clé)
+                errors.append({**item.source, 'error': 'Carte supprimée'})
+            else:
+                generated_cards.append(item.stock)
+    else:
+        # Rendu parallèle, enregistrement dans ce processus au fil des résultats
+        for index, stock, error in generate_cards(
+            sources, template, force=_is_forced(request), lazy=_is_lazy(request)
+        ):
+            if stock is not None:
                 generated_cards.append(stock)
-                
-            except Exception as e:
-                import traceback
-                traceback.print_exc()
-                errors.append({
-                    'member_data': member_data,
-                    'error': str(e)
-                })
+            else:
+                errors.append({**sources[index], 'error': error})
     
-    base_url = request.build_absolute_uri('/')[:-1]
-    
-    return Response({
+    response = {
         'success': True,
         'message': f'{len(generated_cards)} carte(s) générée(s)',
         'total': len(data.get('member_ids', [])) + len(data.get('members_data', [])),
@@ -371,7 +327,41 @@ def generate_bulk_cards(request):
         'failed': len(errors),
         'cards': StockSerializer(generated_cards, many=True, context={'request': request}).data,
         'errors': errors if errors else None
-    }, status=status.HTTP_201_CREATED)
+    }
+    if job is not None:
+        response['job_id'] = job.id
+    
+    return Response(response, status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def get_card_job(request, job_id):
+    """
+    Suivre une tâche de génération en arrière-plan.
+    
+    GET /api/cards/jobs/:id
+    Réponse: progression, résultat de chaque membre et erreurs
+    (même format que les erreurs de /api/cards/generate-bulk)
+    """
+    job = get_object_or_404(CardJob, id=job_id)
+    items = job.items.select_related(
+        'stock__membre__departement', 'stock__template_utilise'
+    ).order_by('position')
+    
+    results = CardJobItemSerializer(items, many=True, context={'request': request}).data
+    errors = [
+        {**item['source'], 'error': item['error']}
+        for item in results if item['status'] == 'echec'
+    ]
+    
+    return Response({
+        'success': True,
+        'job': CardJobSerializer(job).data,
+        'results': results,
+        'errors': errors if errors else None
+    })
 
 
 
@@ -383,7 +373,12 @@ def list_cards(request):
     """
     Liste l'historique des cartes générées.
     
-    GET /api/cards/
+    GET /api/cards/?page=1&limit=10&search=...
+    
+    Pagination par curseur (coût constant quelle que soit la page) :
+    GET /api/cards/?cursor=&limit=10 pour la première page, puis
+    GET /api/cards/?cursor=<next_cursor> avec la valeur renvoyée.
+    Le total est alors approximatif (mis en cache quelques secondes).
     """
     try:
         # Pagination
@@ -392,15 +387,41 @@ def list_cards(request):
         search = request.GET.get('search', '')
         
         # Tri safest: ID décroissant (toujours présent)
-        queryset = Stock.objects.all().order_by('-id')
+        # Membre, département et template chargés dans la même requête (pas de N+1)
+        queryset = Stock.objects.select_related(
+            'membre__departement', 'template_utilise'
+        ).order_by('-id')
 
         # Recherche
         if search:
-            queryset = queryset.filter(
-                membre__nom__icontains=search
-            ) | queryset.filter(
-                membre__prenom__icontains=search
-            )
+            queryset = search_members(queryset, search, prefix='membre__')
+        
+        # Pagination par curseur
+        cursor = request.GET.get('cursor')
+        if cursor is not None:
+            limit = max(1, min(limit, 100))
+            try:
+                data, next_cursor = keyset_page(queryset, cursor, limit)
+            except InvalidCursor as e:
+                return Response({
+                    'success': False,
+                    'message': str(e)
+                }, status=status.HTTP_400_BAD_REQUEST)
+            
+            serializer = StockSerializer(data, many=True, context={'request': request})
+            
+            return Response({
+                'success': True,
+                'cards': serializer.data,
+                'pagination': {
+                    'mode': 'cursor',
+                    'limit': limit,
+                    'next_cursor': next_cursor,
+                    'has_more': next_cursor is not None,
+                    'total': approximate_count(queryset, f'search:{search}' if search else None),
+                    'total_is_approximate': True
+                }
+            })
         
         # Pagination manuelle simple
         total = queryset.count()
@@ -437,7 +458,9 @@ def get_card(request, card_id):
     
     GET /api/cards/:id
     """
-    stock = get_object_or_404(Stock, id=card_id)
+    stock = get_object_or_404(
+        Stock.objects.select_related('membre__departement', 'template_utilise'), id=card_id
+    )
     serializer = StockSerializer(stock, context={'request': request})
     
     return Response({
@@ -446,6 +469,64 @@ def get_card(request, card_id):
     })
 
 
+def card_artefact(request, card_id, artefact):
+    """
+    Télécharger un fichier d'une carte, généré à la première demande.
+    
+    GET /api/cards/:id/(qr|recto|verso|pdf)?v=<version>
+    
+    Avec la version du contenu (URL renvoyée par l'API), la réponse est
+    cachée un an ; sans, elle est revalidée (ETag / Last-Modified, 304).
+    Les plages d'octets (Range) sont acceptées.
+    """
+    from django.http import Http404
+    
+    field = Stock.ARTEFACT_FIELDS.get(artefact)
+    if field is None:
+        raise Http404("Fichier inconnu")
+    stock = get_object_or_404(Stock, id=card_id)
+    try:
+        file = ensure_artefact(stock, field)
+    except TemplateUnavailable as e:
+        raise Http404(str(e))
+    
+    return serve_file(request, file, version=request.GET.get('v'))
+
+
+def thumbnail(request, source, pk, image, size, fmt):
+    """
+    Miniature d'une image de carte ou de template, générée à la première
+    demande puis gardée dans le stockage.
+    
+    GET /api/thumbnails/(card|template)/:id/(qr|recto|verso)/(xs|sm|md).(webp|jpg)?v=<version>
+    
+    Avec la version de l'image source (voir thumbnails.thumbnail_url), la
+    réponse est cachée un an.
+    """
+    from django.http import Http404
+    
+    field = SOURCE_IMAGES.get(source, {}).get(image)
+    if field is None or size not in THUMBNAIL_SIZES or fmt not in THUMBNAIL_FORMATS:
+        raise Http404("Miniature inconnue")
+    
+    if source == 'card':
+        stock = get_object_or_404(Stock, id=pk)
+        try:
+            source_file = ensure_artefact(stock, field)
+        except TemplateUnavailable as e:
+            raise Http404(str(e))
+    else:
+        source_file = getattr(get_object_or_404(CardTemplate, id=pk), field)
+        if not source_file:
+            raise Http404("Image non disponible")
+    
+    version = request.GET.get('v')
+    return serve_file(
+        request, get_thumbnail(source_file, size, fmt),
+        immutable=bool(version) and version == file_version(source_file)
+    )
+
+
 @api_view(['GET'])
 @authentication_classes([])
 @permission_classes([AllowAny])
@@ -559,10 +640,100 @@ def health_check(request):
     return Response({
         'success': True,
         'message': 'API CJP Card Generator is running',
-        'version': '1.0.0'
+        'version': '1.0.0',
+        'caches': assets.stats()
     })
 
 
+def metrics(request):
+    """
+    Durées des étapes de génération (histogrammes) et caches du rendu,
+    au format texte Prometheus. Les histogrammes additionnent ceux du
+    processus serveur qui répond et ceux exportés par le worker (lots
+    planifiés) ; les caches sont ceux du processus serveur.
+    
+    GET /api/metrics
+    """
+    caches = assets.stats()
+    text = prometheus_text({
+        'card_cache_requests_total': [
+            ({'cache': cache, 'result': result}, counts[key])
+            for cache, counts in sorted(caches.items())
+            for result, key in (('hit', 'hits'), ('miss', 'misses'))
+        ]
+    }, exported=exported_snapshots())
+    return HttpResponse(text, content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def _card_sheet_pages(queryset):
+    """
+    Produit le PDF de la grille de cartes (A4) au fil de l'eau.
+    Chaque ligne (recto, verso, légende) est envoyée dès qu'elle est écrite :
+    la mémoire utilisée ne dépend pas du nombre de cartes.
+    
+    Yields:
+        Morceaux du fichier PDF
+    """
+    from reportlab.lib.pagesizes import A4
+    from reportlab.lib.units import cm
+    
+    writer = StreamingPDFWriter(A4)
+    width, height = A4
+    
+    # Dimensions carte (Format CR80: 85.60 x 53.98 mm)
+    card_w = 8.56 * cm
+    card_h = 5.4 * cm
+    
+    # Marges et espacement
+    margin_x = 1.0 * cm
+    margin_y = 1.5 * cm
+    gap_x = 0.5 * cm  # Espace entre Recto et Verso
+    gap_y = 0.5 * cm  # Espace entre les lignes
+    
+    # Position initiale (Haut de page)
+    current_y = height - margin_y - card_h
+    
+    yield writer.flush()
+    
+    for stock in queryset.iterator(chunk_size=200):
+        try:
+            # Images de la carte (générées ici si elles ne l'ont pas encore été)
+            if stock.spec is None and not (
+                stock.carte_recto and stock.carte_verso
+                and os.path.exists(stock.carte_recto.path) and os.path.exists(stock.carte_verso.path)
+            ):
+                continue
+            
+            with ensure_artefact(stock, 'carte_recto').open('rb') as f:
+                recto = writer.add_image(f.read())
+            with ensure_artefact(stock, 'carte_verso').open('rb') as f:
+                verso = writer.add_image(f.read())
+            
+            # Dessiner Recto (Gauche) et Verso (Droite)
+            writer.draw_image(recto, margin_x, current_y, card_w, card_h)
+            writer.draw_image(verso, margin_x + card_w + gap_x, current_y, card_w, card_h)
+            
+            # Légende (Nom du membre sous la carte recto)
+            writer.draw_string(margin_x, current_y - 0.3 * cm, f"{stock.membre.prenom} {stock.membre.nom} (#{stock.id})")
+            
+            # Avancer position Y
+            current_y -= (card_h + gap_y + 0.5 * cm) # +0.5 pour la légende
+            
+            # Nouvelle page si plus de place (on peut mettre 4-5 cartes par page)
+            # Page height ~29.7cm. Card+Gap ~6.5cm. 29.7 / 6.5 = ~4.5
+            if current_y < margin_y:
+                writer.show_page()
+                current_y = height - margin_y - card_h
+        except Exception:
+            logger.exception("Erreur dessin carte %s", stock.id)
+            continue
+        
+        yield writer.flush()
+    
+    writer.close()
+    yield writer.flush()
+
+
 @api_view(['GET'])
 @authentication_classes([])
 @permission_classes([AllowAny])
@@ -571,31 +742,29 @@ def download_all_cards(request):
     Télécharger toutes les cartes dans un SEUL fichier PDF (Grille A4).
     Filtres optionnels par date: start_date, end_date (YYYY-MM-DD)
     
+    Le PDF est envoyé au fur et à mesure de sa construction (mémoire constante).
+    
     GET /api/cards/download-all?start_date=2024-01-01&end_date=2024-12-31
     """
-    import io
     from django.utils.dateparse import parse_date
     from datetime import datetime
-    from reportlab.pdfgen import canvas
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib.units import cm
     
     try:
         # Filtres de date
         start_date_str = request.GET.get('start_date')
         end_date_str = request.GET.get('end_date')
         
-        queryset = Stock.objects.all().order_by('id')
+        queryset = Stock.objects.select_related('membre').order_by('id')
         
         if start_date_str:
             start_date = parse_date(start_date_str)
             if start_date:
-                queryset = queryset.filter(date_creation__date__gte=start_date)
+                queryset = queryset.filter(date_generation__date__gte=start_date)
                 
         if end_date_str:
             end_date = parse_date(end_date_str)
             if end_date:
-                queryset = queryset.filter(date_creation__date__lte=end_date)
+                queryset = queryset.filter(date_generation__date__lte=end_date)
         
         # Vérifier s'il y a des cartes
         if not queryset.exists():
@@ -603,65 +772,15 @@ def download_all_cards(request):
                 'success': False,
                 'message': 'Aucune carte trouvée pour cette période.'
             }, status=status.HTTP_404_NOT_FOUND)
-            
-        # Créer le PDF en mémoire
-        buffer = io.BytesIO()
-        c = canvas.Canvas(buffer, pagesize=A4)
-        width, height = A4
-        
-        # Dimensions carte (Format CR80: 85.60 x 53.98 mm)
-        card_w = 8.56 * cm
-        card_h = 5.4 * cm
-        
-        # Marges et espacement
-        margin_x = 1.0 * cm
-        margin_y = 1.5 * cm
-        gap_x = 0.5 * cm  # Espace entre Recto et Verso
-        gap_y = 0.5 * cm  # Espace entre les lignes
-        
-        # Position initiale (Haut de page)
-        current_y = height - margin_y - card_h
-        cards_on_page = 0
         
-        count = 0
-        for stock in queryset:
-            try:
-                # Vérifier les images
-                if stock.carte_recto and stock.carte_verso:
-                    recto_path = stock.carte_recto.path
-                    verso_path = stock.carte_verso.path
-                    
-                    if os.path.exists(recto_path) and os.path.exists(verso_path):
-                        # Dessiner Recto (Gauche)
-                        c.drawImage(recto_path, margin_x, current_y, width=card_w, height=card_h, preserveAspectRatio=True)
-                        
-                        # Dessiner Verso (Droite)
-                        c.drawImage(verso_path, margin_x + card_w + gap_x, current_y, width=card_w, height=card_h, preserveAspectRatio=True)
-                        
-                        # Légende (Nom du membre sous la carte recto)
-                        c.setFont("Helvetica", 8)
-                        c.drawString(margin_x, current_y - 0.3 * cm, f"{stock.membre.prenom} {stock.membre.nom} (#{stock.id})")
-                        
-                        count += 1
-                        cards_on_page += 1
-                        
-                        # Avancer position Y
-                        current_y -= (card_h + gap_y + 0.5 * cm) # +0.5 pour la légende
-                        
-                        # Nouvelle page si plus de place (on peut mettre 4-5 cartes par page)
-                        # Page height ~29.7cm. Card+Gap ~6.5cm. 29.7 / 6.5 = ~4.5
-                        if current_y < margin_y:
-                            c.showPage()
-                            current_y = height - margin_y - card_h
-                            cards_on_page = 0
-            except Exception as e:
-                print(f"Erreur dessin carte {stock.id}: {e}")
-                continue
-        
-        c.save()
-        buffer.seek(0)
-        
-        if count == 0:
+        # Vérifier qu'au moins une carte est sur le disque (ou peut être rendue)
+        # avant de commencer l'envoi
+        has_images = queryset.filter(spec__isnull=False).exists() or any(
+            stock.carte_recto and stock.carte_verso
+            and os.path.exists(stock.carte_recto.path) and os.path.exists(stock.carte_verso.path)
+            for stock in queryset.select_related(None).only('id', 'carte_recto', 'carte_verso').iterator(chunk_size=200)
+        )
+        if not has_images:
              return Response({
                 'success': False,
                 'message': 'Aucune image de carte trouvée sur le disque.'
@@ -671,7 +790,8 @@ def download_all_cards(request):
         date_str = datetime.now().strftime('%Y-%m-%d')
         filename = f"toutes_les_cartes_{date_str}.pdf"
         
-        response = FileResponse(buffer, as_attachment=True, filename=filename)
+        response = StreamingHttpResponse(_card_sheet_pages(queryset), content_type='application/pdf')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
         return response
         
     except Exception as e:
@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class CryptageConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cryptage'
+
+    def ready(self):
+        # Compteurs de statistiques du dashboard
+        from cryptage import signals  # noqa: F401
+
+        # Images des PDF en binaire (FlateDecode seul) : l'encodage ASCII85 de
+        # ReportLab, en Python pur, coûtait plus que tout le reste du rendu des
+        # cartes et grossissait les fichiers. C'est un réglage global de
+        # ReportLab : il s'applique à tous les PDF générés par le projet.
+        from reportlab import rl_config
+        rl_config.useA85 = 0
@@ -0,0 +1,226 @@
+"""
+Import de membres par lots.
+
+Au lieu d'un get_or_create par entrée (département puis membre, chacun dans
+sa propre transaction), les départements et les emails déjà connus sont
+résolus en une requête chacun et les manquants sont créés avec bulk_create.
+Le nombre d'allers-retours vers la base ne dépend plus de la taille du lot.
+
+Un INSERT groupé échoue en entier si une seule ligne est refusée : les
+longueurs des champs sont donc vérifiées avant, et import_each permet de
+reprendre un lot refusé entrée par entrée pour isoler l'erreur.
+"""
+import traceback
+
+from django.db import transaction
+
+from cryptage import stats
+
+
+# Département attribué aux membres qui n'en précisent pas
+DEFAULT_DEPARTEMENT = 'Non spécifié'
+
+# Taille des INSERT groupés
+BATCH_SIZE = 500
+
+
+def resolve_departements(names):
+    """
+    Récupère ou crée les départements d'un lot.
+
+    Args:
+        names: Noms de départements (doublons autorisés)
+
+    Returns:
+        dict {nom: Departement}
+    """
+    from cryptage.models import Departement
+
+    names = set(names)
+    found = {}
+    # Le nom n'est pas unique : garder le plus ancien, comme get_or_create le ferait
+    for departement in Departement.objects.filter(nom_depart__in=names).order_by('-id'):
+        found[departement.nom_depart] = departement
+
+    missing = [Departement(nom_depart=name) for name in names if name not in found]
+    if missing:
+        with transaction.atomic():
+            Departement.objects.bulk_create(missing, batch_size=BATCH_SIZE)
+            # bulk_create ne déclenche pas les signaux
+            stats.increment(stats.DEPARTEMENTS, len(missing))
+        if any(departement.pk is None for departement in missing):
+            # Base qui ne renvoie pas les identifiants insérés
+            return resolve_departements(names)
+        found.update((departement.nom_depart, departement) for departement in missing)
+    return found
+
+
+# Champs de Membres renseignés par l'import : (champ, clé dans les données)
+MEMBER_FIELDS = (
+    ('prenom', 'first_name'),
+    ('nom', 'last_name'),
+    ('telephone', 'phone'),
+    ('profession', 'profession'),
+)
+
+
+def field_limits():
+    """
+    Returns:
+        dict {clé dans les données: longueur maximale de la colonne}
+    """
+    from cryptage.models import Departement, Membres
+
+    limits = {key: Membres._meta.get_field(field).max_length for field, key in MEMBER_FIELDS}
+    limits['email'] = Membres._meta.get_field('email').max_length
+    limits['department'] = Departement._meta.get_field('nom_depart').max_length
+    return limits
+
+
+def import_members(members_data, update=False):
+    """
+    Récupère ou crée les membres d'un lot à partir de leurs données.
+    Un membre existant (même email) est gardé tel quel, sauf avec update.
+
+    Args:
+        members_data: Liste de dicts (email, first_name, last_name, phone,
+            profession, department)
+        update: Mettre à jour les membres existants avec les données fournies
+
+    Returns:
+        (membres, erreurs) : membres est une liste de (index, membre) avec
+        leur departement chargé, erreurs une liste de (index, message)
+    """
+    from cryptage.models import Membres
+
+    limits = field_limits()
+    errors = []
+    valid = []
+    for index, member_data in enumerate(members_data):
+        too_long = [
+            (key, limit) for key, limit in limits.items() if len(str(member_data.get(key) or '')) > limit
+        ]
+        if not member_data.get('email'):
+            errors.append((index, "L'email est obligatoire"))
+        elif too_long:
+            key, limit = too_long[0]
+            errors.append((index, f"{key} : {limit} caractères au maximum"))
+        else:
+            valid.append((index, member_data))
+
+    if not valid:
+        return [], errors
+
+    departements = resolve_departements(
+        member_data.get('department', DEFAULT_DEPARTEMENT) for _, member_data in valid
+    )
+
+    emails = {member_data['email'] for _, member_data in valid}
+    existing = {
+        membre.email: membre
+        for membre in Membres.objects.select_related('departement').filter(email__in=emails)
+    }
+
+    to_create = {}
+    for _, member_data in valid:
+        email = member_data['email']
+        if email in existing or email in to_create:
+            continue
+        to_create[email] = Membres(
+            email=email,
+            departement=departements[member_data.get('department', DEFAULT_DEPARTEMENT)],
+            **{field: member_data.get(key, '') for field, key in MEMBER_FIELDS}
+        )
+
+    if update:
+        _update_members(existing, valid, departements)
+
+    if to_create:
+        with transaction.atomic():
+            # Membres créés entre-temps par une autre requête : ignorés puis relus
+            Membres.objects.bulk_create(to_create.values(), batch_size=BATCH_SIZE, ignore_conflicts=True)
+            # ignore_conflicts ne renvoie pas les identifiants : relire les membres créés
+            created = {
+                membre.email: membre
+                for membre in Membres.objects.select_related('departement').filter(email__in=to_create.keys())
+            }
+
+            # bulk_create ne déclenche pas les signaux (un membre créé en même
+            # temps par une autre requête est compté deux fois : reconcile_stats corrige)
+            deltas = {stats.MEMBRES: len(created)}
+            for membre in created.values():
+                key = stats.departement_key(membre.departement_id)
+                deltas[key] = deltas.get(key, 0) + 1
+            stats.increment_many(deltas)
+        existing.update(created)
+
+    membres = []
+    for index, member_data in valid:
+        membre = existing.get(member_data['email'])
+        if membre is None:
+            errors.append((index, "Le membre n'a pas pu être créé"))
+        else:
+            membres.append((index, membre))
+    return membres, errors
+
+
+def import_each(members_data, update=False):
+    """
+    Importe les entrées une à une, après l'échec d'un lot entier : seules
+    les entrées refusées par la base sont en erreur.
+
+    Returns:
+        (membres, erreurs) comme import_members
+    """
+    membres = []
+    errors = []
+    for index, member_data in enumerate(members_data):
+        try:
+            imported, import_errors = import_members([member_data], update=update)
+        except Exception as e:
+            traceback.print_exc()
+            errors.append((index, str(e)))
+            continue
+        membres += [(index, membre) for _, membre in imported]
+        errors += [(index, error) for _, error in import_errors]
+    return membres, errors
+
+
+def _update_members(existing, valid, departements):
+    """
+    Met à jour les membres existants dont les données ont changé (un UPDATE groupé).
+
+    Args:
+        existing: dict {email: Membres} des membres déjà en base
+        valid: Liste de (index, données) du lot
+        departements: dict {nom: Departement}
+    """
+    from cryptage.models import Membres
+
+    changed = {}
+    deltas = {}
+    for _, member_data in valid:
+        membre = existing.get(member_data['email'])
+        if membre is None:
+            continue
+        departement = departements[member_data.get('department', DEFAULT_DEPARTEMENT)]
+        values = {field: member_data[key] for field, key in MEMBER_FIELDS if key in member_data}
+        if membre.departement_id != departement.pk:
+            # bulk_update ne déclenche pas les signaux
+            for key, delta in ((stats.departement_key(membre.departement_id), -1),
+                               (stats.departement_key(departement.pk), 1)):
+                deltas[key] = deltas.get(key, 0) + delta
+            membre.departement = departement
+            changed[membre.email] = membre
+        for field, value in values.items():
+            if getattr(membre, field) != value:
+                setattr(membre, field, value)
+                changed[membre.email] = membre
+
+    if changed:
+        with transaction.atomic():
+            Membres.objects.bulk_update(
+                changed.values(), [field for field, _ in MEMBER_FIELDS] + ['departement'],
+                batch_size=BATCH_SIZE
+            )
+            stats.increment_many(deltas)
@@ -4,9 +4,201 @@ from io import BytesIO
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 from reportlab.lib.utils import ImageReader
+from collections import OrderedDict
+import hashlib
+import numpy as np
 import os
+import threading
 from django.conf import settings
 
+from cryptage.metrics import timed
+
+
+# Version du rendu des cartes : à incrémenter dès que l'apparence des cartes
+# générées change, pour que les empreintes de rendu existantes ne soient plus
+# considérées comme à jour (voir CardGenerator.render_fingerprint)
+GENERATOR_VERSION = '3'
+
+
+class TemplateImageCache:
+    """
+    Cache LRU des images de templates, décodées et déjà redimensionnées.
+    
+    Tous les membres d'un lot utilisent le même template : chaque rendu part
+    d'une copie de l'image en mémoire au lieu de relire et redimensionner le
+    PNG sur le disque. La clé contient la date de modification et la taille du
+    fichier, un fichier remplacé n'est donc jamais servi depuis le cache.
+    """
+    
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, template, side, size):
+        """
+        Récupère l'image d'une face du template à la taille demandée.
+        L'image renvoyée est partagée : la copier avant de dessiner dessus.
+        
+        Args:
+            template: Instance du modèle CardTemplate
+            side: 'recto' ou 'verso'
+            size: Tuple (largeur, hauteur) de la carte
+            
+        Returns:
+            Image PIL en RGB
+        """
+        path = getattr(template, f'template_{side}').path
+        stat = os.stat(path)
+        key = (template.pk, side, path, stat.st_mtime_ns, stat.st_size, size)
+        
+        with self._lock:
+            image = self._entries.get(key)
+            if image is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return image
+            self.misses += 1
+        
+        image = Image.open(path).convert('RGB')
+        if image.size != size:
+            image = image.resize(size, Image.Resampling.LANCZOS)
+        
+        with self._lock:
+            # Une seule version par face de template : oublier les anciennes
+            for old_key in [k for k in self._entries if k[:2] == key[:2]]:
+                del self._entries[old_key]
+            self._entries[key] = image
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return image
+    
+    def invalidate(self, template_id=None):
+        """
+        Vide le cache d'un template, ou le cache entier si template_id est None.
+        """
+        with self._lock:
+            if template_id is None:
+                self._entries.clear()
+                return
+            for key in [k for k in self._entries if k[0] == template_id]:
+                del self._entries[key]
+
+
+# Cache partagé par tous les générateurs du processus
+template_cache = TemplateImageCache()
+
+
+def render_qr_matrix(modules, box_size, border):
+    """
+    Dessine une matrice de QR code en une seule opération NumPy.
+    
+    Donne exactement les mêmes pixels que qrcode.make_image(fill_color="black")
+    (modules noirs sur fond blanc), sans dessiner les modules un par un.
+    
+    Args:
+        modules: Matrice de booléens sans bordure (QRCode.modules)
+        box_size: Côté d'un module en pixels
+        border: Largeur de la bordure blanche en modules
+        
+    Returns:
+        Image PIL en niveaux de gris ('L'), noir = 0, blanc = 255
+    """
+    matrix = np.pad(np.asarray(modules, dtype=bool), border, constant_values=False)
+    pixels = np.where(matrix, np.uint8(0), np.uint8(255))
+    pixels = np.ascontiguousarray(pixels.repeat(box_size, axis=0).repeat(box_size, axis=1))
+    
+    height, width = pixels.shape
+    # frombuffer partage la mémoire du tableau au lieu de la copier
+    return Image.frombuffer('L', (width, height), pixels, 'raw', 'L', 0, 1)
+
+
+class AssetRegistry:
+    """
+    Ressources communes à toutes les cartes, chargées une seule fois par processus :
+    le logo du QR code (par taille) avec son fond noir, et les polices (par taille).
+    
+    Les compteurs hits/misses permettent de vérifier en production que les
+    rendus passent bien par le cache (voir stats()).
+    """
+    
+    def __init__(self):
+        self._logos = {}
+        self._fonts = {}
+        self._lock = threading.Lock()
+        self.hits = {'logo': 0, 'font': 0}
+        self.misses = {'logo': 0, 'font': 0}
+    
+    def logo(self, path, size):
+        """
+        Récupère le logo redimensionné et son fond noir.
+        
+        Args:
+            path: Chemin du logo
+            size: Côté du logo en pixels
+            
+        Returns:
+            (logo RGBA, fond noir RGB), ou None si le logo est introuvable
+        """
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        
+        key = (path, mtime, size)
+        with self._lock:
+            cached = self._logos.get(key)
+            if cached is not None:
+                self.hits['logo'] += 1
+                return cached
+            self.misses['logo'] += 1
+        
+        logo = Image.open(path).convert('RGBA')
+        logo = logo.resize((size, size), Image.Resampling.LANCZOS)
+        logo_bg = Image.new('RGB', (size, size), 'black')
+        
+        with self._lock:
+            self._logos[key] = (logo, logo_bg)
+        return logo, logo_bg
+    
+    def font(self, face, size):
+        """
+        Récupère une police TrueType, ou la police par défaut si elle est absente.
+        L'échec de chargement est lui aussi mémorisé.
+        """
+        key = (face, size)
+        with self._lock:
+            font = self._fonts.get(key)
+            if font is not None:
+                self.hits['font'] += 1
+                return font
+            self.misses['font'] += 1
+        
+        try:
+            font = ImageFont.truetype(face, size)
+        except Exception:
+            font = ImageFont.load_default()
+        
+        with self._lock:
+            self._fonts[key] = font
+        return font
+    
+    def stats(self):
+        """Compteurs de succès / échecs des caches de ressources du processus."""
+        with self._lock:
+            stats = {
+                kind: {'hits': self.hits[kind], 'misses': self.misses[kind]}
+                for kind in self.hits
+            }
+        stats['template'] = {'hits': template_cache.hits, 'misses': template_cache.misses}
+        return stats
+
+
+# Registre partagé par tous les générateurs du processus
+assets = AssetRegistry()
+
 
 class CardGenerator:
     """
@@ -18,38 +210,37 @@ class CardGenerator:
     CARD_WIDTH = 1011  # 85.6mm à 300 DPI
     CARD_HEIGHT = 638  # 53.98mm à 300 DPI
     
-    def __init__(self, membre, template=None):
+    def __init__(self, membre, template=None, use_active_template=True):
         """
         Initialise le générateur de carte.
         
         Args:
             membre: Instance du modèle Membres
             template: Instance du modèle CardTemplate (optionnel)
+            use_active_template: Sans template, utiliser le template actif
+                (False : faces par défaut)
         """
         self.membre = membre
         
         # Si aucun template n'est fourni, utiliser le template actif
-        if template is None:
+        if template is None and use_active_template:
             from cryptage.models import CardTemplate
             template = CardTemplate.get_active_template()
         
         self.template = template
+        self._qr = None
         self.qr_code_image = None
         self.carte_recto_image = None
         self.carte_verso_image = None
         
-    def generate_qr_code(self, logo_path='static/images/log7.png'):
+    def qr_payload(self):
         """
-        Génère un QR code avec le logo du club intégré.
+        Données encodées dans le QR code du membre.
         
-        Args:
-            logo_path: Chemin vers le logo à intégrer
-            
         Returns:
-            Image PIL du QR code
+            Texte du QR code
         """
-        # Données à encoder dans le QR code
-        data = (
+        return (
             f"***CLUB DES JEUNES PROGRAMMEURS***\n"
             f"Nom: {self.membre.nom}\n"
             f"Prénom: {self.membre.prenom}\n"
@@ -59,37 +250,89 @@ class CardGenerator:
             f"Profession: {self.membre.profession}\n"
             f"https://club-jp.com"
         )
+    
+    def render_fingerprint(self):
+        """
+        Empreinte de tout ce qui détermine l'apparence de la carte : données du
+        QR code, contenu de la photo, fichiers du template et version du
+        générateur. Deux rendus de même empreinte produisent la même carte.
         
-        # Créer le QR code
-        qr = qrcode.QRCode(
-            version=1,
-            error_correction=qrcode.constants.ERROR_CORRECT_H,  # Haute correction pour supporter le logo
-            box_size=10,  # <<-- REMIS A 10 (haute résolution pour être net en réduction)
-            border=1,
-        )
-        qr.add_data(data)
-        qr.make(fit=True)
+        Returns:
+            Empreinte SHA-256 en hexadécimal
+        """
+        digest = hashlib.sha256()
+        digest.update(f"v{GENERATOR_VERSION}\n".encode())
+        digest.update(self.qr_payload().encode())
         
-        # Générer l'image du QR code
-        qr_img = qr.make_image(fill_color="black").convert('RGB')
+        # Photo : son contenu (un fichier remplacé sous le même nom change l'empreinte)
+        if self.membre.photo:
+            digest.update(f"\nphoto:{self.membre.photo.name}\n".encode())
+            try:
+                with self.membre.photo.open('rb') as photo:
+                    for block in iter(lambda: photo.read(1 << 16), b''):
+                        digest.update(block)
+            except (OSError, ValueError):
+                pass
+        
+        # Template : fichiers et date de modification
+        if self.template:
+            digest.update(f"\ntemplate:{self.template.pk}".encode())
+            for field in (self.template.template_recto, self.template.template_verso):
+                digest.update(f"\n{field.name}".encode())
+                try:
+                    stat = os.stat(field.path)
+                    digest.update(f":{stat.st_mtime_ns}:{stat.st_size}".encode())
+                except (OSError, ValueError):
+                    pass
+        else:
+            digest.update(b"\ntemplate:defaut")
         
-        # Intégrer le logo si disponible
+        return digest.hexdigest()
+    
+    def _get_qr(self):
+        """
+        Construit la matrice du QR code (une seule fois par générateur).
+        
+        Returns:
+            Objet qrcode.QRCode prêt à être dessiné
+        """
+        if self._qr is None:
+            with timed('qr_build'):
+                qr = qrcode.QRCode(
+                    version=1,
+                    error_correction=qrcode.constants.ERROR_CORRECT_H,  # Haute correction pour supporter le logo
+                    box_size=10,  # <<-- REMIS A 10 (haute résolution pour être net en réduction)
+                    border=1,
+                )
+                qr.add_data(self.qr_payload())
+                qr.make(fit=True)
+                self._qr = qr
+        return self._qr
+    
+    @timed('logo_overlay')
+    def _add_logo(self, qr_img, logo_path):
+        """
+        Intègre le logo au centre du QR code (en place).
+        
+        Args:
+            qr_img: Image PIL RGB du QR code
+            logo_path: Chemin vers le logo à intégrer
+        """
         # Construction du chemin absolu pour le logo par défaut
         if logo_path == 'static/images/log7.png':
             logo_path = os.path.join(settings.BASE_DIR, 'static', 'images', 'log7.png')
             
-        if os.path.exists(logo_path):
-            try:
-                logo = Image.open(logo_path).convert('RGBA')
-                
-                # Redimensionner le logo (environ 25% de la taille du QR code pour être plus visible)
-                qr_width, qr_height = qr_img.size
-                logo_size = min(qr_width, qr_height) // 4  # Ajusté à 25%
-                logo = logo.resize((logo_size, logo_size), Image.Resampling.LANCZOS)
-                
-                # Créer un fond blanc pour le logo (pour qu'il ne se mélange pas au QR code)
-                # On fait un cercle blanc ou carré blanc derrière
-                logo_bg = Image.new('RGB', (logo_size, logo_size), 'black') # <<-- CHANGÉ EN NOIR
+        try:
+            # Redimensionner le logo (environ 25% de la taille du QR code pour être plus visible)
+            qr_width, qr_height = qr_img.size
+            logo_size = min(qr_width, qr_height) // 4  # Ajusté à 25%
+            
+            # Logo redimensionné et fond noir (pour qu'il ne se mélange pas au QR code),
+            # chargés une seule fois par taille
+            logo_assets = assets.logo(logo_path, logo_size)
+            
+            if logo_assets is not None:
+                logo, logo_bg = logo_assets
                 
                 # Positionner le logo au centre
                 logo_pos = ((qr_width - logo_size) // 2, (qr_height - logo_size) // 2)
@@ -99,15 +342,64 @@ class CardGenerator:
                 
                 # Coller le logo PAR DESSUS avec son masque de transparence (s'il en a un)
                 qr_img.paste(logo, logo_pos, mask=logo)
+            else:
+                print(f"Logo introuvable au chemin: {logo_path}")
                 
-            except Exception as e:
-                print(f"Erreur lors de l'intégration du logo: {e}")
-        else:
-            print(f"Logo introuvable au chemin: {logo_path}")
+        except Exception as e:
+            print(f"Erreur lors de l'intégration du logo: {e}")
+    
+    @timed('qr_image')
+    def generate_qr_code(self, logo_path='static/images/log7.png'):
+        """
+        Génère un QR code avec le logo du club intégré.
+        
+        Args:
+            logo_path: Chemin vers le logo à intégrer
+            
+        Returns:
+            Image PIL du QR code
+        """
+        # Générer l'image du QR code (dessin vectorisé, identique à qr.make_image)
+        qr = self._get_qr()
+        qr_img = render_qr_matrix(qr.modules, qr.box_size, qr.border).convert('RGB')
+        
+        # Intégrer le logo si disponible
+        self._add_logo(qr_img, logo_path)
         
         self.qr_code_image = qr_img
         return qr_img
     
+    def generate_qr_image(self, size, logo_path='static/images/log7.png'):
+        """
+        Génère le QR code directement à la taille voulue, sans passer par
+        l'image haute résolution : chaque module fait exactement le même
+        nombre entier de pixels (bords nets, modules réguliers), le reste de
+        la taille devient une marge blanche, puis le logo est collé à cette taille.
+        
+        Args:
+            size: Côté de l'image en pixels
+            logo_path: Chemin vers le logo à intégrer
+            
+        Returns:
+            Image PIL RGB de size x size pixels
+        """
+        qr = self._get_qr()
+        modules = len(qr.modules) + 2 * qr.border
+        box_size = size // modules
+        if box_size:
+            matrix = render_qr_matrix(qr.modules, box_size, qr.border)
+            qr_img = Image.new('L', (size, size), 255)
+            offset = (size - matrix.width) // 2
+            qr_img.paste(matrix, (offset, offset))
+        else:
+            # Image plus petite que la matrice : réduction au plus proche voisin
+            qr_img = render_qr_matrix(qr.modules, 1, qr.border).resize((size, size), Image.Resampling.NEAREST)
+        qr_img = qr_img.convert('RGB')
+        
+        self._add_logo(qr_img, logo_path)
+        return qr_img
+    
+    @timed('recto')
     def generate_card_front(self):
         """
         Génère la face avant de la carte avec les informations du membre.
@@ -118,13 +410,10 @@ class CardGenerator:
         # Utiliser le template si disponible, sinon créer une carte par défaut
         if self.template and self.template.template_recto:
             try:
-                # Charger le template
-                template_path = self.template.template_recto.path
-                card = Image.open(template_path).convert('RGB')
-                
-                # Redimensionner si nécessaire
-                if card.size != (self.CARD_WIDTH, self.CARD_HEIGHT):
-                    card = card.resize((self.CARD_WIDTH, self.CARD_HEIGHT), Image.Resampling.LANCZOS)
+                # Charger le template (déjà décodé et redimensionné si en cache)
+                card = template_cache.get(
+                    self.template, 'recto', (self.CARD_WIDTH, self.CARD_HEIGHT)
+                ).copy()
             except Exception as e:
                 print(f"Erreur lors du chargement du template recto: {e}")
                 card = self._create_default_front()
@@ -134,40 +423,14 @@ class CardGenerator:
         # Ajouter les informations du membre sur la carte
         draw = ImageDraw.Draw(card)
         
-        # Charger les polices (utiliser des polices par défaut si nécessaire)
-        try:
-            font_large = ImageFont.truetype("arial.ttf", 45)
-            font_medium = ImageFont.truetype("arial.ttf", 32)
-            font_small = ImageFont.truetype("arial.ttf", 24)
-        except:
-            font_large = ImageFont.load_default()
-            font_medium = ImageFont.load_default()
-            font_small = ImageFont.load_default()
+        # Charger les polices (police par défaut si nécessaire, une seule fois par processus)
+        font_large = assets.font("arial.ttf", 45)
+        font_medium = assets.font("arial.ttf", 32)
+        font_small = assets.font("arial.ttf", 24)
         
         # Ajouter la photo du membre si disponible
         if self.membre.photo:
-            try:
-                photo = Image.open(self.membre.photo.path).convert('RGB')
-                # Redimensionner la photo (cercle de 150px de diamètre)
-                photo_size = 150
-                photo = photo.resize((photo_size, photo_size), Image.Resampling.LANCZOS)
-                
-                # Créer un masque circulaire
-                mask = Image.new('L', (photo_size, photo_size), 0)
-                mask_draw = ImageDraw.Draw(mask)
-                mask_draw.ellipse((0, 0, photo_size, photo_size), fill=255)
-                
-                # Appliquer le masque
-                output = Image.new('RGB', (photo_size, photo_size), (255, 255, 255))
-                output.paste(photo, (0, 0))
-                output.putalpha(mask)
-                
-                # Positionner la photo (coin supérieur gauche)
-                photo_x = 50
-                photo_y = 50
-                card.paste(output, (photo_x, photo_y), output)
-            except Exception as e:
-                print(f"Erreur lors de l'ajout de la photo: {e}")
+            self._add_photo(card)
         
         
         # Positionner le nom et prénom (À DROITE de la photo et de la zone orange)
@@ -184,13 +447,11 @@ class CardGenerator:
         # draw.text((name_x, dept_y), str(self.membre.departement), fill=text_color, font=font_small)
         
         # Ajouter le QR Code sur le recto
-        # Générer le QR code si ce n'est pas déjà fait
-        if self.qr_code_image is None:
-            self.generate_qr_code()
-
         # Dimensions du QR code (ajusté pour le recto)
         qr_size = 200  # <<-- Taille mise à jour à 200px
-        qr_resized = self.qr_code_image.resize((qr_size, qr_size), Image.Resampling.LANCZOS)
+        
+        # Dessiné directement à 200px (pas de réduction de l'image haute résolution)
+        qr_resized = self.generate_qr_image(qr_size)
         
         # Position du QR (Centré verticalement à droite)
         qr_x = self.CARD_WIDTH - qr_size - 80  # Marge augmentée pour bien centrer
@@ -203,6 +464,37 @@ class CardGenerator:
         self.carte_recto_image = card
         return card
     
+    @timed('photo_mask')
+    def _add_photo(self, card):
+        """
+        Colle la photo du membre, découpée en cercle, en haut à gauche de la carte (en place).
+        
+        Args:
+            card: Image PIL de la face avant
+        """
+        try:
+            photo = Image.open(self.membre.photo.path).convert('RGB')
+            # Redimensionner la photo (cercle de 150px de diamètre)
+            photo_size = 150
+            photo = photo.resize((photo_size, photo_size), Image.Resampling.LANCZOS)
+            
+            # Créer un masque circulaire
+            mask = Image.new('L', (photo_size, photo_size), 0)
+            mask_draw = ImageDraw.Draw(mask)
+            mask_draw.ellipse((0, 0, photo_size, photo_size), fill=255)
+            
+            # Appliquer le masque
+            output = Image.new('RGB', (photo_size, photo_size), (255, 255, 255))
+            output.paste(photo, (0, 0))
+            output.putalpha(mask)
+            
+            # Positionner la photo (coin supérieur gauche)
+            photo_x = 50
+            photo_y = 50
+            card.paste(output, (photo_x, photo_y), output)
+        except Exception as e:
+            print(f"Erreur lors de l'ajout de la photo: {e}")
+    
     def _create_default_front(self):
         """
         Crée une carte avant par défaut si aucun template n'est disponible.
@@ -218,12 +510,8 @@ class CardGenerator:
         draw.rectangle([(50, 50), (self.CARD_WIDTH - 50, 200)], fill=(218, 165, 32))
         
         # Ajouter du texte
-        try:
-            font_title = ImageFont.truetype("arial.ttf", 50)
-            font_text = ImageFont.truetype("arial.ttf", 30)
-        except:
-            font_title = ImageFont.load_default()
-            font_text = ImageFont.load_default()
+        font_title = assets.font("arial.ttf", 50)
+        font_text = assets.font("arial.ttf", 30)
         
         draw.text((100, 80), "CARTE MEMBRE", fill=(0, 0, 0), font=font_title)
         draw.text((100, 250), f"{self.membre.prenom} {self.membre.nom}", fill=(255, 255, 255), font=font_text)
@@ -231,6 +519,7 @@ class CardGenerator:
         
         return card
     
+    @timed('verso')
     def generate_card_back(self):
         """
         Génère la face arrière de la carte (Image simple ou template verso).
@@ -242,13 +531,10 @@ class CardGenerator:
         # Utiliser le template si disponible, sinon créer une carte par défaut
         if self.template and self.template.template_verso:
             try:
-                # Charger le template
-                template_path = self.template.template_verso.path
-                card = Image.open(template_path).convert('RGB')
-                
-                # Redimensionner si nécessaire
-                if card.size != (self.CARD_WIDTH, self.CARD_HEIGHT):
-                    card = card.resize((self.CARD_WIDTH, self.CARD_HEIGHT), Image.Resampling.LANCZOS)
+                # Charger le template (déjà décodé et redimensionné si en cache)
+                card = template_cache.get(
+                    self.template, 'verso', (self.CARD_WIDTH, self.CARD_HEIGHT)
+                ).copy()
             except Exception as e:
                 print(f"Erreur lors du chargement du template verso: {e}")
                 card = self._create_default_back()
@@ -270,16 +556,14 @@ class CardGenerator:
         draw = ImageDraw.Draw(card)
         
         # Ajouter un titre
-        try:
-            font_title = ImageFont.truetype("arial.ttf", 40)
-        except:
-            font_title = ImageFont.load_default()
+        font_title = assets.font("arial.ttf", 40)
         
         draw.text((self.CARD_WIDTH // 2 - 250, 30), "CLUB DES JEUNES PROGRAMMEURS", 
                   fill=(30, 30, 30), font=font_title)
         
         return card
     
+    @timed('pdf_build')
     def generate_pdf(self, output_path=None):
         """
         Génère un PDF contenant le recto et le verso de la carte.
@@ -303,16 +587,10 @@ class CardGenerator:
         c = canvas.Canvas(buffer, pagesize=letter)
         width, height = letter
         
-        # Convertir les images PIL en format utilisable par ReportLab
-        recto_buffer = BytesIO()
-        self.carte_recto_image.save(recto_buffer, format='PNG')
-        recto_buffer.seek(0)
-        recto_img = ImageReader(recto_buffer)
-        
-        verso_buffer = BytesIO()
-        self.carte_verso_image.save(verso_buffer, format='PNG')
-        verso_buffer.seek(0)
-        verso_img = ImageReader(verso_buffer)
+        # ReportLab lit directement les pixels des images PIL :
+        # pas d'encodage PNG intermédiaire, décodé aussitôt
+        recto_img = ImageReader(self.carte_recto_image)
+        verso_img = ImageReader(self.carte_verso_image)
         
         # Calculer les dimensions pour centrer les cartes
         # Format Carte de Crédit standard: 85.6mm x 53.98mm
@@ -364,19 +642,3 @@ class CardGenerator:
             buffer.seek(0)
         
         return buffer
-    
-    def save_to_bytes(self, image, format='PNG'):
-        """
-        Convertit une image PIL en BytesIO.
-        
-        Args:
-            image: Image PIL
-            format: Format de l'image (PNG, JPEG, etc.)
-            
-        Returns:
-            BytesIO contenant l'image
-        """
-        buffer = BytesIO()
-        image.save(buffer, format=format)
-        buffer.seek(0)
-        return buffer
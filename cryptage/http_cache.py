@@ -0,0 +1,179 @@
+"""
+Envoi des fichiers des cartes en HTTP : validation (ETag, Last-Modified),
+requêtes partielles (Range) et mise en cache longue durée.
+
+Les URL des fichiers (Stock.artefact_url) portent une version tirée du nom,
+de la taille et de la date de modification du fichier (?v=...) : une URL
+versionnée désigne toujours les mêmes octets, les navigateurs et le CDN
+peuvent la garder un an sans revalider. Un fichier régénéré ou ré-encodé
+change de version, donc d'URL.
+"""
+import hashlib
+import mimetypes
+import os
+
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, quote_etag
+
+
+# Durée de cache d'une URL versionnée (secondes)
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+# Nombre de caractères de la version gardés dans les URL
+VERSION_LENGTH = 16
+
+CHUNK_SIZE = 64 * 1024
+
+
+class RangeNotSatisfiable(Exception):
+    """Plage demandée entièrement hors du fichier (réponse 416)."""
+
+
+def file_info(field_file):
+    """
+    Version, taille et date de modification d'un fichier (FieldFile, ou tout
+    objet avec storage et name).
+    La version est tirée du nom, de la taille et de la date de modification,
+    sans relire le contenu : régénération et ré-encodage enregistrent un
+    nouveau fichier, un fichier remplacé sous le même nom change de date.
+
+    Returns:
+        (version hexadécimale, taille, datetime de modification)
+
+    Raises:
+        OSError: fichier absent du stockage
+    """
+    storage, name = field_file.storage, field_file.name
+    size = storage.size(name)
+    modified = storage.get_modified_time(name)
+    digest = hashlib.sha256(f'{name}:{size}:{modified.timestamp()}'.encode()).hexdigest()
+    return digest, size, modified
+
+
+def file_version(field_file):
+    """Version du fichier pour son URL, ou None s'il n'existe pas (encore)."""
+    if not field_file:
+        return None
+    try:
+        return file_info(field_file)[0][:VERSION_LENGTH]
+    except (OSError, ValueError):
+        return None
+
+
+def parse_range(header, size):
+    """
+    Lit un en-tête Range d'une seule plage d'octets.
+
+    Args:
+        header: Valeur de l'en-tête (ou None)
+        size: Taille du fichier
+
+    Returns:
+        (début, fin incluse), ou None pour envoyer le fichier entier
+        (pas d'en-tête, plusieurs plages, syntaxe non reconnue)
+
+    Raises:
+        RangeNotSatisfiable: la plage commence après la fin du fichier
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if not first:
+            # Les N derniers octets
+            length = int(last)
+            if length <= 0 or size == 0:
+                raise RangeNotSatisfiable
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start > end and last:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    return start, min(end, size - 1)
+
+
+def _read_range(f, start, length):
+    """Lit length octets à partir de start, par blocs, puis ferme le fichier."""
+    try:
+        f.seek(start)
+        while length > 0:
+            block = f.read(min(CHUNK_SIZE, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+    finally:
+        f.close()
+
+
+def serve_file(request, field_file, version=None, immutable=False, as_attachment=False, filename=None):
+    """
+    Envoie un fichier du stockage avec ETag (version du fichier) et
+    Last-Modified : 304 si le client a déjà cette version (If-None-Match,
+    If-Modified-Since), 206 pour une plage d'octets (Range, If-Range).
+
+    Args:
+        request: Requête HTTP
+        field_file: FieldFile à envoyer (existant), ou tout objet avec storage et name
+        version: Version demandée dans l'URL : si c'est celle du fichier, la
+            réponse est cachée un an (immutable), sinon elle doit être revalidée
+        immutable: Cacher la réponse un an (URL versionnée par l'appelant)
+        as_attachment: Proposer le téléchargement plutôt que l'affichage
+        filename: Nom proposé au client (défaut : nom du fichier stocké)
+
+    Returns:
+        HttpResponse
+    """
+    digest, size, modified = file_info(field_file)
+    etag = quote_etag(digest)
+    last_modified = int(modified.timestamp())
+    filename = filename or os.path.basename(field_file.name)
+
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(last_modified),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': (
+            f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+            if immutable or (version and version == digest[:VERSION_LENGTH]) else 'no-cache'
+        ),
+    }
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is not None:
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    # Une plage n'est valable que pour la version connue du client (If-Range)
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if if_range is None or if_range == etag:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    f = field_file.storage.open(field_file.name, 'rb')
+    if byte_range is None:
+        response = FileResponse(f, as_attachment=as_attachment, filename=filename)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _read_range(f, start, end - start + 1), status=206,
+            content_type=mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+
+    for header, value in headers.items():
+        response[header] = value
+    return response
@@ -0,0 +1,83 @@
+"""
+Encodage des images stockées des cartes (QR code, recto, verso).
+
+Chaque type d'image a son encodage (settings.CARD_IMAGE_ENCODING) :
+
+- png : PNG en couleurs réelles, sans perte
+- png-palette : PNG de 256 couleurs au plus ; quasi sans perte pour le QR
+  code (deux couleurs et le logo), environ dix fois plus léger pour les
+  faces mais avec perte (tramage des dégradés et des photos)
+- png-1bit : PNG noir et blanc (QR code sans les couleurs du logo)
+- webp-lossless : WebP sans perte, environ 30 % plus léger que le PNG
+
+Le niveau d'optimisation va de 0 (encodage rapide) à 9 (fichier le plus
+compact, encodage le plus lent).
+
+Le PDF est généré à partir des images en mémoire : l'encodage ne change que
+les fichiers servis au navigateur et la planche de download-all.
+"""
+from io import BytesIO
+
+from django.conf import settings
+from PIL import Image
+
+from cryptage.metrics import timed
+
+
+# Encodage : extension du fichier
+ENCODINGS = {
+    'png': 'png',
+    'png-palette': 'png',
+    'png-1bit': 'png',
+    'webp-lossless': 'webp',
+}
+
+DEFAULT_ENCODING = ('png', 6)
+
+
+def artefact_encoding(field):
+    """
+    Returns:
+        (encodage, niveau d'optimisation) d'un champ image de Stock
+    """
+    encoding, optimize = getattr(settings, 'CARD_IMAGE_ENCODING', {}).get(field, DEFAULT_ENCODING)
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Encodage d'image inconnu pour {field}: {encoding}")
+    return encoding, max(0, min(9, optimize))
+
+
+def artefact_extension(field):
+    """Extension du fichier d'un champ image de Stock."""
+    return ENCODINGS[artefact_encoding(field)[0]]
+
+
+def encode_image(image, encoding='png', optimize=6):
+    """
+    Encode une image PIL.
+
+    Args:
+        image: Image PIL
+        encoding: Clé de ENCODINGS
+        optimize: Niveau d'optimisation (0 à 9)
+
+    Returns:
+        bytes
+    """
+    buffer = BytesIO()
+    with timed('image_encode' if encoding == 'webp-lossless' else 'png_encode'):
+        if encoding == 'webp-lossless':
+            # method : effort de 0 à 6, quality : effort de compression sans perte
+            image.save(buffer, 'WEBP', lossless=True, method=round(optimize * 6 / 9),
+                       quality=round(optimize * 100 / 9))
+        else:
+            if encoding == 'png-palette' and image.mode != 'P':
+                image = image.convert('RGB').quantize(256, method=Image.Quantize.FASTOCTREE)
+            elif encoding == 'png-1bit':
+                image = image.convert('1', dither=Image.Dither.NONE)
+            image.save(buffer, 'PNG', compress_level=optimize, optimize=optimize >= 9)
+    return buffer.getvalue()
+
+
+def encode_artefact(image, field):
+    """Encode une image de carte selon l'encodage de son champ (voir artefact_encoding)."""
+    return encode_image(image, *artefact_encoding(field))
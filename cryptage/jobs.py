@@ -0,0 +1,293 @@
+"""
+File d'attente de génération de cartes, stockée en base de données.
+
+Les vues créent une CardJob et rendent la main immédiatement ; le worker
+(`python manage.py run_card_worker`) prend les tâches une à une et génère
+les cartes au fil de l'eau, en mettant à jour la progression et le signe de
+vie de la tâche (date_activite) à chaque paquet de cartes enregistré, et
+régulièrement pendant la préparation du lot.
+"""
+import hashlib
+import json
+import traceback
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from cryptage.models import CardJob, CardJobItem, CardTemplate
+from cryptage.rendering import generate_card_batches
+
+
+# Délai sans signe de vie après lequel une tâche en cours est considérée comme
+# abandonnée (worker arrêté en plein lot)
+STALE_AFTER = timedelta(minutes=10)
+
+
+class IdempotencyConflict(Exception):
+    """La clé d'idempotence a déjà servi pour un autre lot."""
+
+
+class JobInProgress(Exception):
+    """La tâche est déjà en cours de traitement ailleurs."""
+
+
+def sources_fingerprint(sources, template, force=False):
+    """Empreinte d'un lot, pour vérifier qu'une clé d'idempotence désigne bien le même lot."""
+    payload = json.dumps(
+        [sources, template.pk if template else None, force], sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def enqueue_card_job(sources, template, force=False, idempotency_key=None):
+    """
+    Crée une tâche de génération en attente.
+
+    Avec une clé d'idempotence déjà connue, la tâche existante est renvoyée
+    au lieu d'en créer une nouvelle (une tâche en échec est remise en
+    attente : seuls ses membres non traités seront générés).
+
+    Args:
+        sources: Liste de dicts {'member_id': id} ou {'member_data': {...}}
+        template: Instance du modèle CardTemplate
+        force: Régénérer même les cartes déjà à jour
+        idempotency_key: Clé fournie par le client (optionnelle)
+
+    Returns:
+        L'instance CardJob créée ou retrouvée
+
+    Raises:
+        IdempotencyConflict: la clé a déjà servi pour un lot différent
+    """
+    job, _ = _get_or_create_job(sources, template, force, idempotency_key, CardJob.EN_ATTENTE)
+    return job
+
+
+def _get_or_create_job(sources, template, force, idempotency_key, statut):
+    """
+    Returns:
+        (tâche, créée ou non)
+    """
+    fingerprint = sources_fingerprint(sources, template, force)
+    if idempotency_key:
+        job = CardJob.objects.filter(cle_idempotence=idempotency_key).first()
+        if job is not None:
+            return _resume(job, fingerprint), False
+
+    try:
+        now = timezone.now() if statut == CardJob.EN_COURS else None
+        with transaction.atomic():
+            job = CardJob.objects.create(
+                template=template, forcer=force, total=len(sources), statut=statut,
+                date_debut=now, date_activite=now,
+                cle_idempotence=idempotency_key or None, empreinte_sources=fingerprint
+            )
+            CardJobItem.objects.bulk_create(
+                [CardJobItem(job=job, position=position, source=source)
+                 for position, source in enumerate(sources)],
+                batch_size=500
+            )
+    except IntegrityError:
+        # Même clé soumise au même moment par une autre requête
+        if not idempotency_key:
+            raise
+        return _resume(CardJob.objects.get(cle_idempotence=idempotency_key), fingerprint), False
+    return job, True
+
+
+def _resume(job, fingerprint):
+    """Renvoie une tâche existante, remise en attente si elle avait échoué."""
+    if job.empreinte_sources != fingerprint:
+        raise IdempotencyConflict(
+            f"La clé d'idempotence a déjà été utilisée pour un autre lot (tâche #{job.pk})"
+        )
+    if job.statut == CardJob.ECHEC:
+        CardJob.objects.filter(pk=job.pk, statut=CardJob.ECHEC).update(statut=CardJob.EN_ATTENTE)
+        job.refresh_from_db()
+    return job
+
+
+def claim_job(job, stale_after=STALE_AFTER):
+    """
+    Réserve une tâche précise (en attente, ou en cours mais sans signe de
+    vie depuis stale_after).
+
+    Returns:
+        True si la tâche a été réservée par cet appel
+    """
+    now = timezone.now()
+    claimed = CardJob.objects.filter(
+        Q(statut=CardJob.EN_ATTENTE) |
+        Q(statut=CardJob.EN_COURS, date_activite__lt=now - stale_after),
+        pk=job.pk
+    ).update(statut=CardJob.EN_COURS, date_debut=now, date_activite=now)
+    if claimed:
+        job.statut = CardJob.EN_COURS
+        job.date_debut = job.date_activite = now
+    return bool(claimed)
+
+
+def run_job_now(sources, template, force=False, idempotency_key=None, max_workers=None, lazy=None):
+    """
+    Génère un lot dans le processus courant en passant par une tâche :
+    chaque membre est enregistré comme traité dès que sa carte est stockée.
+    Si le processus s'arrête en cours de route, renvoyer le même lot (même
+    clé d'idempotence) reprend aux membres non traités.
+
+    Args:
+        lazy: Différer le rendu des fichiers (voir generate_card_batches)
+
+    Returns:
+        L'instance CardJob terminée
+
+    Raises:
+        IdempotencyConflict: la clé a déjà servi pour un lot différent
+        JobInProgress: le lot est en cours de traitement par une autre requête
+    """
+    job, created = _get_or_create_job(sources, template, force, idempotency_key, CardJob.EN_COURS)
+    if not created:
+        if job.statut == CardJob.TERMINE:
+            return job
+        if not claim_job(job):
+            raise JobInProgress(f"Le lot est déjà en cours de génération (tâche #{job.pk})")
+    return process_job(job, max_workers=max_workers, lazy=lazy)
+
+
+def claim_next_job():
+    """
+    Réserve la plus ancienne tâche en attente.
+    Plusieurs workers peuvent tourner en parallèle : les lignes verrouillées
+    par un autre worker sont ignorées (SKIP LOCKED sur PostgreSQL).
+
+    Returns:
+        L'instance CardJob passée en cours, ou None si la file est vide
+    """
+    with transaction.atomic():
+        job = (
+            CardJob.objects.select_for_update(skip_locked=True)
+            .filter(statut=CardJob.EN_ATTENTE)
+            .order_by('date_creation', 'id')
+            .first()
+        )
+        if job is None:
+            return None
+        job.statut = CardJob.EN_COURS
+        job.date_debut = job.date_activite = timezone.now()
+        job.save(update_fields=['statut', 'date_debut', 'date_activite'])
+    return job
+
+
+def requeue_stale_jobs(older_than=STALE_AFTER):
+    """
+    Remet en attente les tâches restées en cours (worker arrêté en plein lot).
+    Les membres déjà traités ne sont pas régénérés.
+
+    Args:
+        older_than: timedelta depuis le dernier signe de vie de la tâche
+
+    Returns:
+        Nombre de tâches remises en attente
+    """
+    limit = timezone.now() - older_than
+    return CardJob.objects.filter(
+        statut=CardJob.EN_COURS, date_activite__lt=limit
+    ).update(statut=CardJob.EN_ATTENTE)
+
+
+def touch_job(job):
+    """Met à jour le signe de vie d'une tâche en cours (voir STALE_AFTER)."""
+    CardJob.objects.filter(pk=job.pk).update(date_activite=timezone.now())
+
+
+def process_job(job, max_workers=None, lazy=None):
+    """
+    Génère les cartes restantes d'une tâche.
+
+    Tous les membres non traités passent par un seul appel à
+    generate_card_batches (un seul pool de rendu pour la tâche). Chaque
+    paquet de cartes enregistré est un point de reprise : ses membres sont
+    marqués traités (un UPDATE groupé) et la progression et le signe de vie
+    de la tâche sont mis à jour en une requête. Pendant la préparation du lot
+    (empreintes de tous les membres), seul le signe de vie est mis à jour :
+    la tâche n'est pas reprise par un autre worker.
+
+    Args:
+        job: Instance CardJob réservée par claim_next_job ou claim_job
+        max_workers: Nombre de processus de rendu (voir BulkCardRenderer)
+        lazy: Différer le rendu des fichiers (défaut : settings.CARD_LAZY_ARTEFACTS)
+    """
+    template = job.template or CardTemplate.get_active_template()
+
+    try:
+        items = list(
+            job.items.filter(statut=CardJobItem.EN_ATTENTE).order_by('position').only('pk', 'source')
+        )
+        sources = [item.source for item in items]
+        batches = generate_card_batches(
+            sources, template, max_workers, force=job.forcer, lazy=lazy,
+            heartbeat=lambda: touch_job(job)
+        )
+        for results in batches:
+            done = []
+            for index, stock, error in results:
+                item = items[index]
+                if stock is not None:
+                    item.statut = CardJobItem.TERMINE
+                    item.stock = stock
+                else:
+                    item.statut = CardJobItem.ECHEC
+                    item.erreur = error
+                done.append(item)
+            failed = sum(item.statut == CardJobItem.ECHEC for item in done)
+            # Point de reprise : les membres sont marqués traités dès que leurs cartes sont stockées
+            with transaction.atomic():
+                CardJobItem.objects.bulk_update(done, ['statut', 'stock', 'erreur'])
+                CardJob.objects.filter(pk=job.pk).update(
+                    traites=F('traites') + len(done),
+                    echecs=F('echecs') + failed,
+                    date_activite=timezone.now()
+                )
+    except Exception as e:
+        traceback.print_exc()
+        job.statut = CardJob.ECHEC
+        job.message = str(e)
+    else:
+        job.statut = CardJob.TERMINE
+        job.message = ''
+
+    job.date_fin = timezone.now()
+    job.save(update_fields=['statut', 'message', 'date_fin'])
+    job.refresh_from_db()
+    return job
+
+
+def run_worker(interval=2, once=False, max_workers=None, stale_after=STALE_AFTER, stdout=None):
+    """
+    Boucle du worker : traite les tâches en attente puis attend les suivantes.
+
+    Args:
+        interval: Secondes d'attente quand la file est vide
+        once: Vider la file puis s'arrêter
+        max_workers: Nombre de processus de rendu par tâche
+        stale_after: Délai sans signe de vie après lequel une tâche en cours est reprise
+        stdout: Flux où écrire la progression (optionnel)
+    """
+    import time
+
+    while True:
+        requeue_stale_jobs(stale_after)
+        job = claim_next_job()
+        if job is None:
+            if once:
+                return
+            time.sleep(interval)
+            continue
+
+        job = process_job(job, max_workers=max_workers)
+        if stdout is not None:
+            stdout.write(
+                f"{job}: {job.traites - job.echecs}/{job.total} carte(s) générée(s), "
+                f"{job.echecs} échec(s)"
+            )
@@ -0,0 +1,237 @@
+import contextlib
+import json
+import os
+import platform
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import PIL
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image, ImageDraw
+
+from cryptage.card_generator import CardGenerator, render_qr_matrix, template_cache
+from cryptage.image_encoding import encode_artefact
+from cryptage.models import CardTemplate, Departement, Membres
+
+
+# Étapes mesurées, dans l'ordre du rendu d'une carte (render_card_artefacts).
+# Les sous-étapes sont déjà comprises dans la face avant : elles ne comptent
+# pas dans le temps total d'une carte.
+STAGES = ('qr_build', 'qr_image', 'recto', 'verso', 'png_encode', 'pdf_build')
+SUB_STAGES = ('logo_overlay', 'photo_mask')
+
+
+def percentile(values, fraction):
+    """Percentile par interpolation linéaire (values non vide)."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(durations):
+    """Statistiques d'une liste de durées (secondes)."""
+    total = sum(durations)
+    return {
+        'count': len(durations),
+        'ops_per_sec': round(len(durations) / total, 2) if total else None,
+        'mean_ms': round(1000 * statistics.mean(durations), 3),
+        'p50_ms': round(1000 * percentile(durations, 0.50), 3),
+        'p95_ms': round(1000 * percentile(durations, 0.95), 3),
+    }
+
+
+def peak_rss_mb():
+    """
+    Pic de mémoire résidente du processus depuis son démarrage (ru_maxrss :
+    Ko sous Linux, octets sous macOS). Ce maximum ne redescend jamais : il
+    vaut pour l'ensemble des lots mesurés, pas pour un lot en particulier.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def fixture_file(field_file, directory, name):
+    """Fait pointer un champ fichier d'une instance non sauvegardée vers un fichier local."""
+    field_file.name = name
+    field_file.storage = FileSystemStorage(location=str(directory))
+
+
+class Command(BaseCommand):
+    help = (
+        'Mesure le temps de chaque étape du rendu des cartes (QR code, logo, photo, '
+        'recto, verso, encodage PNG, PDF) sans base de données'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-sizes', default='1,10,50',
+                            help='Tailles de lots, séparées par des virgules')
+        parser.add_argument('--templates', default='default,model-carte',
+                            help="Templates mesurés : 'default' (carte générée) et/ou "
+                                 "'model-carte' (images du dossier « model carte »)")
+        parser.add_argument('--no-photo', action='store_true',
+                            help='Membres sans photo (pas de masque circulaire)')
+        parser.add_argument('--json', action='store_true',
+                            help='Afficher le résultat en JSON')
+        parser.add_argument('--output', default=None,
+                            help='Écrire le résultat JSON dans ce fichier')
+        parser.add_argument('--baseline', default=None,
+                            help='Résultat JSON de référence à comparer')
+        parser.add_argument('--max-regression', type=float, default=0.2,
+                            help='Ralentissement toléré du p50 par rapport à la référence (0.2 = 20%%)')
+
+    def handle(self, *args, **options):
+        batch_sizes = [int(size) for size in options['batch_sizes'].split(',') if size.strip()]
+        template_names = [name.strip() for name in options['templates'].split(',') if name.strip()]
+
+        fixtures = Path(tempfile.mkdtemp(prefix='benchmark_cards_'))
+        photo = None
+        if not options['no_photo']:
+            photo = fixtures / 'photo.jpg'
+            image = Image.new('RGB', (600, 600), (40, 90, 160))
+            ImageDraw.Draw(image).ellipse((150, 100, 450, 400), fill=(230, 190, 150))
+            image.save(photo, quality=90)
+
+        runs = []
+        for template_name in template_names:
+            template = self.build_template(template_name)
+            for batch_size in batch_sizes:
+                runs.append(self.run_batch(template_name, template, batch_size, photo))
+
+        result = {
+            'environment': {
+                'python': platform.python_version(),
+                'pillow': PIL.__version__,
+                'numpy': np.__version__,
+                'cpu_count': os.cpu_count(),
+                'platform': platform.platform(),
+            },
+            'runs': runs,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+
+        if options['output']:
+            Path(options['output']).write_text(json.dumps(result, indent=2))
+        if options['json']:
+            self.stdout.write(json.dumps(result, indent=2))
+        else:
+            self.print_report(result)
+
+        if options['baseline']:
+            self.compare(result, json.loads(Path(options['baseline']).read_text()), options['max_regression'])
+
+    def build_template(self, name):
+        """Template non sauvegardé : aucune requête n'est faite pendant la mesure."""
+        if name == 'default':
+            return CardTemplate(nom='Benchmark (carte par défaut)')
+        if name == 'model-carte':
+            directory = Path(settings.BASE_DIR) / 'model carte'
+            template = CardTemplate(nom='Benchmark (model carte)')
+            fixture_file(template.template_recto, directory, 'carte devant.PNG')
+            fixture_file(template.template_verso, directory, 'carte derriere.PNG')
+            if not os.path.exists(template.template_recto.path):
+                raise CommandError(f'Template introuvable: {template.template_recto.path}')
+            return template
+        raise CommandError(f"Template inconnu: {name} (choix: default, model-carte)")
+
+    def build_member(self, index, photo):
+        membre = Membres(
+            nom=f'Nom{index}', prenom=f'Prenom{index}',
+            departement=Departement(nom_depart='Informatique'),
+            telephone='770000000', email=f'membre{index}@example.com', profession='Développeur'
+        )
+        if photo is not None:
+            fixture_file(membre.photo, photo.parent, photo.name)
+        return membre
+
+    def run_batch(self, template_name, template, batch_size, photo):
+        """Rend batch_size cartes à la suite, caches vides au départ (comme un lot en production)."""
+        template_cache.invalidate()
+        timings = {stage: [] for stage in STAGES + SUB_STAGES}
+        cards = []
+
+        def timed(stage, function, *args):
+            start = time.perf_counter()
+            value = function(*args)
+            timings[stage].append(time.perf_counter() - start)
+            return value
+
+        # Les messages du générateur (logo absent...) fausseraient la mesure et la sortie
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            batch_start = time.perf_counter()
+            for index in range(batch_size):
+                membre = self.build_member(index, photo)
+                generator = CardGenerator(membre, template=template)
+                card_start = time.perf_counter()
+
+                qr = timed('qr_build', generator._get_qr)
+                qr_img = timed('qr_image', generator.generate_qr_code)
+                recto = timed('recto', generator.generate_card_front)
+                verso = timed('verso', generator.generate_card_back)
+                timed('png_encode', lambda: [encode_artefact(image, field) for image, field in (
+                    (qr_img, 'qr_code'), (recto, 'carte_recto'), (verso, 'carte_verso'))])
+                timed('pdf_build', generator.generate_pdf)
+                cards.append(time.perf_counter() - card_start)
+
+                # Sous-étapes de la face avant, mesurées à part sur des copies
+                small_qr = render_qr_matrix(qr.modules, 1, qr.border).resize(
+                    (200, 200), Image.Resampling.NEAREST).convert('RGB')
+                timed('logo_overlay', generator._add_logo, small_qr, 'static/images/log7.png')
+                if membre.photo:
+                    timed('photo_mask', generator._add_photo, recto.copy())
+            elapsed = time.perf_counter() - batch_start
+
+        return {
+            'template': template_name,
+            'batch_size': batch_size,
+            'cards_per_sec': round(batch_size / sum(cards), 2),
+            'wall_time_s': round(elapsed, 3),
+            'card': summarize(cards),
+            'stages': {stage: summarize(values) for stage, values in timings.items() if values},
+            'sub_stages': [stage for stage in SUB_STAGES if timings[stage]],
+        }
+
+    def print_report(self, result):
+        for run in result['runs']:
+            self.stdout.write(self.style.MIGRATE_HEADING(
+                f"{run['template']} - lot de {run['batch_size']} : {run['cards_per_sec']} cartes/s "
+                f"(p50 {run['card']['p50_ms']} ms, p95 {run['card']['p95_ms']} ms)"
+            ))
+            for stage, values in run['stages'].items():
+                label = f"{stage}{' *' if stage in run['sub_stages'] else ''}"
+                self.stdout.write(
+                    f"  {label:<15} p50 {values['p50_ms']:>9.3f} ms   p95 {values['p95_ms']:>9.3f} ms   "
+                    f"{values['ops_per_sec']:>9} op/s"
+                )
+        self.stdout.write('* sous-étape déjà comprise dans recto')
+        self.stdout.write(f"RSS max du processus (tous lots confondus) : {result['peak_rss_mb']} Mo")
+
+    def compare(self, result, baseline, max_regression):
+        """Échoue si le p50 d'une étape a ralenti au-delà du seuil par rapport à la référence."""
+        reference = {(run['template'], run['batch_size']): run for run in baseline.get('runs', [])}
+        regressions = []
+        for run in result['runs']:
+            previous = reference.get((run['template'], run['batch_size']))
+            if previous is None:
+                continue
+            stages = dict(run['stages'], card=run['card'])
+            previous_stages = dict(previous['stages'], card=previous['card'])
+            for stage, values in stages.items():
+                before = previous_stages.get(stage, {}).get('p50_ms')
+                if before and values['p50_ms'] > before * (1 + max_regression):
+                    regressions.append(
+                        f"{run['template']}/{run['batch_size']}/{stage}: "
+                        f"{before} ms -> {values['p50_ms']} ms"
+                    )
+
+        if regressions:
+            raise CommandError('Régressions de performance :\n' + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Aucune régression par rapport à la référence.'))
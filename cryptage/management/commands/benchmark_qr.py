@@ -0,0 +1,72 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+import qrcode
+
+from cryptage.card_generator import render_qr_matrix
+
+
+class Command(BaseCommand):
+    help = 'Compare le rendu des QR codes par qrcode.make_image et par render_qr_matrix (NumPy)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200,
+                            help='Nombre de QR codes rendus par méthode')
+        parser.add_argument('--box-size', type=int, default=10,
+                            help='Côté d\'un module en pixels')
+        parser.add_argument('--json', action='store_true',
+                            help='Afficher le résultat en JSON')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        box_size = options['box_size']
+
+        # Des données de taille réaliste (comme le QR code d'une carte de membre)
+        codes = []
+        for i in range(iterations):
+            qr = qrcode.QRCode(
+                version=1,
+                error_correction=qrcode.constants.ERROR_CORRECT_H,
+                box_size=box_size,
+                border=1,
+            )
+            qr.add_data(
+                f"***CLUB DES JEUNES PROGRAMMEURS***\nNom: Membre{i}\nPrénom: Test\n"
+                f"Email: membre{i}@example.com\nTéléphone: 77{i:07d}\nhttps://club-jp.com"
+            )
+            qr.make(fit=True)
+            codes.append(qr)
+
+        def run(render):
+            start = time.perf_counter()
+            images = [render(qr) for qr in codes]
+            return time.perf_counter() - start, images
+
+        qrcode_time, expected = run(lambda qr: qr.make_image(fill_color="black").convert('RGB'))
+        numpy_time, actual = run(
+            lambda qr: render_qr_matrix(qr.modules, qr.box_size, qr.border).convert('RGB')
+        )
+
+        identical = all(a.tobytes() == b.tobytes() for a, b in zip(actual, expected))
+        result = {
+            'iterations': iterations,
+            'box_size': box_size,
+            'modules': len(codes[0].modules),
+            'qrcode_ms': round(1000 * qrcode_time / iterations, 3),
+            'numpy_ms': round(1000 * numpy_time / iterations, 3),
+            'speedup': round(qrcode_time / numpy_time, 2),
+            'identical': identical,
+        }
+
+        if options['json']:
+            self.stdout.write(json.dumps(result))
+            return
+
+        self.stdout.write(f"{iterations} QR codes de {result['modules']} modules, box_size={box_size}")
+        self.stdout.write(f"  qrcode.make_image : {result['qrcode_ms']} ms / QR code")
+        self.stdout.write(f"  render_qr_matrix  : {result['numpy_ms']} ms / QR code")
+        style = self.style.SUCCESS if identical else self.style.ERROR
+        self.stdout.write(style(
+            f"Accélération x{result['speedup']}, images {'identiques' if identical else 'DIFFÉRENTES'}"
+        ))
@@ -0,0 +1,69 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from cryptage.models import Stock
+
+
+def access_patterns():
+    """
+    Requêtes courantes sur Stock et l'index que chacune doit utiliser.
+
+    Returns:
+        Liste de (description, queryset, nom de l'index attendu)
+    """
+    une_semaine = timezone.now() - timedelta(days=7)
+    return [
+        ("Cartes d'un membre (remplacement, historique)",
+         Stock.objects.filter(membre_id=1).order_by('-date_generation'),
+         'cryptage_stock_membre_date_idx'),
+        ('Cartes par template (liste admin)',
+         Stock.objects.filter(template_utilise_id=1).order_by('-date_generation'),
+         'cryptage_stock_tpl_date_idx'),
+        ('Cartes de la semaine (dashboard)',
+         Stock.objects.filter(date_generation__gte=une_semaine),
+         'cryptage_stock_date_id_idx'),
+        ('Page suivante (pagination par curseur)',
+         Stock.objects.filter(date_generation__lt=timezone.now()).order_by('-date_generation', '-id')[:10],
+         'cryptage_stock_date_id_idx'),
+    ]
+
+
+class Command(BaseCommand):
+    help = "Affiche le plan d'exécution (EXPLAIN) des requêtes courantes sur Stock et les index utilisés"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help="Échouer si une requête n'utilise pas l'index attendu")
+        parser.add_argument('--no-seqscan', action='store_true',
+                            help="PostgreSQL : désactiver les parcours séquentiels "
+                                 "(utile sur une base presque vide)")
+        parser.add_argument('--plans', action='store_true',
+                            help='Afficher les plans complets')
+
+    def handle(self, *args, **options):
+        missing = []
+
+        with transaction.atomic():
+            if options['no_seqscan'] and connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+
+            for description, queryset, index in access_patterns():
+                plan = queryset.explain()
+                used = index in plan
+                if not used:
+                    missing.append(description)
+
+                status = self.style.SUCCESS('OK') if used else self.style.WARNING('SANS INDEX')
+                self.stdout.write(f"[{status}] {description} -> {index}")
+                if options['plans'] or not used:
+                    for line in plan.splitlines():
+                        self.stdout.write(f"    {line}")
+
+        if missing and options['check']:
+            raise CommandError(
+                f"{len(missing)} requête(s) sans l'index attendu : " + ', '.join(missing)
+            )
@@ -0,0 +1,109 @@
+from itertools import islice
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cryptage.media_gc import (
+    delete_files, managed_directories, prunable_history, referenced_names, walk_files
+)
+from cryptage.models import Stock
+from cryptage.thumbnails import THUMBNAIL_DIR
+
+
+class Command(BaseCommand):
+    help = (
+        "Supprime les fichiers media qui ne sont plus référencés en base "
+        "(cartes remplacées ou supprimées, écritures interrompues)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Lister les fichiers sans les supprimer')
+        parser.add_argument('--min-age', type=int, default=60,
+                            help="Âge minimal (minutes) d'un fichier pour être supprimé")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Lignes lues et fichiers supprimés par paquet')
+        parser.add_argument('--thumbnails', action='store_true',
+                            help='Supprimer aussi les miniatures (régénérées à la demande)')
+        parser.add_argument('--prune-history', action='store_true',
+                            help="Supprimer les fichiers des anciennes cartes de chaque membre "
+                                 "(régénérés à la demande)")
+
+    def handle(self, *args, **options):
+        root = settings.MEDIA_ROOT
+        min_age = options['min_age'] * 60
+        batch_size = max(1, options['batch_size'])
+        dry_run = options['dry_run']
+        total_files = total_bytes = 0
+
+        if options['prune_history']:
+            count, size = self.prune_history(batch_size, dry_run)
+            self.stdout.write(f'Anciennes cartes: {count} fichier(s), {size / 1e6:.1f} Mo')
+            total_files += count
+            total_bytes += size
+
+        directories = managed_directories()
+        if options['thumbnails']:
+            directories[THUMBNAIL_DIR] = []
+
+        for directory, references in sorted(directories.items()):
+            # Noms référencés lus d'abord : un fichier plus récent que min_age est ignoré,
+            # une ligne enregistrée pendant le parcours ne peut donc pas être manquée
+            referenced = referenced_names(references, batch_size)
+            orphans = (
+                (name, size) for name, size in walk_files(root, directory, min_age)
+                if name not in referenced
+            )
+
+            count = size_sum = 0
+            while True:
+                batch = list(islice(orphans, batch_size))
+                if not batch:
+                    break
+                count += len(batch)
+                size_sum += sum(size for _, size in batch)
+                if dry_run:
+                    for name, _ in batch:
+                        self.stdout.write(f'  {name}')
+                else:
+                    delete_files([(default_storage, name) for name, _ in batch])
+
+            self.stdout.write(f'{directory}/: {count} fichier(s) orphelin(s), {size_sum / 1e6:.1f} Mo')
+            total_files += count
+            total_bytes += size_sum
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{'[simulation] ' if dry_run else ''}{total_files} fichier(s) "
+            f"{'à supprimer' if dry_run else 'supprimé(s)'}, {total_bytes / 1e6:.1f} Mo"
+        ))
+
+    def prune_history(self, batch_size, dry_run):
+        """Vide les champs fichiers des anciennes cartes et supprime leurs fichiers."""
+        fields = list(Stock.ARTEFACT_FIELDS.values())
+        count = size_sum = 0
+        last_pk = 0
+        while True:
+            batch = list(prunable_history().filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+            files = [
+                (file.storage, file.name)
+                for stock in batch for file in (getattr(stock, field) for field in fields) if file
+            ]
+            for storage, name in files:
+                try:
+                    size_sum += storage.size(name)
+                except OSError:
+                    continue
+            count += len(files)
+            if dry_run:
+                continue
+            with transaction.atomic():
+                Stock.objects.filter(pk__in=[stock.pk for stock in batch]).update(
+                    **{field: '' for field in fields}
+                )
+                transaction.on_commit(lambda files=files: delete_files(files))
+        return count, size_sum
@@ -0,0 +1,211 @@
+import csv
+import json
+import os
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cryptage.bulk_import import field_limits, import_each, import_members
+from cryptage.models import CardTemplate
+from cryptage.rendering import generate_cards
+from cryptage.serializers import MembreCreateSerializer
+
+
+# Champs tronqués à la longueur de leur colonne (comme pour /api/cards/generate-bulk/) ;
+# un email trop long reste une erreur
+TRUNCATED_FIELDS = ('first_name', 'last_name', 'phone', 'profession', 'department')
+
+
+def read_rows(path, file_format):
+    """
+    Lit le fichier ligne par ligne (mémoire constante).
+
+    Yields:
+        (numéro de ligne sans compter l'en-tête CSV, dict des colonnes) ;
+        le dict vaut None si la ligne est illisible
+    """
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if file_format == 'csv':
+            reader = csv.DictReader(f)
+            for number, row in enumerate(reader, start=1):
+                yield number, {key.strip(): (value or '').strip() for key, value in row.items() if key}
+        else:
+            for number, line in enumerate(f, start=1):
+                if not line.strip():
+                    yield number, {}
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield number, row if isinstance(row, dict) else None
+
+
+def validate_row(row):
+    """
+    Valide une ligne avec MembreCreateSerializer.
+
+    Returns:
+        (données du membre, None) ou (None, message d'erreur)
+    """
+    if row is None:
+        return None, 'Ligne illisible'
+    serializer = MembreCreateSerializer(data=row)
+    if not serializer.is_valid():
+        return None, json.dumps(serializer.errors, ensure_ascii=False)
+
+    member_data = dict(serializer.validated_data)
+    limits = field_limits()
+    for key in TRUNCATED_FIELDS:
+        if member_data.get(key):
+            member_data[key] = member_data[key][:limits[key]]
+    return member_data, None
+
+
+def file_signature(path):
+    """Taille et date de modification du fichier : une progression ne vaut que pour ce fichier."""
+    stat = path.stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+class Command(BaseCommand):
+    help = (
+        "Importe des membres depuis un fichier CSV ou JSONL (colonnes first_name, last_name, "
+        "email, department, phone, profession) et génère éventuellement leurs cartes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Fichier .csv ou .jsonl')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default=None,
+                            help="Format du fichier (défaut: d'après l'extension)")
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Lignes importées par lot')
+        parser.add_argument('--update', action='store_true',
+                            help='Mettre à jour les membres existants (même email)')
+        parser.add_argument('--render', action='store_true',
+                            help='Générer les cartes des membres importés')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Processus de rendu (défaut: CARD_RENDER_WORKERS)')
+        parser.add_argument('--template', type=int, default=None,
+                            help='ID du template (défaut: template actif)')
+        parser.add_argument('--force', action='store_true',
+                            help='Régénérer même les cartes déjà à jour')
+        parser.add_argument('--lazy', action='store_true', default=None,
+                            help='Enregistrer les cartes sans leurs fichiers, générés à la première demande '
+                                 '(défaut: CARD_LAZY_ARTEFACTS)')
+        parser.add_argument('--progress', default=None,
+                            help="Fichier de progression, supprimé en fin d'import (défaut: <fichier>.progress)")
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignorer la progression enregistrée et tout reprendre')
+        parser.add_argument('--errors', default=None,
+                            help='Écrire les lignes en échec dans ce fichier (JSONL)')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'Fichier non trouvé: {path}')
+        file_format = options['format'] or ('jsonl' if path.suffix.lower() in ('.jsonl', '.ndjson') else 'csv')
+        batch_size = max(1, options['batch_size'])
+
+        template = None
+        if options['render']:
+            if options['template']:
+                template = CardTemplate.objects.filter(pk=options['template']).first()
+            else:
+                template = CardTemplate.get_active_template()
+            if template is None:
+                raise CommandError('Aucun template trouvé pour générer les cartes')
+
+        # Reprise : les lignes déjà traitées par une exécution interrompue sont sautées
+        progress_path = Path(options['progress'] or f'{path}.progress')
+        signature = file_signature(path)
+        progress = {'line': 0, 'imported': 0, 'cards': 0, 'failed': 0, 'file': signature}
+        if progress_path.exists() and not options['restart']:
+            saved = json.loads(progress_path.read_text())
+            if saved.get('file') == signature:
+                progress.update(saved)
+                self.stdout.write(f"Reprise après la ligne {progress['line']}")
+            else:
+                self.stdout.write('Fichier modifié depuis la progression enregistrée : import depuis le début')
+
+        errors_file = open(options['errors'], 'a', encoding='utf-8') if options['errors'] else None
+        start = time.perf_counter()
+        processed = 0
+
+        try:
+            rows = islice(read_rows(path, file_format), progress['line'], None)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+
+                failures = []
+                valid = []
+                for number, row in batch:
+                    if row == {}:
+                        continue
+                    member_data, error = validate_row(row)
+                    if error:
+                        failures.append((number, row, error))
+                    else:
+                        valid.append((number, member_data))
+
+                members_data = [member_data for _, member_data in valid]
+                try:
+                    membres, import_errors = import_members(members_data, update=options['update'])
+                except Exception as e:
+                    # Lot refusé par la base : reprendre les lignes une à une pour isoler l'erreur
+                    self.stderr.write(f'Lot refusé ({e}), import ligne par ligne')
+                    membres, import_errors = import_each(members_data, update=options['update'])
+                for position, error in import_errors:
+                    number, member_data = valid[position]
+                    failures.append((number, member_data, error))
+                progress['imported'] += len(membres)
+
+                if template is not None and membres:
+                    sources = [{'member_id': membre.pk} for _, membre in membres]
+                    for index, stock, error in generate_cards(
+                        sources, template, max_workers=options['workers'], force=options['force'],
+                        lazy=options['lazy']
+                    ):
+                        if stock is not None:
+                            progress['cards'] += 1
+                        else:
+                            number, member_data = valid[membres[index][0]]
+                            failures.append((number, member_data, f'Carte: {error}'))
+
+                for number, row, error in sorted(failures, key=lambda failure: failure[0]):
+                    self.stderr.write(f'Ligne {number}: {error}')
+                    if errors_file is not None:
+                        errors_file.write(json.dumps({'line': number, 'row': row, 'error': error},
+                                                     ensure_ascii=False, default=str) + '\n')
+                progress['failed'] += len(failures)
+
+                # La progression n'avance qu'une fois le lot enregistré
+                progress['line'] = batch[-1][0]
+                processed += len(batch)
+                tmp_path = progress_path.with_name(progress_path.name + '.tmp')
+                tmp_path.write_text(json.dumps(progress))
+                os.replace(tmp_path, progress_path)
+
+                elapsed = time.perf_counter() - start
+                self.stdout.write(
+                    f"Ligne {progress['line']}: {progress['imported']} membre(s), "
+                    f"{progress['cards']} carte(s), {progress['failed']} échec(s) "
+                    f"- {processed / elapsed:.0f} lignes/s"
+                )
+        finally:
+            if errors_file is not None:
+                errors_file.close()
+
+        # Import terminé : une nouvelle exécution relit tout le fichier
+        progress_path.unlink(missing_ok=True)
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Import terminé: {progress['imported']} membre(s) importé(s), "
+            f"{progress['cards']} carte(s) générée(s), {progress['failed']} échec(s) "
+            f"en {elapsed:.1f}s ({processed / elapsed if elapsed else 0:.0f} lignes/s)"
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from cryptage.stats import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Recalcule les compteurs de statistiques du dashboard à partir des tables'
+
+    def handle(self, *args, **options):
+        changes = reconcile()
+        for key, (old, new) in sorted(changes.items()):
+            self.stdout.write(f"{key}: {old} -> {new}")
+        self.stdout.write(self.style.SUCCESS(f'{len(changes)} compteur(s) corrigé(s).'))
@@ -0,0 +1,95 @@
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from cryptage.image_encoding import artefact_encoding, artefact_extension, encode_artefact
+from cryptage.models import Stock
+
+
+IMAGE_FIELDS = ('qr_code', 'carte_recto', 'carte_verso')
+
+
+class Command(BaseCommand):
+    help = (
+        "Ré-encode les images des cartes déjà stockées (QR code, recto, verso) "
+        "selon CARD_IMAGE_ENCODING"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fields', default=','.join(IMAGE_FIELDS),
+                            help='Champs à traiter, séparés par des virgules')
+        parser.add_argument('--batch-size', type=int, default=200,
+                            help='Cartes lues par requête')
+        parser.add_argument('--min-saving', type=float, default=0.05,
+                            help='Gain minimal pour remplacer un fichier (0.05 = 5%%)')
+        parser.add_argument('--limit', type=int, default=None,
+                            help='Nombre maximal de cartes traitées')
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Calculer le gain sans rien modifier")
+
+    def handle(self, *args, **options):
+        fields = [field.strip() for field in options['fields'].split(',') if field.strip()]
+        unknown = set(fields) - set(IMAGE_FIELDS)
+        if unknown:
+            raise CommandError(f"Champs inconnus: {', '.join(sorted(unknown))}")
+        for field in fields:
+            encoding, optimize = artefact_encoding(field)
+            self.stdout.write(f'{field}: {encoding} (optimisation {optimize})')
+
+        queryset = Stock.objects.order_by('pk').only('pk', 'versions', *fields)
+        if options['limit']:
+            queryset = queryset[:options['limit']]
+
+        totals = {'reencoded': 0, 'skipped': 0, 'missing': 0, 'before': 0, 'after': 0}
+        for stock in queryset.iterator(chunk_size=max(1, options['batch_size'])):
+            for field in fields:
+                self.reencode(stock, field, options, totals)
+
+        saved = totals['before'] - totals['after']
+        self.stdout.write(self.style.SUCCESS(
+            f"{'[simulation] ' if options['dry_run'] else ''}"
+            f"{totals['reencoded']} fichier(s) ré-encodé(s), {totals['skipped']} inchangé(s), "
+            f"{totals['missing']} absent(s) : {totals['before'] / 1e6:.1f} Mo -> "
+            f"{totals['after'] / 1e6:.1f} Mo ({saved / 1e6:.1f} Mo gagnés)"
+        ))
+
+    def reencode(self, stock, field, options, totals):
+        """Ré-encode un fichier s'il y gagne au moins --min-saving."""
+        file = getattr(stock, field)
+        if not file:
+            return
+        storage, old_name = file.storage, file.name
+        try:
+            with storage.open(old_name, 'rb') as f:
+                data = f.read()
+            image = Image.open(BytesIO(data))
+            image.load()
+        except (OSError, ValueError):
+            totals['missing'] += 1
+            return
+
+        encoded = encode_artefact(image, field)
+        if len(encoded) > len(data) * (1 - options['min_saving']):
+            totals['skipped'] += 1
+            return
+
+        totals['reencoded'] += 1
+        totals['before'] += len(data)
+        totals['after'] += len(encoded)
+        if options['dry_run']:
+            return
+
+        # Nouveau nom : les URL versionnées et les miniatures suivent le nouveau contenu
+        new_name = storage.save(
+            f"{os.path.splitext(old_name)[0]}.{artefact_extension(field)}", ContentFile(encoded)
+        )
+        setattr(stock, field, new_name)
+        stock.record_version(field)
+        # Ne remplace que si la carte n'a pas été régénérée entre-temps
+        updated = Stock.objects.filter(pk=stock.pk, **{field: old_name}).update(
+            **{field: new_name, 'versions': stock.versions}
+        )
+        storage.delete(old_name if updated else new_name)
@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from cryptage import metrics
+from cryptage.jobs import run_worker
+
+
+class Command(BaseCommand):
+    help = 'Traite la file des tâches de génération de cartes (CardJob)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help="Vider la file puis s'arrêter")
+        parser.add_argument('--interval', type=float, default=2,
+                            help='Secondes entre deux consultations de la file vide')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Processus de rendu par tâche (défaut: CARD_RENDER_WORKERS)')
+        parser.add_argument('--stale-after', type=int, default=600,
+                            help='Secondes sans signe de vie après lesquelles une tâche en cours est reprise')
+
+    def handle(self, *args, **options):
+        self.stdout.write(self.style.SUCCESS('Worker de génération de cartes démarré.'))
+
+        # Durées mesurées ici : exportées pour /api/metrics/ (servi par un autre processus)
+        export_interval = getattr(settings, 'CARD_METRICS_EXPORT_INTERVAL', 15)
+        name = metrics.process_name('worker')
+        if export_interval:
+            metrics.start_exporter(name, export_interval)
+        try:
+            run_worker(
+                interval=options['interval'],
+                once=options['once'],
+                max_workers=options['workers'],
+                stale_after=timedelta(seconds=options['stale_after']),
+                stdout=self.stdout,
+            )
+        finally:
+            if export_interval:
+                metrics.export(name)
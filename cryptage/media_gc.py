@@ -0,0 +1,131 @@
+"""
+Cycle de vie des fichiers media.
+
+Les fichiers d'une carte (ou la photo d'un membre) sont supprimés avec leur
+ligne : signal post_delete, une fois la transaction validée (une suppression
+annulée ne perd aucun fichier). La commande gc_media rattrape le reste :
+fichiers de lignes supprimées avant ce mécanisme ou hors de l'ORM, écritures
+interrompues (fichier écrit, transaction annulée), miniatures.
+
+Le parcours des dossiers suppose un stockage sur disque (FileSystemStorage,
+MEDIA_ROOT).
+"""
+import os
+import time
+
+from django.apps import apps
+from django.db import models, transaction
+
+
+def delete_files(files):
+    """
+    Supprime des fichiers du stockage (les fichiers déjà absents sont ignorés).
+
+    Args:
+        files: Liste de (storage, nom)
+    """
+    for storage, name in files:
+        try:
+            storage.delete(name)
+        except OSError as e:
+            print(f"Erreur suppression fichier {name}: {e}")
+
+
+def delete_files_on_commit(instance, fields):
+    """Supprime les fichiers d'une instance supprimée, après validation de la transaction."""
+    files = [
+        (file.storage, file.name)
+        for file in (getattr(instance, field) for field in fields)
+        if file
+    ]
+    if files:
+        transaction.on_commit(lambda: delete_files(files))
+
+
+def managed_directories():
+    """
+    Dossiers du stockage où l'application enregistre ses fichiers.
+
+    Returns:
+        dict {dossier (upload_to): [(modèle, champ)]}
+    """
+    directories = {}
+    for model in apps.get_app_config('cryptage').get_models():
+        for field in model._meta.get_fields():
+            if isinstance(field, models.FileField) and isinstance(field.upload_to, str):
+                directories.setdefault(field.upload_to.strip('/'), []).append((model, field.name))
+    return directories
+
+
+def referenced_names(references, batch_size=2000):
+    """
+    Noms des fichiers référencés en base, lus par paquets (requêtes en flux).
+
+    Args:
+        references: Liste de (modèle, champ)
+
+    Returns:
+        set des noms
+    """
+    names = set()
+    for model, field in references:
+        queryset = model.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})
+        names.update(queryset.values_list(field, flat=True).iterator(chunk_size=batch_size))
+    return names
+
+
+def walk_files(root, directory, min_age=0):
+    """
+    Parcourt un dossier du stockage sans le charger en mémoire.
+
+    Args:
+        root: Racine du stockage (MEDIA_ROOT)
+        directory: Dossier relatif à la racine
+        min_age: Ignorer les fichiers modifiés depuis moins de min_age secondes
+            (fichier écrit dont la ligne n'est pas encore enregistrée)
+
+    Yields:
+        (nom relatif à la racine, taille en octets)
+    """
+    limit = time.time() - min_age
+    pending = [os.path.join(root, directory)]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except FileNotFoundError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                    continue
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime > limit:
+                    continue
+                name = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                yield name, stat.st_size
+
+
+def prunable_history():
+    """
+    Anciennes cartes (pas la dernière de leur membre) dont les fichiers peuvent
+    être supprimés : leur spec permet de les régénérer à la demande.
+
+    Returns:
+        QuerySet Stock (champs fichiers seulement), trié par id
+    """
+    from cryptage.models import Stock
+
+    latest = Stock.objects.filter(membre=models.OuterRef('membre')).order_by('-date_generation', '-id')
+    has_files = models.Q()
+    for field in Stock.ARTEFACT_FIELDS.values():
+        has_files |= ~models.Q(**{field: ''}) & models.Q(**{f'{field}__isnull': False})
+
+    return (
+        Stock.objects.filter(spec__isnull=False).filter(has_files)
+        .exclude(pk=models.Subquery(latest.values('pk')[:1]))
+        .only('pk', *Stock.ARTEFACT_FIELDS.values())
+        .order_by('pk')
+    )
@@ -0,0 +1,243 @@
+"""
+Mesure du temps passé dans chaque étape de la génération des cartes.
+
+Chaque étape (construction du QR code, composition du recto, encodage PNG,
+PDF, écriture des fichiers, accès à la base...) est chronométrée avec
+`timed()` et cumulée dans un histogramme en mémoire. Les histogrammes sont
+exposés au format texte Prometheus sur /api/metrics/ et chaque carte rendue
+produit une ligne de log JSON (logger 'cryptage.metrics') avec le détail de
+ses étapes.
+
+Les processus de rendu (BulkCardRenderer) ne gardent pas leurs mesures :
+elles sont renvoyées avec les fichiers générés et ajoutées aux histogrammes
+du processus parent (voir forward_only et record()).
+
+Le worker (run_card_worker), qui génère les lots planifiés, ne sert pas
+/api/metrics/ : il exporte ses histogrammes en base à intervalle régulier
+(voir export et start_exporter, CARD_METRICS_EXPORT_INTERVAL) et l'endpoint
+les additionne à ceux du processus serveur qui répond. Les mesures des
+autres processus serveur (plusieurs workers gunicorn) ne sont pas incluses.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+
+logger = logging.getLogger('cryptage.metrics')
+
+# Bornes des histogrammes (secondes)
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Dans un processus de rendu : mesurer sans remplir les histogrammes locaux,
+# les durées sont renvoyées au parent
+forward_only = False
+
+_local = threading.local()
+
+
+class Histogram:
+    """Histogramme cumulatif des durées d'une étape."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # dernière case : au-delà de la plus grande borne
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+
+
+class Registry:
+    """Histogrammes du processus, par étape."""
+
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict {étape: (comptes par case, somme, nombre)}
+        """
+        with self._lock:
+            return {
+                stage: (list(h.counts), h.total, h.count)
+                for stage, h in sorted(self._histograms.items())
+            }
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+registry = Registry()
+
+
+@contextmanager
+def collect():
+    """
+    Relève aussi les durées des étapes exécutées dans le bloc (thread courant).
+
+    Yields:
+        Liste de (étape, durée en secondes), complétée à la sortie de chaque étape
+    """
+    previous = getattr(_local, 'stages', None)
+    _local.stages = stages = []
+    try:
+        yield stages
+    finally:
+        _local.stages = previous
+        if previous is not None:
+            previous.extend(stages)
+
+
+@contextmanager
+def timed(stage):
+    """Chronomètre le bloc et l'ajoute à l'histogramme de l'étape."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        if not forward_only:
+            registry.observe(stage, seconds)
+        stages = getattr(_local, 'stages', None)
+        if stages is not None:
+            stages.append((stage, seconds))
+
+
+def record(stages):
+    """Ajoute aux histogrammes les durées relevées par collect() dans un processus de rendu."""
+    for stage, seconds in stages:
+        registry.observe(stage, seconds)
+
+
+def merge(snapshots):
+    """
+    Additionne des histogrammes de plusieurs processus (voir Registry.snapshot).
+    Ceux mesurés avec d'autres bornes (BUCKETS) sont ignorés.
+
+    Returns:
+        dict {étape: (comptes par case, somme, nombre)}
+    """
+    merged = {}
+    for snapshot in snapshots:
+        for stage, (counts, total, count) in snapshot.items():
+            if len(counts) != len(BUCKETS) + 1:
+                continue
+            previous_counts, previous_total, previous_count = merged.get(stage, ([0] * len(counts), 0.0, 0))
+            merged[stage] = (
+                [a + b for a, b in zip(previous_counts, counts)], previous_total + total, previous_count + count
+            )
+    return dict(sorted(merged.items()))
+
+
+def process_name(role='worker'):
+    """Identifiant du processus pour export : 'rôle:hôte:pid'."""
+    return f'{role}:{socket.gethostname()}:{os.getpid()}'
+
+
+def export(name):
+    """
+    Enregistre en base les histogrammes du processus (une ligne par processus,
+    remplacée à chaque export), pour /api/metrics/. Réservé aux processus qui
+    ne servent pas l'endpoint : ceux du processus serveur y sont déjà.
+    Les lignes des processus arrêtés sont gardées : les totaux ne reculent pas.
+    """
+    from cryptage.models import MesuresProcessus
+
+    MesuresProcessus.objects.update_or_create(processus=name, defaults={'histogrammes': registry.snapshot()})
+
+
+def exported_snapshots():
+    """Histogrammes exportés par les autres processus (voir export)."""
+    from cryptage.models import MesuresProcessus
+
+    return list(MesuresProcessus.objects.values_list('histogrammes', flat=True))
+
+
+def start_exporter(name, interval):
+    """
+    Exporte les histogrammes du processus toutes les interval secondes, depuis
+    un thread d'arrière-plan (voir export).
+    """
+    from django.db import connection
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                export(name)
+            except Exception:
+                logger.exception('Export des mesures impossible')
+            finally:
+                # Connexion propre à ce thread : ne pas la garder ouverte entre deux exports
+                connection.close()
+
+    threading.Thread(target=run, name='metrics-exporter', daemon=True).start()
+
+
+def log_event(event, **fields):
+    """Écrit une ligne de log JSON (logger 'cryptage.metrics')."""
+    if logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({'event': event, **fields}, ensure_ascii=False, default=str))
+
+
+def log_stages(event, stages, **fields):
+    """Ligne de log JSON avec la durée totale de chaque étape relevée par collect(), en millisecondes."""
+    totals = {}
+    for stage, seconds in stages:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    log_event(event, **fields, stages_ms={stage: round(1000 * seconds, 3) for stage, seconds in totals.items()})
+
+
+def _format_le(bound):
+    return '+Inf' if bound is None else repr(float(bound))
+
+
+def prometheus_text(extra_counters=None, exported=()):
+    """
+    Histogrammes au format texte Prometheus (version 0.0.4).
+
+    Args:
+        extra_counters: dict {nom de la métrique: [(labels, valeur)]} de compteurs à ajouter
+        exported: Histogrammes d'autres processus à additionner à ceux du
+            processus (voir exported_snapshots)
+
+    Returns:
+        str
+    """
+    name = 'card_generation_stage_duration_seconds'
+    lines = [
+        f'# HELP {name} Durée des étapes de génération des cartes',
+        f'# TYPE {name} histogram',
+    ]
+    for stage, (counts, total, count) in merge([registry.snapshot(), *exported]).items():
+        cumulative = 0
+        for bound, bucket_count in zip(BUCKETS + (None,), counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{stage="{stage}",le="{_format_le(bound)}"}} {cumulative}')
+        lines.append(f'{name}_sum{{stage="{stage}"}} {total!r}')
+        lines.append(f'{name}_count{{stage="{stage}"}} {count}')
+
+    for metric, samples in (extra_counters or {}).items():
+        lines.append(f'# TYPE {metric} counter')
+        for labels, value in samples:
+            label_text = ','.join(f'{key}="{val}"' for key, val in labels.items())
+            lines.append(f'{metric}{{{label_text}}} {value}')
+
+    return '\n'.join(lines) + '\n'
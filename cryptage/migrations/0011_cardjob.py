@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptage', '0010_cardtemplate_remove_stock_image_membres_photo_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('statut', models.CharField(choices=[('en_attente', 'En attente'), ('en_cours', 'En cours'), ('termine', 'Terminé'), ('echec', 'Échec')], db_index=True, default='en_attente', max_length=16)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('traites', models.PositiveIntegerField(default=0)),
+                ('echecs', models.PositiveIntegerField(default=0)),
+                ('message', models.TextField(blank=True)),
+                ('date_creation', models.DateTimeField(auto_now_add=True)),
+                ('date_debut', models.DateTimeField(blank=True, null=True)),
+                ('date_fin', models.DateTimeField(blank=True, null=True)),
+                ('template', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='cryptage.cardtemplate')),
+            ],
+            options={
+                'verbose_name': 'Tâche de génération',
+                'verbose_name_plural': 'Tâches de génération',
+                'ordering': ['date_creation'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CardJobItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('source', models.JSONField()),
+                ('statut', models.CharField(choices=[('en_attente', 'En attente'), ('termine', 'Terminé'), ('echec', 'Échec')], default='en_attente', max_length=16)),
+                ('erreur', models.TextField(blank=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='cryptage.cardjob')),
+                ('stock', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='cryptage.stock')),
+            ],
+            options={
+                'ordering': ['position'],
+                'indexes': [models.Index(fields=['job', 'statut', 'position'], name='cryptage_jobitem_todo_idx')],
+            },
+        ),
+    ]
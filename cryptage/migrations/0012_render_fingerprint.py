@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptage', '0011_cardjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cardjob',
+            name='forcer',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='stock',
+            name='empreinte',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
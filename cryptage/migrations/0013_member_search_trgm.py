@@ -0,0 +1,35 @@
+from django.db import migrations
+
+
+# Colonnes de cryptage_membres couvertes par la recherche (voir cryptage/search.py)
+SEARCH_COLUMNS = ('nom', 'prenom', 'email', 'profession')
+
+
+def create_trigram_indexes(apps, schema_editor):
+    """Index GIN trigrammes sur UPPER(colonne), l'expression utilisée par icontains."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for column in SEARCH_COLUMNS:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS cryptage_membres_{column}_trgm '
+            f'ON cryptage_membres USING gin (UPPER({column}::text) gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for column in SEARCH_COLUMNS:
+        schema_editor.execute(f'DROP INDEX IF EXISTS cryptage_membres_{column}_trgm')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptage', '0012_render_fingerprint'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptage', '0013_member_search_trgm'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['membre', '-date_generation'], name='cryptage_stock_membre_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['template_utilise', '-date_generation'], name='cryptage_stock_tpl_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['-date_generation', '-id'], name='cryptage_stock_date_id_idx'),
+        ),
+    ]
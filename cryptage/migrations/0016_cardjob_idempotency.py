@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptage', '0015_compteur'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cardjob',
+            name='cle_idempotence',
+            field=models.CharField(blank=True, max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='cardjob',
+            name='empreinte_sources',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
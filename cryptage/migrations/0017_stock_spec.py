@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptage', '0016_cardjob_idempotency'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stock',
+            name='spec',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
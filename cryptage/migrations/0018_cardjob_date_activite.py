@@ -0,0 +1,24 @@
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_heartbeat(apps, schema_editor):
+    """Tâches en cours : le dernier signe de vie connu est le début du traitement."""
+    CardJob = apps.get_model('cryptage', 'CardJob')
+    CardJob.objects.filter(date_debut__isnull=False).update(date_activite=F('date_debut'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptage', '0017_stock_spec'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cardjob',
+            name='date_activite',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_heartbeat, migrations.RunPython.noop),
+    ]
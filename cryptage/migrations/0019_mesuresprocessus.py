@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptage', '0018_cardjob_date_activite'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MesuresProcessus',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('processus', models.CharField(max_length=128, unique=True)),
+                ('histogrammes', models.JSONField(default=dict)),
+                ('date_maj', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': "Mesures d'un processus",
+                'verbose_name_plural': 'Mesures des processus',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cryptage', '0019_mesuresprocessus'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stock',
+            name='versions',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
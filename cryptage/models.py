@@ -1,6 +1,47 @@
 from django.db import models
 
 
+class LoadedValuesMixin:
+    """
+    Garde la valeur de certains champs (TRACKED_FIELDS, noms de colonnes)
+    telle qu'elle a été lue en base ou enregistrée : les signaux pre_save
+    connaissent ainsi l'ancienne valeur sans relire la ligne.
+    """
+
+    TRACKED_FIELDS = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = {
+            name: value for name, value in zip(field_names, values) if name in cls.TRACKED_FIELDS
+        }
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+        self.remember_loaded_values(fields)
+
+    def loaded_value(self, name):
+        """
+        Valeur du champ en base. Relue par une requête seulement si l'instance
+        ne l'a pas chargée (champ différé, ligne créée par bulk_create...).
+        """
+        loaded = self.__dict__.setdefault('_loaded_values', {})
+        if name not in loaded:
+            loaded[name] = (
+                type(self)._default_manager.filter(pk=self.pk).values_list(name, flat=True).first()
+            )
+        return loaded[name]
+
+    def remember_loaded_values(self, fields=None):
+        """Note les valeurs actuelles comme celles de la base (après save ou refresh_from_db)."""
+        loaded = self.__dict__.setdefault('_loaded_values', {})
+        for name in self.TRACKED_FIELDS:
+            if fields is None or name in fields or name.removesuffix('_id') in fields:
+                loaded[name] = getattr(self, name)
+
+
 # Create your models here.
 class Departement(models.Model):
     nom_depart = models.CharField(max_length = 64)
@@ -8,7 +49,7 @@ class Departement(models.Model):
     def __str__(self):
         return self.nom_depart
 
-class Membres(models.Model):
+class Membres(LoadedValuesMixin, models.Model):
     nom = models.CharField(max_length = 32)
     prenom = models.CharField(max_length = 32)
     departement = models.ForeignKey(Departement, on_delete = models.CASCADE)
@@ -17,6 +58,9 @@ class Membres(models.Model):
     profession = models.CharField(max_length = 32)
     photo = models.ImageField(upload_to='membres/photos/', null=True, blank=True)
     
+    # Département d'origine, pour déplacer le membre d'un compteur à l'autre (voir signals)
+    TRACKED_FIELDS = ('departement_id',)
+    
     def __str__(self):
         return f"{self.nom} {self.prenom}"
 
@@ -44,21 +88,214 @@ class CardTemplate(models.Model):
         if self.actif:
             CardTemplate.objects.exclude(pk=self.pk).update(actif=False)
         super().save(*args, **kwargs)
+        
+        # Les images ont pu changer : oublier les versions en cache
+        from cryptage.card_generator import template_cache
+        template_cache.invalidate(self.pk)
+    
+    def delete(self, *args, **kwargs):
+        from cryptage.card_generator import template_cache
+        template_cache.invalidate(self.pk)
+        return super().delete(*args, **kwargs)
 
-class Stock(models.Model):
+class Stock(LoadedValuesMixin, models.Model):
     membre = models.ForeignKey(Membres, on_delete = models.CASCADE)
     qr_code = models.ImageField(upload_to='qrcodes/', null=True, blank=True)  # QR code seul
     carte_recto = models.ImageField(upload_to='cartes/recto/', null=True, blank=True)  # Face avant
     carte_verso = models.ImageField(upload_to='cartes/verso/', null=True, blank=True)  # Face arrière avec QR
     carte_pdf = models.FileField(upload_to='cartes/pdf/', null=True, blank=True)  # PDF recto-verso
     template_utilise = models.ForeignKey(CardTemplate, on_delete=models.SET_NULL, null=True, blank=True)
+    empreinte = models.CharField(max_length=64, blank=True)  # Empreinte du rendu (CardGenerator.render_fingerprint)
+    spec = models.JSONField(null=True, blank=True)  # Données du rendu : fichiers générés à la demande (rendering.ensure_artefact)
+    versions = models.JSONField(default=dict, blank=True)  # {champ: [nom du fichier, version]} (voir artefact_version)
     date_generation = models.DateTimeField(auto_now=True)
     
+    # Fichiers de la carte, tels que nommés dans /api/cards/<id>/<artefact>/
+    ARTEFACT_FIELDS = {
+        'qr': 'qr_code',
+        'recto': 'carte_recto',
+        'verso': 'carte_verso',
+        'pdf': 'carte_pdf',
+    }
+    
+    # date_generation change à chaque sauvegarde (auto_now) : garder l'ancienne (voir signals)
+    TRACKED_FIELDS = ('date_generation',)
+    
     class Meta:
         ordering = ['-date_generation']
+        indexes = [
+            # Cartes d'un membre (historique, remplacement, réutilisation)
+            models.Index(fields=['membre', '-date_generation'], name='cryptage_stock_membre_date_idx'),
+            # Filtre par template de la liste d'administration
+            models.Index(fields=['template_utilise', '-date_generation'], name='cryptage_stock_tpl_date_idx'),
+            # Tri par date, filtres par période et pagination par curseur
+            models.Index(fields=['-date_generation', '-id'], name='cryptage_stock_date_id_idx'),
+        ]
+    
+    def artefact_url(self, artefact):
+        """
+        URL d'un fichier de la carte (vue qui le génère à la première demande).
+        Une fois le fichier stocké, l'URL porte la version de son contenu et
+        peut être mise en cache indéfiniment (voir http_cache).
+        
+        Args:
+            artefact: 'qr', 'recto', 'verso' ou 'pdf'
+            
+        Returns:
+            URL relative, ou None si la carte ne peut pas être rendue
+        """
+        from django.urls import reverse
+        
+        field = self.ARTEFACT_FIELDS[artefact]
+        if self.pk is None or (not getattr(self, field) and self.spec is None):
+            return None
+        url = reverse('api:card_artefact', args=[self.pk, artefact])
+        version = self.artefact_version(field)
+        return f'{url}?v={version}' if version else url
+    
+    def artefact_version(self, field):
+        """
+        Version d'un fichier de la carte pour son URL (voir http_cache.file_version).
+        Elle est enregistrée avec le fichier (record_version) : les listes de
+        cartes n'accèdent pas au stockage. Sans version enregistrée pour ce
+        fichier (carte antérieure, fichier remplacé hors de l'application),
+        elle est lue dans le stockage.
+        
+        Args:
+            field: 'qr_code', 'carte_recto', 'carte_verso' ou 'carte_pdf'
+            
+        Returns:
+            Version, ou None si le fichier n'existe pas (encore)
+        """
+        from cryptage.http_cache import file_version
+        
+        file = getattr(self, field)
+        if not file:
+            return None
+        recorded = (self.versions or {}).get(field)
+        if recorded and recorded[0] == file.name:
+            return recorded[1]
+        return file_version(file)
+    
+    def record_version(self, field):
+        """Note (sur l'instance, à sauvegarder) la version d'un fichier qui vient d'être écrit."""
+        from cryptage.http_cache import file_version
+        
+        file = getattr(self, field)
+        self.versions = {**(self.versions or {}), field: [file.name, file_version(file)]}
+    
+    @property
+    def qr_code_url(self):
+        return self.artefact_url('qr')
+    
+    @property
+    def recto_url(self):
+        return self.artefact_url('recto')
+    
+    @property
+    def verso_url(self):
+        return self.artefact_url('verso')
+    
+    @property
+    def pdf_url(self):
+        return self.artefact_url('pdf')
+
+
+class CardJob(models.Model):
+    """Lot de cartes à générer en arrière-plan par le worker (run_card_worker)."""
 
+    EN_ATTENTE = 'en_attente'
+    EN_COURS = 'en_cours'
+    TERMINE = 'termine'
+    ECHEC = 'echec'
+    STATUT_CHOICES = [
+        (EN_ATTENTE, 'En attente'),
+        (EN_COURS, 'En cours'),
+        (TERMINE, 'Terminé'),
+        (ECHEC, 'Échec'),
+    ]
 
+    statut = models.CharField(max_length=16, choices=STATUT_CHOICES, default=EN_ATTENTE, db_index=True)
+    template = models.ForeignKey(CardTemplate, on_delete=models.SET_NULL, null=True, blank=True)
+    forcer = models.BooleanField(default=False)  # Régénérer même les cartes déjà à jour
+    cle_idempotence = models.CharField(max_length=64, unique=True, null=True, blank=True)  # Clé fournie par le client
+    empreinte_sources = models.CharField(max_length=64, blank=True)  # Empreinte du lot soumis (voir jobs.sources_fingerprint)
+    total = models.PositiveIntegerField(default=0)
+    traites = models.PositiveIntegerField(default=0)  # Membres traités (succès + échecs)
+    echecs = models.PositiveIntegerField(default=0)
+    message = models.TextField(blank=True)
+    date_creation = models.DateTimeField(auto_now_add=True)
+    date_debut = models.DateTimeField(null=True, blank=True)
+    date_activite = models.DateTimeField(null=True, blank=True)  # Dernier signe de vie du worker (paquet de cartes enregistré)
+    date_fin = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Tâche de génération"
+        verbose_name_plural = "Tâches de génération"
+        ordering = ['date_creation']
+
+    def __str__(self):
+        return f"Tâche #{self.pk} ({self.get_statut_display()})"
+
+
+class CardJobItem(models.Model):
+    """Un membre d'un lot de génération, avec son résultat."""
+
+    EN_ATTENTE = 'en_attente'
+    TERMINE = 'termine'
+    ECHEC = 'echec'
+    STATUT_CHOICES = [
+        (EN_ATTENTE, 'En attente'),
+        (TERMINE, 'Terminé'),
+        (ECHEC, 'Échec'),
+    ]
+
+    job = models.ForeignKey(CardJob, on_delete=models.CASCADE, related_name='items')
+    position = models.PositiveIntegerField()
+    source = models.JSONField()  # {'member_id': id} ou {'member_data': {...}}
+    statut = models.CharField(max_length=16, choices=STATUT_CHOICES, default=EN_ATTENTE)
+    stock = models.ForeignKey(Stock, on_delete=models.SET_NULL, null=True, blank=True)
+    erreur = models.TextField(blank=True)
+
+    class Meta:
+        ordering = ['position']
+        indexes = [
+            models.Index(fields=['job', 'statut', 'position'], name='cryptage_jobitem_todo_idx'),
+        ]
 
 
+class Compteur(models.Model):
+    """
+    Compteur de statistiques tenu à jour par les signaux (voir cryptage/stats.py).
+    Le dashboard lit ces valeurs au lieu de compter les tables.
+    """
 
+    cle = models.CharField(max_length=64, unique=True)  # 'cartes', 'cartes:jour:2024-01-31', ...
+    valeur = models.BigIntegerField(default=0)
+    date_maj = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        verbose_name = "Compteur"
+        verbose_name_plural = "Compteurs"
+
+    def __str__(self):
+        return f"{self.cle} = {self.valeur}"
+
+
+class MesuresProcessus(models.Model):
+    """
+    Histogrammes des durées de génération exportés par un processus qui ne
+    sert pas /api/metrics/ (worker), pour que l'endpoint les additionne à
+    ceux du processus serveur (voir cryptage/metrics.py).
+    """
+
+    processus = models.CharField(max_length=128, unique=True)  # 'worker:hôte:pid'
+    histogrammes = models.JSONField(default=dict)  # {étape: [comptes par case, somme, nombre]}
+    date_maj = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Mesures d'un processus"
+        verbose_name_plural = "Mesures des processus"
+
+    def __str__(self):
+        return self.processus
@@ -0,0 +1,112 @@
+"""
+Pagination par curseur (keyset) de l'historique des cartes.
+
+Au lieu d'un OFFSET, chaque page reprend après la dernière carte de la page
+précédente, sur l'ordre (date_generation, id) décroissant : la page N coûte
+autant que la page 1, quelle que soit la taille de la table.
+"""
+import base64
+import hashlib
+import json
+
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+# Durée de vie du total mis en cache (secondes)
+TOTAL_CACHE_TIMEOUT = 60
+
+
+class InvalidCursor(ValueError):
+    """Curseur de pagination illisible ou altéré."""
+
+
+def encode_cursor(stock):
+    """Curseur opaque désignant la position juste après cette carte."""
+    payload = json.dumps({'d': stock.date_generation.isoformat(), 'i': stock.pk})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """
+    Returns:
+        (date_generation, id) de la dernière carte de la page précédente
+    """
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        date_generation = parse_datetime(payload['d'])
+        pk = int(payload['i'])
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor('Curseur de pagination invalide')
+    if date_generation is None:
+        raise InvalidCursor('Curseur de pagination invalide')
+    return date_generation, pk
+
+
+def keyset_page(queryset, cursor, limit):
+    """
+    Récupère une page de cartes après le curseur.
+
+    Args:
+        queryset: Cartes à paginer (filtrées, non triées)
+        cursor: Curseur renvoyé par la page précédente, ou '' pour la première page
+        limit: Nombre de cartes par page
+
+    Returns:
+        (cartes de la page, curseur de la page suivante ou None)
+    """
+    queryset = queryset.order_by('-date_generation', '-id')
+    if cursor:
+        date_generation, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(date_generation__lt=date_generation) |
+            Q(date_generation=date_generation, id__lt=pk)
+        )
+
+    # Une carte de plus pour savoir s'il reste une page
+    rows = list(queryset[:limit + 1])
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+    return rows, None
+
+
+def approximate_count(queryset, key):
+    """
+    Nombre de lignes, mis en cache quelques secondes.
+
+    Sans filtre, sur PostgreSQL, l'estimation du planificateur (pg_class.reltuples)
+    évite de parcourir toute la table.
+
+    Args:
+        queryset: Lignes à compter
+        key: Partie variable de la clé de cache (filtres appliqués), None si aucun filtre
+    """
+    cache_key = 'count:%s:%s' % (
+        queryset.model._meta.db_table,
+        hashlib.sha1((key or '').encode()).hexdigest()
+    )
+    total = cache.get(cache_key)
+    if total is not None:
+        return total
+
+    total = None
+    if key is None and connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+        # -1 (ou 0) tant que la table n'a jamais été analysée
+        if row and row[0] > 0:
+            total = row[0]
+
+    if total is None:
+        total = queryset.count()
+
+    cache.set(cache_key, total, TOTAL_CACHE_TIMEOUT)
+    return total
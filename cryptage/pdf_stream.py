@@ -0,0 +1,260 @@
+"""
+Écriture de PDF au fil de l'eau.
+
+ReportLab garde tout le document en mémoire jusqu'à canvas.save() : pour
+des milliers de cartes, cela représente des centaines de Mo et le client
+n'obtient rien avant la fin. StreamingPDFWriter émet chaque objet PDF dès
+qu'il est complet ; seule la table des positions (un entier par objet) est
+gardée jusqu'à la fin du document.
+
+Les PNG RGB / niveaux de gris 8 bits non entrelacés (le format des cartes
+générées) sont intégrés sans décodage : leurs données IDAT sont déjà un flux
+FlateDecode valide avec le prédicteur PNG.
+
+Les images identiques (même contenu) ne sont écrites qu'une fois et
+partagées entre toutes les pages qui les utilisent.
+"""
+import hashlib
+import struct
+import zlib
+from io import BytesIO
+
+from PIL import Image
+
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+class PDFImage:
+    """Image déjà écrite dans le PDF, utilisable sur n'importe quelle page."""
+
+    def __init__(self, ref, name, width, height):
+        self.ref = ref
+        self.name = name
+        self.width = width
+        self.height = height
+
+
+def _escape_text(text):
+    """Encode une chaîne pour l'opérateur Tj (police en WinAnsiEncoding)."""
+    data = text.encode('cp1252', errors='replace')
+    return data.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+
+
+def _png_passthrough(data):
+    """
+    Prépare l'intégration directe d'un PNG dans le PDF.
+
+    Returns:
+        (largeur, hauteur, dictionnaire de l'image, flux) ou None si le PNG
+        n'est pas dans un format intégrable tel quel
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        return None
+
+    position = len(PNG_SIGNATURE)
+    header = None
+    idat = []
+    while position + 8 <= len(data):
+        length, kind = struct.unpack('>I4s', data[position:position + 8])
+        chunk = data[position + 8:position + 8 + length]
+        position += 12 + length
+        if kind == b'IHDR':
+            header = struct.unpack('>IIBBBBB', chunk)
+        elif kind == b'IDAT':
+            idat.append(chunk)
+        elif kind == b'IEND':
+            break
+
+    if header is None or not idat:
+        return None
+    width, height, bit_depth, color_type, _, _, interlace = header
+    colors = {0: 1, 2: 3}.get(color_type)
+    if bit_depth != 8 or colors is None or interlace:
+        return None
+
+    color_space = b'/DeviceRGB' if colors == 3 else b'/DeviceGray'
+    dictionary = (
+        b'/ColorSpace ' + color_space + b' /BitsPerComponent 8 /Filter /FlateDecode '
+        b'/DecodeParms << /Predictor 15 /Colors %d /BitsPerComponent 8 /Columns %d >>'
+        % (colors, width)
+    )
+    return width, height, dictionary, b''.join(idat)
+
+
+def _decoded_image(data):
+    """Intègre n'importe quel format lisible par Pillow (pixels RGB compressés)."""
+    with Image.open(BytesIO(data)) as image:
+        image = image.convert('RGB')
+        width, height = image.size
+        stream = zlib.compress(image.tobytes())
+    dictionary = b'/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode'
+    return width, height, dictionary, stream
+
+
+class StreamingPDFWriter:
+    """
+    Construit un PDF page par page en émettant les octets au fur et à mesure.
+
+    Utilisation :
+        writer = StreamingPDFWriter(A4)
+        image = writer.add_image(png_bytes)
+        writer.draw_image(image, x, y, width, height)
+        writer.draw_string(x, y, "Légende")
+        writer.show_page()
+        yield writer.flush()
+        ...
+        writer.close()
+        yield writer.flush()
+    """
+
+    def __init__(self, page_size, font_size=8):
+        self.page_width, self.page_height = page_size
+        self.font_size = font_size
+        self._chunks = []
+        self._offset = 0
+        self._offsets = []
+        self._page_refs = []
+        self._content = []
+        self._page_images = {}
+        self._images = {}  # empreinte du contenu -> PDFImage déjà écrite
+        self.images_reused = 0
+
+        self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        # Les pages doivent connaître leur parent, écrit seulement à la fin
+        self._pages_ref = self._reserve()
+        self._font_ref = self._reserve()
+        self._write_object(
+            self._font_ref,
+            b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>'
+        )
+
+    def _write(self, data):
+        self._chunks.append(data)
+        self._offset += len(data)
+
+    def _reserve(self):
+        """Réserve un numéro d'objet (écrit plus tard)."""
+        self._offsets.append(None)
+        return len(self._offsets)
+
+    def _write_object(self, ref, body, stream=None):
+        self._offsets[ref - 1] = self._offset
+        self._write(b'%d 0 obj\n' % ref)
+        if stream is None:
+            self._write(body + b'\nendobj\n')
+        else:
+            self._write(body[:-2] + b' /Length %d >>\nstream\n' % len(stream))
+            self._write(stream)
+            self._write(b'\nendstream\nendobj\n')
+
+    def flush(self):
+        """Renvoie les octets produits depuis le dernier appel."""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+    def add_image(self, data):
+        """
+        Écrit une image (octets PNG, WebP, JPEG...) dans le PDF.
+        Une image déjà écrite (même contenu) n'est pas réécrite : l'objet
+        existant est réutilisé.
+
+        Returns:
+            PDFImage à passer à draw_image
+        """
+        digest = hashlib.sha256(data).digest()
+        image = self._images.get(digest)
+        if image is not None:
+            self.images_reused += 1
+            return image
+
+        prepared = _png_passthrough(data) or _decoded_image(data)
+        width, height, dictionary, stream = prepared
+
+        ref = self._reserve()
+        self._write_object(
+            ref,
+            b'<< /Type /XObject /Subtype /Image /Width %d /Height %d ' % (width, height)
+            + dictionary + b' >>',
+            stream
+        )
+        image = PDFImage(ref, b'Im%d' % (len(self._images) + 1), width, height)
+        self._images[digest] = image
+        return image
+
+    def draw_image(self, image, x, y, width, height, preserve_aspect_ratio=True):
+        """
+        Place une image dans le rectangle donné (en points, origine en bas à gauche).
+        Avec preserve_aspect_ratio, l'image est centrée sans être déformée.
+        """
+        if preserve_aspect_ratio:
+            scale = min(width / image.width, height / image.height)
+            draw_width, draw_height = image.width * scale, image.height * scale
+            x += (width - draw_width) / 2
+            y += (height - draw_height) / 2
+            width, height = draw_width, draw_height
+
+        self._page_images[image.name] = image.ref
+        self._content.append(
+            b'q %.4f 0 0 %.4f %.4f %.4f cm /%s Do Q' % (width, height, x, y, image.name)
+        )
+
+    def draw_string(self, x, y, text):
+        """Écrit une ligne de texte en Helvetica."""
+        self._content.append(
+            b'BT /F1 %d Tf %.4f %.4f Td (%s) Tj ET' % (self.font_size, x, y, _escape_text(text))
+        )
+
+    def show_page(self):
+        """Termine la page en cours (ignorée si elle est vide)."""
+        if self._content:
+            self._write_page()
+
+    def _write_page(self):
+        """Écrit la page en cours (contenu, puis objet page)."""
+        content_ref = self._reserve()
+        self._write_object(
+            content_ref,
+            b'<< /Filter /FlateDecode >>',
+            zlib.compress(b'\n'.join(self._content))
+        )
+
+        images = b' '.join(b'/%s %d 0 R' % (name, ref) for name, ref in self._page_images.items())
+        page_ref = self._reserve()
+        self._write_object(
+            page_ref,
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.4f %.4f] '
+            b'/Resources << /Font << /F1 %d 0 R >> /XObject << %s >> >> /Contents %d 0 R >>'
+            % (self._pages_ref, self.page_width, self.page_height, self._font_ref, images, content_ref)
+        )
+        self._page_refs.append(page_ref)
+        self._content = []
+        self._page_images = {}
+
+    def close(self):
+        """
+        Termine le document : arbre des pages, catalogue et table des positions.
+        Un document sans aucune page reçoit une page blanche (comme avec
+        ReportLab) : un arbre de pages vide n'est pas lu par tous les lecteurs.
+        """
+        self.show_page()
+        if not self._page_refs:
+            self._write_page()
+
+        kids = b' '.join(b'%d 0 R' % ref for ref in self._page_refs)
+        self._write_object(
+            self._pages_ref,
+            b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self._page_refs))
+        )
+        catalog_ref = self._reserve()
+        self._write_object(catalog_ref, b'<< /Type /Catalog /Pages %d 0 R >>' % self._pages_ref)
+
+        xref_offset = self._offset
+        self._write(b'xref\n0 %d\n0000000000 65535 f \n' % (len(self._offsets) + 1))
+        for offset in self._offsets:
+            self._write(b'%010d 00000 n \n' % offset)
+        self._write(
+            b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+            % (len(self._offsets) + 1, catalog_ref, xref_offset)
+        )
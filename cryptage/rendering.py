@@ -0,0 +1,673 @@
+"""
+Moteur de rendu des cartes.
+
+Le rendu (Pillow / ReportLab) est confié à un pool de processus : les
+processus de travail ne font que du calcul et renvoient les octets des
+fichiers générés. Le processus parent se charge seul de la base de données
+et du stockage des fichiers.
+"""
+import os
+import traceback
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import prefetch_related_objects
+
+from cryptage import metrics
+from cryptage.card_generator import CardGenerator
+from cryptage.image_encoding import artefact_extension, encode_artefact
+from cryptage.media_gc import delete_files
+from cryptage.metrics import timed
+
+
+# Champs de Stock générés pour chaque carte : (champ, suffixe du nom)
+# L'extension des images dépend de leur encodage (voir image_encoding)
+ARTEFACTS = (
+    ('qr_code', 'qr'),
+    ('carte_recto', 'recto'),
+    ('carte_verso', 'verso'),
+    ('carte_pdf', 'carte'),
+)
+
+# Nombre de cartes enregistrées par transaction lors d'une génération en lot
+STORE_BATCH_SIZE = 50
+
+# Erreur d'une carte dont le rendu a arrêté son processus de travail
+WORKER_CRASHED = 'Processus de rendu interrompu (mémoire, signal...)'
+
+
+class TemplateUnavailable(Exception):
+    """Le template d'une carte a été supprimé : ses fichiers ne peuvent plus être générés."""
+
+
+@timed('render')
+def render_card_artefacts(membre, template, fields=None):
+    """
+    Génère les fichiers d'une carte (QR code, recto, verso, PDF).
+
+    Args:
+        membre: Instance du modèle Membres (departement déjà chargé)
+        template: Instance du modèle CardTemplate, ou None pour les faces par
+            défaut (le template actif n'est jamais choisi ici)
+        fields: Champs Stock à générer (défaut : tous)
+
+    Returns:
+        dict {nom du champ Stock: bytes}
+    """
+    generator = CardGenerator(membre, template=template, use_active_template=False)
+    renderers = {
+        'qr_code': lambda: encode_artefact(generator.generate_qr_code(), 'qr_code'),
+        'carte_recto': lambda: encode_artefact(generator.generate_card_front(), 'carte_recto'),
+        'carte_verso': lambda: encode_artefact(generator.generate_card_back(), 'carte_verso'),
+        'carte_pdf': lambda: generator.generate_pdf().getvalue(),
+    }
+    return {
+        field: renderers[field]()
+        for field, _ in ARTEFACTS
+        if fields is None or field in fields
+    }
+
+
+def render_spec(membre, template):
+    """
+    Données du membre et template qui déterminent le rendu de sa carte,
+    enregistrés avec la carte (Stock.spec) : un fichier généré plus tard à la
+    demande est identique à celui qu'aurait produit la génération.
+
+    Args:
+        membre: Instance du modèle Membres (departement déjà chargé)
+        template: Instance du modèle CardTemplate, ou None (faces par défaut)
+
+    Returns:
+        dict sérialisable en JSON
+    """
+    return {
+        'template': template.pk if template else None,
+        'nom': membre.nom,
+        'prenom': membre.prenom,
+        'departement': membre.departement.nom_depart,
+        'telephone': membre.telephone,
+        'email': membre.email,
+        'profession': membre.profession,
+        'photo': membre.photo.name if membre.photo else '',
+    }
+
+
+def membre_from_spec(stock):
+    """Membre (non sauvegardé) tel qu'il était à la génération de la carte."""
+    from cryptage.models import Departement, Membres
+
+    spec = stock.spec
+    return Membres(
+        pk=stock.membre_id,
+        nom=spec['nom'],
+        prenom=spec['prenom'],
+        departement=Departement(nom_depart=spec['departement']),
+        telephone=spec['telephone'],
+        email=spec['email'],
+        profession=spec['profession'],
+        photo=spec['photo'] or None,
+    )
+
+
+def template_from_spec(stock):
+    """
+    Template avec lequel la carte a été générée (None : faces par défaut).
+    Sans template dans la spec (carte antérieure), template_utilise fait foi.
+
+    Raises:
+        TemplateUnavailable: le template de la carte a été supprimé
+    """
+    template_id = (stock.spec or {}).get('template')
+    if template_id is not None and stock.template_utilise_id != template_id:
+        raise TemplateUnavailable(
+            f"Template #{template_id} de la carte #{stock.pk} supprimé : fichier impossible à générer"
+        )
+    return stock.template_utilise
+
+
+def card_fingerprint(membre, template):
+    """Empreinte du rendu de la carte d'un membre (voir CardGenerator.render_fingerprint)."""
+    return CardGenerator(membre, template=template, use_active_template=False).render_fingerprint()
+
+
+@timed('reuse_lookup')
+def find_reusable_cards(membres, fingerprints):
+    """
+    Cherche, pour chaque membre, une carte déjà générée avec la même empreinte
+    et dont tous les fichiers sont encore présents ou peuvent être générés à
+    la demande (Stock.spec).
+
+    Args:
+        membres: Instances Membres
+        fingerprints: Empreintes correspondantes (même ordre)
+
+    Returns:
+        dict {id du membre: Stock réutilisable}
+    """
+    from cryptage.models import Stock
+
+    wanted = {membre.pk: fingerprint for membre, fingerprint in zip(membres, fingerprints)}
+    if not wanted:
+        return {}
+
+    reusable = {}
+    candidates = Stock.objects.filter(
+        membre_id__in=wanted.keys(), empreinte__in=set(wanted.values())
+    ).exclude(empreinte='').select_related('template_utilise').order_by('-date_generation')
+
+    for stock in candidates:
+        if stock.membre_id in reusable or wanted[stock.membre_id] != stock.empreinte:
+            continue
+        if stock.spec is not None:
+            reusable[stock.membre_id] = stock
+            continue
+        fields = [getattr(stock, field) for field, _ in ARTEFACTS]
+        if all(f and f.storage.exists(f.name) for f in fields):
+            reusable[stock.membre_id] = stock
+    return reusable
+
+
+def _artefact_name(membre, field):
+    """Nom (unique) du fichier d'une carte."""
+    suffix = dict(ARTEFACTS)[field]
+    extension = 'pdf' if field == 'carte_pdf' else artefact_extension(field)
+    return f"{membre.prenom}_{membre.nom}_{suffix}_{uuid.uuid4().hex[:8]}.{extension}"
+
+
+def _stock_files(stocks):
+    """Fichiers écrits pour des entrées Stock : liste de (storage, nom)."""
+    return [
+        (file.storage, file.name)
+        for stock in stocks
+        for file in (getattr(stock, field) for field, _ in ARTEFACTS)
+        if file
+    ]
+
+
+def _build_stock(membre, template, artefacts, fingerprint=''):
+    """
+    Écrit les fichiers d'une carte dans le stockage et renvoie l'entrée Stock (non sauvegardée).
+    Sans artefacts, aucun fichier n'est écrit : ils seront générés à la demande.
+    """
+    from cryptage.models import Stock
+
+    stock = Stock(membre=membre, template_utilise=template, empreinte=fingerprint, spec=render_spec(membre, template))
+    if artefacts is None:
+        return stock
+    with timed('storage_write'):
+        try:
+            for field, _ in ARTEFACTS:
+                getattr(stock, field).save(
+                    _artefact_name(membre, field), ContentFile(artefacts[field]), save=False
+                )
+                stock.record_version(field)
+        except BaseException:
+            delete_files(_stock_files([stock]))
+            raise
+    return stock
+
+
+def store_card(membre, template, artefacts, fingerprint='', replace=True):
+    """
+    Enregistre les fichiers générés dans une nouvelle entrée Stock.
+    Si l'enregistrement échoue, les fichiers écrits sont supprimés.
+
+    Args:
+        membre: Instance du modèle Membres
+        template: Instance du modèle CardTemplate
+        artefacts: dict renvoyé par render_card_artefacts, ou None pour
+            générer les fichiers à la demande (voir ensure_artefact)
+        fingerprint: Empreinte du rendu (voir card_fingerprint)
+        replace: Supprimer les anciennes cartes du membre pour éviter les doublons
+
+    Returns:
+        L'instance Stock sauvegardée
+    """
+    from cryptage.models import Stock
+
+    stock = _build_stock(membre, template, artefacts, fingerprint)
+    try:
+        with timed('db_write'), transaction.atomic():
+            stock.save()
+            # Les anciennes cartes ne sont supprimées qu'une fois la nouvelle enregistrée
+            if replace:
+                Stock.objects.filter(membre=membre).exclude(pk=stock.pk).delete()
+    except BaseException:
+        delete_files(_stock_files([stock]))
+        raise
+    return stock
+
+
+def store_cards(entries, template, replace=True):
+    """
+    Enregistre un paquet de cartes en une transaction : un INSERT groupé
+    pour les nouvelles entrées Stock, un DELETE pour les anciennes.
+    Si la transaction échoue, les fichiers écrits pour le paquet sont supprimés.
+
+    Args:
+        entries: Liste de (membre, artefacts ou None, empreinte) ; un membre
+            présent plusieurs fois n'a qu'une carte (sa dernière entrée)
+        template: Instance du modèle CardTemplate
+        replace: Supprimer les anciennes cartes des membres
+
+    Returns:
+        Liste des instances Stock sauvegardées (une par entrée, même ordre)
+    """
+    from django.utils import timezone
+
+    from cryptage import stats
+    from cryptage.models import Stock
+
+    unique = {membre.pk: (membre, artefacts, fingerprint) for membre, artefacts, fingerprint in entries}
+    if not unique:
+        return []
+
+    stocks = {}
+    try:
+        for member_id, (membre, artefacts, fingerprint) in unique.items():
+            stocks[member_id] = _build_stock(membre, template, artefacts, fingerprint)
+
+        # bulk_create ne passe pas par pre_save : fixer la date (auto_now) ici
+        now = timezone.now()
+        for stock in stocks.values():
+            stock.date_generation = now
+
+        with timed('db_write'), transaction.atomic(), stats.deferred():
+            Stock.objects.bulk_create(list(stocks.values()))
+            # Les anciennes cartes ne sont supprimées qu'une fois les nouvelles enregistrées
+            if replace:
+                Stock.objects.filter(
+                    membre_id__in=stocks.keys()
+                ).exclude(pk__in=[stock.pk for stock in stocks.values()]).delete()
+            # bulk_create ne déclenche pas les signaux
+            stats.increment_many({
+                stats.CARTES: len(stocks),
+                stats.day_key(timezone.localdate(now)): len(stocks),
+            })
+    except BaseException:
+        delete_files(_stock_files(stocks.values()))
+        raise
+    return [stocks[membre.pk] for membre, _, _ in entries]
+
+
+def reuse_card(stock, replace=True):
+    """
+    Garde une carte à jour au lieu de la régénérer.
+
+    Args:
+        stock: Carte renvoyée par find_reusable_cards
+        replace: Supprimer les autres cartes du membre
+
+    Returns:
+        L'instance Stock conservée
+    """
+    from cryptage.models import Stock
+
+    if replace:
+        Stock.objects.filter(membre_id=stock.membre_id).exclude(pk=stock.pk).delete()
+    return stock
+
+
+def ensure_artefact(stock, field):
+    """
+    Renvoie un fichier de la carte, généré et stocké à la première demande
+    (carte enregistrée sans ses fichiers, ou fichier disparu du stockage).
+
+    Le rendu se fait sous verrou de la ligne Stock : deux requêtes
+    simultanées ne génèrent pas deux fois le même fichier.
+
+    Args:
+        stock: Instance Stock (mise à jour avec le nom du fichier)
+        field: Champ du fichier ('qr_code', 'carte_recto', 'carte_verso' ou 'carte_pdf')
+
+    Returns:
+        FieldFile du fichier
+
+    Raises:
+        TemplateUnavailable: fichier à générer, mais template de la carte supprimé
+    """
+    from cryptage.models import Stock
+
+    current = getattr(stock, field)
+    if current and current.storage.exists(current.name):
+        return current
+
+    with transaction.atomic():
+        locked = Stock.objects.select_for_update().select_related(
+            'membre__departement', 'template_utilise'
+        ).get(pk=stock.pk)
+        file = getattr(locked, field)
+        if not (file and file.storage.exists(file.name)):
+            # Sans spec (carte antérieure), le membre actuel fait foi
+            membre = membre_from_spec(locked) if locked.spec is not None else locked.membre
+            content = render_card_artefacts(membre, template_from_spec(locked), fields=[field])[field]
+            with timed('storage_write'):
+                file.save(_artefact_name(membre, field), ContentFile(content), save=False)
+                locked.record_version(field)
+            # update() : ni date de génération modifiée, ni signaux
+            with timed('db_write'):
+                Stock.objects.filter(pk=locked.pk).update(**{field: file.name, 'versions': locked.versions})
+
+    setattr(stock, field, file.name)
+    stock.versions = locked.versions
+    return getattr(stock, field)
+
+
+def _init_worker():
+    """Initialise un processus de rendu."""
+    import django
+    from django.apps import apps
+    from django.db import connections
+
+    if not apps.ready:
+        django.setup()
+
+    # Les durées mesurées ici sont renvoyées au parent avec les fichiers
+    metrics.forward_only = True
+
+    # Les connexions héritées du parent (fork) ne doivent jamais être réutilisées
+    for conn in connections.all(initialized_only=True):
+        conn.connection = None
+
+
+def _render_one(membre, template):
+    """
+    Rend une carte sans lever d'exception.
+
+    Returns:
+        (artefacts, erreur, durées des étapes) : artefacts vaut None et erreur
+        contient le message en cas d'échec
+    """
+    with metrics.collect() as stages:
+        try:
+            artefacts, error = render_card_artefacts(membre, template), None
+        except Exception as e:
+            traceback.print_exc()
+            artefacts, error = None, str(e)
+    return artefacts, error, stages
+
+
+def _log_render(membre, error, stages):
+    """Ligne de log JSON des durées de rendu d'une carte."""
+    metrics.log_stages('card_rendered', stages, membre_id=membre.pk, error=error)
+
+
+class BulkCardRenderer:
+    """
+    Rend un lot de cartes en parallèle dans un pool de processus.
+
+    Les résultats sont renvoyés dans l'ordre des membres, au fil de l'eau :
+    le parent peut enregistrer une carte pendant que les suivantes sont rendues.
+    """
+
+    # Nombre de rendus en attente par processus (borne la mémoire du parent)
+    PENDING_PER_WORKER = 4
+
+    def __init__(self, template, max_workers=None):
+        """
+        Args:
+            template: Instance du modèle CardTemplate utilisée pour tout le lot
+            max_workers: Nombre de processus (par défaut settings.CARD_RENDER_WORKERS,
+                0 signifiant un processus par CPU)
+        """
+        if max_workers is None:
+            max_workers = getattr(settings, 'CARD_RENDER_WORKERS', 0)
+        self.template = template
+        self.max_workers = max_workers or os.cpu_count() or 1
+
+    def render(self, membres):
+        """
+        Rend les cartes d'une liste de membres.
+
+        Args:
+            membres: Instances Membres avec leur departement déjà chargé
+                (les processus de rendu n'accèdent pas à la base)
+
+        Yields:
+            (membre, artefacts, erreur) : artefacts vaut None en cas d'erreur
+        """
+        membres = list(membres)
+        workers = min(self.max_workers, len(membres))
+
+        # Pas de pool pour un seul rendu : le coût de démarrage l'emporterait
+        if workers <= 1:
+            for membre in membres:
+                artefacts, error, stages = _render_one(membre, self.template)
+                _log_render(membre, error, stages)
+                yield membre, artefacts, error
+            return
+
+        remaining = deque(membres)
+        while remaining:
+            suspects = yield from self._render_in_pool(remaining, workers)
+            # Processus de rendu arrêté net : les rendus en cours sont repris un
+            # par un, chacun dans un pool neuf, pour que seul le responsable échoue
+            for membre in suspects:
+                if (yield from self._render_in_pool(deque([membre]), 1)):
+                    _log_render(membre, WORKER_CRASHED, [])
+                    yield membre, None, WORKER_CRASHED
+
+    def _render_in_pool(self, remaining, workers):
+        """
+        Rend les membres de remaining (retirés au fur et à mesure) dans un pool.
+
+        Yields:
+            (membre, artefacts, erreur), dans l'ordre des membres
+
+        Returns:
+            Membres dont le rendu était en cours si un processus du pool s'est
+            arrêté (mémoire, signal...) : le pool est alors inutilisable
+        """
+        pending = deque()
+        window = workers * self.PENDING_PER_WORKER
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+            while remaining or pending:
+                try:
+                    while remaining and len(pending) < window:
+                        future = pool.submit(_render_one, remaining[0], self.template)
+                        pending.append((remaining.popleft(), future))
+                    membre, future = pending[0]
+                    artefacts, error, stages = future.result()
+                except BrokenProcessPool:
+                    traceback.print_exc()
+                    return [membre for membre, _ in pending]
+                except Exception as e:
+                    artefacts, error, stages = None, str(e), []
+                pending.popleft()
+                # Durées mesurées dans le processus de rendu : ajoutées aux histogrammes d'ici
+                metrics.record(stages)
+                _log_render(membre, error, stages)
+                yield membre, artefacts, error
+        return []
+
+
+@timed('member_lookup')
+def resolve_members(sources):
+    """
+    Récupère ou crée les membres d'un lot.
+
+    Args:
+        sources: Liste de dicts {'member_id': id} ou {'member_data': {...}}
+
+    Returns:
+        (membres, erreurs) : membres est une liste de (index, membre) avec
+        leur departement chargé, erreurs une liste de (index, message)
+    """
+    from cryptage.bulk_import import import_each, import_members
+    from cryptage.models import Membres
+
+    membres = []
+    errors = []
+
+    # Membres existants : une seule requête
+    member_ids = [source['member_id'] for source in sources if 'member_id' in source]
+    found = Membres.objects.select_related('departement').in_bulk(member_ids)
+
+    data_indexes = []
+    for index, source in enumerate(sources):
+        if 'member_id' not in source:
+            data_indexes.append(index)
+            continue
+        membre = found.get(source['member_id'])
+        if membre is None:
+            errors.append((index, 'Membres matching query does not exist.'))
+        else:
+            membres.append((index, membre))
+
+    # Nouveaux membres : départements et emails résolus en quelques requêtes groupées
+    if data_indexes:
+        members_data = [sources[index]['member_data'] for index in data_indexes]
+        try:
+            imported, import_errors = import_members(members_data)
+        except Exception:
+            # Lot refusé par la base : reprendre les entrées une à une pour isoler l'erreur
+            traceback.print_exc()
+            imported, import_errors = import_each(members_data)
+        membres += [(data_indexes[position], membre) for position, membre in imported]
+        errors += [(data_indexes[position], error) for position, error in import_errors]
+
+    # Les processus de rendu n'accèdent pas à la base : charger les départements ici
+    prefetch_related_objects([membre for _, membre in membres], 'departement')
+    return membres, errors
+
+
+def generate_cards(sources, template, max_workers=None, force=False, lazy=None):
+    """
+    Génère et enregistre les cartes d'un lot (voir generate_card_batches).
+
+    Yields:
+        (index dans sources, stock, erreur) : stock vaut None en cas d'erreur
+    """
+    for results in generate_card_batches(sources, template, max_workers, force, lazy):
+        yield from results
+
+
+def generate_card_batches(sources, template, max_workers=None, force=False, lazy=None, heartbeat=None):
+    """
+    Génère et enregistre les cartes d'un lot, paquet par paquet.
+
+    Les cartes dont l'empreinte de rendu n'a pas changé sont réutilisées telles
+    quelles. Le rendu des autres est parallélisé par BulkCardRenderer,
+    l'enregistrement se fait dans ce processus au fil des résultats, par
+    paquets de STORE_BATCH_SIZE cartes (voir store_cards).
+
+    En mode différé (lazy), aucun fichier n'est rendu : seules les entrées
+    Stock sont enregistrées, chaque fichier est généré à sa première demande
+    (voir ensure_artefact).
+
+    Args:
+        sources: Liste de dicts {'member_id': id} ou {'member_data': {...}}
+        template: Instance du modèle CardTemplate
+        max_workers: Nombre de processus de rendu (voir BulkCardRenderer)
+        force: Régénérer même les cartes déjà à jour
+        lazy: Différer le rendu des fichiers (défaut : settings.CARD_LAZY_ARTEFACTS)
+        heartbeat: Fonction sans argument appelée régulièrement pendant la
+            préparation du lot (membres, empreintes, cartes réutilisables),
+            avant le premier paquet enregistré (optionnelle)
+
+    Yields:
+        Liste de (index dans sources, stock, erreur) par paquet traité (stock
+        vaut None en cas d'erreur) : les cartes d'un paquet sont toutes
+        enregistrées quand il est renvoyé
+    """
+    if lazy is None:
+        lazy = getattr(settings, 'CARD_LAZY_ARTEFACTS', False)
+
+    heartbeat = heartbeat or (lambda: None)
+
+    membres, errors = resolve_members(sources)
+    heartbeat()
+    if errors:
+        yield [(index, None, error) for index, error in errors]
+
+    # Empreintes calculées ici : les cartes inchangées ne partent pas au rendu.
+    # Chacune relit la photo du membre : signe de vie tous les STORE_BATCH_SIZE membres
+    fingerprints = {}
+    for position, (index, membre) in enumerate(membres, 1):
+        try:
+            fingerprints[index] = card_fingerprint(membre, template)
+        except Exception:
+            traceback.print_exc()
+            fingerprints[index] = ''
+        if position % STORE_BATCH_SIZE == 0:
+            heartbeat()
+
+    reusable = {} if force else find_reusable_cards(
+        [membre for _, membre in membres], [fingerprints[index] for index, _ in membres]
+    )
+    heartbeat()
+
+    to_render = []
+    reused = []
+    for index, membre in membres:
+        stock = reusable.get(membre.pk)
+        if stock is not None:
+            reused.append((index, stock))
+        else:
+            to_render.append((index, membre))
+
+    if reused:
+        # Une seule requête pour supprimer les autres cartes des membres réutilisés
+        from cryptage import stats
+        from cryptage.models import Stock
+
+        with stats.deferred():
+            Stock.objects.filter(
+                membre_id__in=[stock.membre_id for _, stock in reused]
+            ).exclude(pk__in=[stock.pk for _, stock in reused]).delete()
+        yield [(index, stock, None) for index, stock in reused]
+
+    indexes = [index for index, _ in to_render]
+    if lazy:
+        results = ((membre, None, None) for _, membre in to_render)
+    else:
+        renderer = BulkCardRenderer(template, max_workers=max_workers)
+        results = renderer.render(membre for _, membre in to_render)
+
+    batch = []
+    failed = []
+    for index, (membre, artefacts, error) in zip(indexes, results):
+        if error is not None:
+            failed.append((index, None, error))
+        else:
+            batch.append((index, membre, artefacts, fingerprints[index]))
+        if len(batch) + len(failed) >= STORE_BATCH_SIZE:
+            yield failed + list(_store_batch(batch, template))
+            batch, failed = [], []
+    if batch or failed:
+        yield failed + list(_store_batch(batch, template))
+
+
+def _store_batch(batch, template):
+    """
+    Enregistre un paquet de cartes rendues (voir store_cards).
+    Si le paquet échoue, les cartes sont reprises une à une pour isoler l'erreur.
+
+    Yields:
+        (index, stock, erreur)
+    """
+    if not batch:
+        return
+    try:
+        stocks = store_cards(
+            [(membre, artefacts, fingerprint) for _, membre, artefacts, fingerprint in batch], template
+        )
+    except Exception:
+        traceback.print_exc()
+    else:
+        for (index, _, _, _), stock in zip(batch, stocks):
+            yield index, stock, None
+        return
+
+    for index, membre, artefacts, fingerprint in batch:
+        try:
+            yield index, store_card(membre, template, artefacts, fingerprint), None
+        except Exception as e:
+            traceback.print_exc()
+            yield index, None, str(e)
@@ -0,0 +1,64 @@
+"""
+Recherche de membres (nom, prénom, email, profession).
+
+Chaque mot de la recherche doit apparaître dans l'un des champs :
+« jean dupont » trouve le membre Jean DUPONT.
+
+Sur PostgreSQL, la recherche s'appuie sur des index trigrammes (pg_trgm,
+migration 0013) posés sur UPPER(champ) : c'est l'expression produite par
+`icontains`, les index sont donc utilisés même pour un motif '%...%' et le
+temps de recherche ne dépend plus du nombre de membres. Sur SQLite (tests),
+la même requête s'exécute sans index.
+"""
+from django.db.models import Q
+
+
+# Champs de Membres couverts par la recherche (et par les index trigrammes)
+SEARCH_FIELDS = ('nom', 'prenom', 'email', 'profession')
+
+# Nombre maximum de mots pris en compte
+MAX_TERMS = 5
+
+
+def search_terms(query):
+    """Découpe une recherche en mots (sans doublons, dans l'ordre)."""
+    terms = []
+    for term in (query or '').split():
+        if term.lower() not in (t.lower() for t in terms):
+            terms.append(term)
+    return terms[:MAX_TERMS]
+
+
+def member_search_filter(query, prefix=''):
+    """
+    Construit le filtre de recherche.
+
+    Args:
+        query: Texte saisi par l'utilisateur
+        prefix: Chemin vers le membre depuis le modèle filtré ('membre__' pour Stock)
+
+    Returns:
+        Objet Q, ou None si la recherche est vide
+    """
+    terms = search_terms(query)
+    if not terms:
+        return None
+
+    condition = Q()
+    for term in terms:
+        matches = Q()
+        for field in SEARCH_FIELDS:
+            matches |= Q(**{f'{prefix}{field}__icontains': term})
+        condition &= matches
+    return condition
+
+
+def search_members(queryset, query, prefix=''):
+    """
+    Filtre un queryset (Membres, ou Stock avec prefix='membre__') par recherche.
+    Une recherche vide renvoie le queryset inchangé.
+    """
+    condition = member_search_filter(query, prefix)
+    if condition is None:
+        return queryset
+    return queryset.filter(condition)
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from cryptage.models import Membres, Departement, Stock, CardTemplate
+from cryptage.models import Membres, Departement, Stock, CardTemplate, CardJob, CardJobItem
 
 
 class DepartementSerializer(serializers.ModelSerializer):
@@ -97,6 +97,11 @@ class StockSerializer(serializers.ModelSerializer):
     
     membre = MembreSerializer(read_only=True)
     template = CardTemplateSerializer(source='template_utilise', read_only=True)
+    # Fichier stocké, ou vue qui le génère à la première demande
+    qr_code = serializers.SerializerMethodField()
+    carte_recto = serializers.SerializerMethodField()
+    carte_verso = serializers.SerializerMethodField()
+    carte_pdf = serializers.SerializerMethodField()
     
     class Meta:
         model = Stock
@@ -105,6 +110,25 @@ class StockSerializer(serializers.ModelSerializer):
             'carte_pdf', 'template', 'date_generation'
         ]
         read_only_fields = fields
+    
+    def _artefact_url(self, obj, artefact):
+        url = obj.artefact_url(artefact)
+        request = self.context.get('request')
+        if url and request is not None:
+            return request.build_absolute_uri(url)
+        return url
+    
+    def get_qr_code(self, obj):
+        return self._artefact_url(obj, 'qr')
+    
+    def get_carte_recto(self, obj):
+        return self._artefact_url(obj, 'recto')
+    
+    def get_carte_verso(self, obj):
+        return self._artefact_url(obj, 'verso')
+    
+    def get_carte_pdf(self, obj):
+        return self._artefact_url(obj, 'pdf')
 
 
 class CardGenerationResponseSerializer(serializers.Serializer):
@@ -137,6 +161,12 @@ class BulkCardGenerationRequestSerializer(serializers.Serializer):
     
     template_id = serializers.IntegerField(required=False)
     
+    idempotency_key = serializers.CharField(
+        max_length=64,
+        required=False,
+        help_text="Clé du lot : renvoyer le même lot avec la même clé reprend la génération"
+    )
+    
     def validate(self, data):
         """Valider qu'on a au moins une liste."""
         if not data.get('member_ids') and not data.get('members_data'):
@@ -156,3 +186,43 @@ class BulkCardGenerationResponseSerializer(serializers.Serializer):
     failed = serializers.IntegerField()
     cards = StockSerializer(many=True, required=False)
     errors = serializers.ListField(required=False)
+
+
+class CardJobItemSerializer(serializers.ModelSerializer):
+    """Serializer pour le résultat d'un membre dans une tâche de génération."""
+    
+    status = serializers.CharField(source='statut', read_only=True)
+    error = serializers.CharField(source='erreur', read_only=True)
+    card = StockSerializer(source='stock', read_only=True)
+    
+    class Meta:
+        model = CardJobItem
+        fields = ['position', 'source', 'status', 'card', 'error']
+        read_only_fields = fields
+
+
+class CardJobSerializer(serializers.ModelSerializer):
+    """Serializer pour une tâche de génération en arrière-plan."""
+    
+    status = serializers.CharField(source='statut', read_only=True)
+    processed = serializers.IntegerField(source='traites', read_only=True)
+    failed = serializers.IntegerField(source='echecs', read_only=True)
+    generated = serializers.SerializerMethodField()
+    progress = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = CardJob
+        fields = [
+            'id', 'status', 'template', 'total', 'processed', 'generated', 'failed',
+            'progress', 'message', 'date_creation', 'date_debut', 'date_fin'
+        ]
+        read_only_fields = fields
+    
+    def get_generated(self, obj):
+        return obj.traites - obj.echecs
+    
+    def get_progress(self, obj):
+        """Pourcentage de membres traités."""
+        if not obj.total:
+            return 100
+        return round(100 * obj.traites / obj.total, 1)
@@ -0,0 +1,102 @@
+"""
+Mise à jour des compteurs de statistiques (cryptage/stats.py) et suppression
+des fichiers des lignes supprimées (cryptage/media_gc.py).
+Connectés au démarrage de l'application (CryptageConfig.ready).
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from cryptage import stats
+from cryptage.media_gc import delete_files_on_commit
+from cryptage.models import CardTemplate, Departement, Membres, Stock
+
+
+@receiver(post_save, sender=Departement)
+def departement_saved(sender, instance, created, **kwargs):
+    if created:
+        stats.increment(stats.DEPARTEMENTS)
+
+
+@receiver(post_delete, sender=Departement)
+def departement_deleted(sender, instance, **kwargs):
+    stats.increment(stats.DEPARTEMENTS, -1)
+    stats.forget(stats.departement_key(instance.pk))
+
+
+@receiver(post_save, sender=CardTemplate)
+def template_saved(sender, instance, created, **kwargs):
+    if created:
+        stats.increment(stats.TEMPLATES)
+
+
+@receiver(post_delete, sender=CardTemplate)
+def template_deleted(sender, instance, **kwargs):
+    stats.increment(stats.TEMPLATES, -1)
+
+
+@receiver(pre_save, sender=Membres)
+def membre_before_save(sender, instance, **kwargs):
+    # Département avant modification, pour déplacer le membre d'un compteur à l'autre
+    # (gardé à la lecture de l'instance : pas de requête, voir LoadedValuesMixin)
+    if not instance._state.adding:
+        instance._departement_precedent = instance.loaded_value('departement_id')
+
+
+@receiver(post_save, sender=Membres)
+def membre_saved(sender, instance, created, **kwargs):
+    instance.remember_loaded_values()
+    if created:
+        stats.increment_many({
+            stats.MEMBRES: 1,
+            stats.departement_key(instance.departement_id): 1,
+        })
+        return
+
+    previous = getattr(instance, '_departement_precedent', None)
+    if previous is not None and previous != instance.departement_id:
+        stats.increment_many({
+            stats.departement_key(previous): -1,
+            stats.departement_key(instance.departement_id): 1,
+        })
+
+
+@receiver(post_delete, sender=Membres)
+def membre_deleted(sender, instance, **kwargs):
+    stats.increment_many({
+        stats.MEMBRES: -1,
+        stats.departement_key(instance.departement_id): -1,
+    })
+    delete_files_on_commit(instance, ['photo'])
+
+
+@receiver(pre_save, sender=Stock)
+def stock_before_save(sender, instance, **kwargs):
+    # date_generation change à chaque sauvegarde (auto_now) : garder l'ancienne
+    # (gardée à la lecture de l'instance : pas de requête, voir LoadedValuesMixin)
+    if not instance._state.adding:
+        instance._date_precedente = instance.loaded_value('date_generation')
+
+
+@receiver(post_save, sender=Stock)
+def stock_saved(sender, instance, created, **kwargs):
+    instance.remember_loaded_values()
+    deltas = {stats.day_key(timezone.localdate(instance.date_generation)): 1}
+    if created:
+        deltas[stats.CARTES] = 1
+    else:
+        previous = getattr(instance, '_date_precedente', None)
+        if previous is None or timezone.localdate(previous) == timezone.localdate(instance.date_generation):
+            return
+        if stats.in_history(previous):
+            deltas[stats.day_key(timezone.localdate(previous))] = -1
+    stats.increment_many(deltas)
+
+
+@receiver(post_delete, sender=Stock)
+def stock_deleted(sender, instance, **kwargs):
+    deltas = {stats.CARTES: -1}
+    if instance.date_generation and stats.in_history(instance.date_generation):
+        deltas[stats.day_key(timezone.localdate(instance.date_generation))] = -1
+    stats.increment_many(deltas)
+    delete_files_on_commit(instance, Stock.ARTEFACT_FIELDS.values())
@@ -0,0 +1,220 @@
+"""
+Statistiques du dashboard, tenues à jour au fil de l'eau.
+
+Les compteurs (table Compteur) sont incrémentés par les signaux de
+cryptage/signals.py à chaque création ou suppression : le dashboard lit une
+poignée de lignes au lieu de compter les tables. Les écritures qui ne
+déclenchent pas de signaux (bulk_create, queryset.update) doivent appeler
+increment() elles-mêmes ; `python manage.py reconcile_stats` recalcule tout
+à partir des tables et corrige les écarts.
+"""
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+MEMBRES = 'membres'
+DEPARTEMENTS = 'departements'
+CARTES = 'cartes'
+TEMPLATES = 'templates'
+
+# Présent une fois les compteurs calculés à partir des tables
+INITIALISE = 'stats:initialise'
+
+# Nombre de jours conservés dans les compteurs quotidiens de cartes
+HISTORY_DAYS = 30
+
+# Variations en attente dans ce thread (voir deferred)
+_local = threading.local()
+
+
+def day_key(day):
+    """Clé du compteur des cartes générées un jour donné."""
+    return f'cartes:jour:{day.isoformat()}'
+
+
+def departement_key(departement_id):
+    """Clé du compteur des membres d'un département."""
+    return f'membres:dept:{departement_id}'
+
+
+def in_history(moment):
+    """Indique si une date de génération a encore son compteur quotidien."""
+    return timezone.localdate(moment) >= timezone.localdate() - timedelta(days=HISTORY_DAYS)
+
+
+def increment(key, delta=1):
+    """Ajoute delta au compteur (créé au besoin), dans la transaction en cours."""
+    from cryptage.models import Compteur
+
+    if not delta:
+        return
+    pending = getattr(_local, 'deltas', None)
+    if pending is not None:
+        pending[key] = pending.get(key, 0) + delta
+        return
+    now = timezone.now()
+    if Compteur.objects.filter(cle=key).update(valeur=F('valeur') + delta, date_maj=now):
+        return
+    try:
+        with transaction.atomic():
+            Compteur.objects.create(cle=key, valeur=delta)
+    except IntegrityError:
+        # Créé entre-temps par une autre requête
+        Compteur.objects.filter(cle=key).update(valeur=F('valeur') + delta, date_maj=now)
+
+
+def increment_many(deltas):
+    """
+    Args:
+        deltas: dict {clé: variation}
+    """
+    for key, delta in deltas.items():
+        increment(key, delta)
+
+
+@contextmanager
+def deferred():
+    """
+    Regroupe les incrémentations faites dans le bloc (y compris par les
+    signaux) en une seule mise à jour par compteur à la sortie.
+    Utile pour les suppressions en masse : sans cela, chaque ligne supprimée
+    met à jour ses compteurs. Rien n'est écrit si le bloc lève une exception.
+    """
+    if getattr(_local, 'deltas', None) is not None:
+        # Déjà dans un bloc deferred : le bloc extérieur écrira
+        yield
+        return
+
+    _local.deltas = {}
+    try:
+        yield
+        deltas = _local.deltas
+    finally:
+        _local.deltas = None
+    increment_many(deltas)
+
+
+def forget(key):
+    """Supprime un compteur devenu inutile (département supprimé)."""
+    from cryptage.models import Compteur
+
+    Compteur.objects.filter(cle=key).delete()
+
+
+def compute():
+    """
+    Calcule toutes les statistiques à partir des tables.
+
+    Returns:
+        dict {clé: valeur}
+    """
+    from cryptage.models import CardTemplate, Departement, Membres, Stock
+
+    values = {
+        MEMBRES: Membres.objects.count(),
+        DEPARTEMENTS: Departement.objects.count(),
+        CARTES: Stock.objects.count(),
+        TEMPLATES: CardTemplate.objects.count(),
+        INITIALISE: 1,
+    }
+
+    today = timezone.localdate()
+    first_day = today - timedelta(days=HISTORY_DAYS)
+    for offset in range(HISTORY_DAYS + 1):
+        values[day_key(today - timedelta(days=offset))] = 0
+    per_day = (
+        Stock.objects.filter(date_generation__date__gte=first_day)
+        .annotate(jour=TruncDate('date_generation'))
+        .values('jour').annotate(nombre=Count('id')).order_by()
+    )
+    for row in per_day:
+        values[day_key(row['jour'])] = row['nombre']
+
+    per_departement = Departement.objects.annotate(nombre=Count('membres')).values_list('id', 'nombre')
+    for departement_id, nombre in per_departement:
+        values[departement_key(departement_id)] = nombre
+
+    return values
+
+
+def reconcile():
+    """
+    Remplace les compteurs par les valeurs recalculées et supprime les
+    compteurs obsolètes (jours trop anciens, départements supprimés).
+
+    Returns:
+        dict {clé: (ancienne valeur ou None, nouvelle valeur ou None)} des compteurs corrigés
+    """
+    from cryptage.models import Compteur
+
+    with transaction.atomic():
+        # Les incrémentations concurrentes attendent la fin du recalcul
+        existing = {c.cle: c for c in Compteur.objects.select_for_update()}
+        values = compute()
+
+        changes = {}
+        to_update = []
+        to_create = []
+        for key, value in values.items():
+            counter = existing.get(key)
+            if counter is None:
+                to_create.append(Compteur(cle=key, valeur=value))
+                changes[key] = (None, value)
+            elif counter.valeur != value:
+                changes[key] = (counter.valeur, value)
+                counter.valeur = value
+                to_update.append(counter)
+
+        obsolete = [key for key in existing if key not in values]
+        for key in obsolete:
+            changes[key] = (existing[key].valeur, None)
+
+        Compteur.objects.bulk_create(to_create)
+        Compteur.objects.bulk_update(to_update, ['valeur'])
+        Compteur.objects.filter(cle__in=obsolete).delete()
+    return changes
+
+
+def dashboard_stats():
+    """
+    Statistiques du dashboard, lues dans les compteurs.
+    Les compteurs sont calculés au premier appel s'ils n'existent pas encore.
+
+    Returns:
+        dict avec total_membres, total_departements, total_cartes,
+        total_templates, cartes_semaine (cartes des 7 derniers jours
+        calendaires, aujourd'hui compris, lues dans les compteurs quotidiens)
+        et membres_par_dept (départements annotés de nombre_membres, du
+        plus grand au plus petit)
+    """
+    from cryptage.models import Compteur, Departement
+
+    today = timezone.localdate()
+    week = [day_key(today - timedelta(days=offset)) for offset in range(7)]
+    departements = list(Departement.objects.all())
+    keys = [MEMBRES, DEPARTEMENTS, CARTES, TEMPLATES, INITIALISE] + week
+    keys += [departement_key(d.pk) for d in departements]
+
+    values = dict(Compteur.objects.filter(cle__in=keys).values_list('cle', 'valeur'))
+    if INITIALISE not in values:
+        reconcile()
+        values = dict(Compteur.objects.filter(cle__in=keys).values_list('cle', 'valeur'))
+
+    for departement in departements:
+        departement.nombre_membres = values.get(departement_key(departement.pk), 0)
+    departements.sort(key=lambda d: d.nombre_membres, reverse=True)
+
+    return {
+        'total_membres': values.get(MEMBRES, 0),
+        'total_departements': values.get(DEPARTEMENTS, 0),
+        'total_cartes': values.get(CARTES, 0),
+        'total_templates': values.get(TEMPLATES, 0),
+        'cartes_semaine': sum(values.get(key, 0) for key in week),
+        'membres_par_dept': departements,
+    }
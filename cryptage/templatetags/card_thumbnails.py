@@ -0,0 +1,16 @@
+from django import template
+
+from cryptage.thumbnails import thumbnail_url
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def thumbnail(obj, image, size='sm', fmt='webp'):
+    """
+    URL de la miniature d'une image de carte ou de template.
+
+    Usage: <img src="{% thumbnail carte 'recto' 'md' %}">
+    """
+    return thumbnail_url(obj, image, size, fmt) or ''
@@ -1,3 +1,1348 @@
-from django.test import TestCase
+import os
+import re
+import shutil
+import struct
+import tempfile
+import zlib
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import DataError, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image, ImageDraw
+from reportlab.lib.pagesizes import A4
+
+from cryptage import bulk_import, http_cache, jobs, metrics, rendering, stats, thumbnails, views
+from cryptage.bulk_import import import_members
+from cryptage.card_generator import AssetRegistry, CardGenerator, TemplateImageCache, render_qr_matrix, template_cache
+from cryptage.jobs import (
+    IdempotencyConflict, JobInProgress, claim_next_job, requeue_stale_jobs, run_job_now, run_worker
+)
+from cryptage.management.commands import import_members as import_command
+from cryptage.models import CardJob, CardJobItem, CardTemplate, Departement, Membres, MesuresProcessus, Stock
+from cryptage.pdf_stream import PNG_SIGNATURE, StreamingPDFWriter
+from cryptage.rendering import ARTEFACTS, BulkCardRenderer, store_cards
+from cryptage.search import search_members
+from cryptage.thumbnails import thumbnail_url
+
+try:
+    import pypdf
+except ImportError:  # lecteur PDF utilisé seulement par les tests
+    pypdf = None
+
+
+class TemporaryMediaMixin:
+    """MEDIA_ROOT dans un dossier temporaire (self.media), supprimé après chaque test."""
+
+    def setUp(self):
+        super().setUp()
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media, ignore_errors=True)
+        media = override_settings(MEDIA_ROOT=self.media)
+        media.enable()
+        self.addCleanup(media.disable)
+
+
+class RenderQrMatrixTests(TestCase):
+    """Le rendu NumPy du QR code doit être identique au rendu de la bibliothèque qrcode."""
+
+    def setUp(self):
+        departement = Departement.objects.create(nom_depart='Informatique')
+        self.membre = Membres.objects.create(
+            nom='Diallo', prenom='Awa', departement=departement,
+            telephone='771234567', email='awa.diallo@example.com', profession='Développeuse'
+        )
+
+    def test_pixel_identical_to_qrcode_make_image(self):
+        qr = CardGenerator(self.membre, template=None)._get_qr()
+        expected = qr.make_image(fill_color="black").convert('RGB')
+        actual = render_qr_matrix(qr.modules, qr.box_size, qr.border).convert('RGB')
+
+        self.assertEqual(actual.size, expected.size)
+        self.assertEqual(actual.tobytes(), expected.tobytes())
+
+    def test_one_pixel_per_module(self):
+        qr = CardGenerator(self.membre, template=None)._get_qr()
+        image = render_qr_matrix(qr.modules, 1, qr.border)
+
+        matrix = qr.get_matrix()
+        self.assertEqual(image.size, (len(matrix), len(matrix)))
+        self.assertEqual(
+            list(image.getdata()),
+            [0 if cell else 255 for row in matrix for cell in row]
+        )
+
+    def test_qr_image_has_whole_pixel_modules(self):
+        generator = CardGenerator(self.membre, template=None)
+        image = generator.generate_qr_image(200, logo_path='logo-absent.png')
+        qr = generator._get_qr()
+
+        # Tous les modules font box_size pixels, le reste est une marge blanche centrée
+        box_size = 200 // (len(qr.modules) + 2 * qr.border)
+        expected = render_qr_matrix(qr.modules, box_size, qr.border)
+        offset = (200 - expected.width) // 2
+        self.assertEqual(image.size, (200, 200))
+        self.assertEqual(
+            image.convert('L').crop((offset, offset, offset + expected.width, offset + expected.height)).tobytes(),
+            expected.tobytes()
+        )
+        self.assertEqual(image.crop((0, 0, 200, offset)).convert('L').getextrema(), (255, 255))
+
+
+class CardPdfTests(TestCase):
+    """PDF de la carte : faces embarquées en binaire (voir CryptageConfig.ready)."""
+
+    def test_face_images_not_ascii85_encoded(self):
+        membre = Membres(
+            nom='Pdf', prenom='Test', departement=Departement(nom_depart='Informatique'),
+            telephone='770000000', email='pdf@example.com', profession='Dev'
+        )
+        pdf = CardGenerator(membre, template=None).generate_pdf().getvalue()
+
+        images = re.findall(rb'<<([^<>]*/Subtype /Image[^<>]*)>>', pdf)
+        self.assertEqual(len(images), 2)
+        for image in images:
+            self.assertEqual(re.search(rb'/Filter \[([^\]]*)\]', image).group(1).split(), [b'/FlateDecode'])
+        self.assertNotIn(b'ASCII85Decode', pdf)
+
+
+class TemplateImageCacheTests(TemporaryMediaMixin, TestCase):
+    """Images de template décodées une seule fois, oubliées dès que le template ou son fichier change."""
+
+    SIZE = (CardGenerator.CARD_WIDTH, CardGenerator.CARD_HEIGHT)
+
+    def setUp(self):
+        super().setUp()
+        self.template = CardTemplate.objects.create(
+            nom='Cache', template_recto=self.image_file('recto.png', 'red'),
+            template_verso=self.image_file('verso.png', 'blue')
+        )
+        template_cache.invalidate()
+        self.addCleanup(template_cache.invalidate)
+
+    def image_file(self, name, color):
+        buffer = BytesIO()
+        Image.new('RGB', (505, 319), color).save(buffer, 'PNG')
+        return ContentFile(buffer.getvalue(), name=name)
+
+    def test_decoded_once_and_resized(self):
+        hits, misses = template_cache.hits, template_cache.misses
+        first = template_cache.get(self.template, 'recto', self.SIZE)
+        second = template_cache.get(self.template, 'recto', self.SIZE)
+
+        self.assertIs(first, second)
+        self.assertEqual(first.size, self.SIZE)
+        self.assertEqual(first.getpixel((0, 0)), (255, 0, 0))
+        self.assertEqual((template_cache.hits - hits, template_cache.misses - misses), (1, 1))
+
+    def test_template_save_invalidates(self):
+        first = template_cache.get(self.template, 'recto', self.SIZE)
+        self.template.save()
+        self.assertIsNot(template_cache.get(self.template, 'recto', self.SIZE), first)
+
+    def test_replaced_file_invalidates(self):
+        template_cache.get(self.template, 'recto', self.SIZE)
+
+        # Fichier réécrit sous le même nom, sans passer par le modèle
+        path = self.template.template_recto.path
+        mtime = os.stat(path).st_mtime_ns
+        Image.new('RGB', (505, 319), 'green').save(path)
+        os.utime(path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+
+        image = template_cache.get(self.template, 'recto', self.SIZE)
+        self.assertEqual(image.getpixel((0, 0)), (0, 128, 0))
+
+    def test_least_recently_used_entry_evicted(self):
+        cache = TemplateImageCache(max_entries=1)
+        cache.get(self.template, 'recto', self.SIZE)
+        cache.get(self.template, 'verso', self.SIZE)
+        cache.get(self.template, 'recto', self.SIZE)
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+
+
+class AssetRegistryTests(TestCase):
+    """Logo et polices chargés une fois par taille, logo relu si son fichier change."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.logo_path = os.path.join(directory, 'logo.png')
+        Image.new('RGBA', (300, 300), (20, 120, 200, 128)).save(self.logo_path)
+        self.assets = AssetRegistry()
+
+    def test_logo_cached_per_size_and_version(self):
+        logo, background = self.assets.logo(self.logo_path, 50)
+        self.assertEqual((logo.mode, logo.size), ('RGBA', (50, 50)))
+        self.assertEqual((background.mode, background.getpixel((0, 0))), ('RGB', (0, 0, 0)))
+        self.assertIs(self.assets.logo(self.logo_path, 50)[0], logo)
+        self.assertIsNot(self.assets.logo(self.logo_path, 60)[0], logo)
+
+        # Logo remplacé : nouvelle version chargée
+        mtime = os.stat(self.logo_path).st_mtime_ns
+        os.utime(self.logo_path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+        self.assertIsNot(self.assets.logo(self.logo_path, 50)[0], logo)
+
+        self.assertIsNone(self.assets.logo(self.logo_path + '.absent', 50))
+        self.assertEqual(self.assets.stats()['logo'], {'hits': 1, 'misses': 3})
+
+    def test_missing_font_falls_back_once(self):
+        font = self.assets.font('police-absente.ttf', 24)
+        self.assertIs(self.assets.font('police-absente.ttf', 24), font)
+        self.assertEqual(self.assets.stats()['font'], {'hits': 1, 'misses': 1})
+
+
+class CardListQueryCountTests(TestCase):
+    """Les listes de cartes doivent faire un nombre fixe de requêtes, quelle que soit la page."""
+
+    def setUp(self):
+        template = CardTemplate.objects.create(
+            nom='Template test', template_recto='card_templates/r.png',
+            template_verso='card_templates/v.png'
+        )
+        for i in range(12):
+            departement = Departement.objects.create(nom_depart=f'Département {i}')
+            membre = Membres.objects.create(
+                nom=f'Nom{i}', prenom=f'Prenom{i}', departement=departement,
+                telephone='771234567', email=f'membre{i}@example.com', profession='Étudiant'
+            )
+            Stock.objects.create(membre=membre, template_utilise=template)
+
+    def test_api_list_cards(self):
+        for limit in (2, 12):
+            # COUNT(*) + une seule requête pour les cartes, membres, départements et templates
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/cards/list/', {'limit': limit})
+            self.assertEqual(len(response.json()['cards']), limit)
+            self.assertEqual(response.json()['cards'][0]['membre']['departement_name'], 'Département 11')
+
+    def test_api_list_cards_search(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/cards/list/', {'search': 'Prenom1', 'limit': 10})
+        self.assertEqual(response.json()['pagination']['total'], 3)
+
+    def test_html_list(self):
+        # COUNT(*) de la pagination + une requête pour les cartes de la page
+        with self.assertNumQueries(2):
+            response = self.client.get('/list/')
+        self.assertContains(response, 'Département 11')
+
+        with mock.patch.object(views, 'LIST_PAGE_SIZE', 5):
+            response = self.client.get('/list/', {'page': 3})
+        self.assertEqual(len(response.context['images']), 2)
+        self.assertContains(response, 'Page 3 / 3')
+
+    def test_api_list_cards_cursor(self):
+        cache.clear()
+        seen = []
+        cursor = ''
+        while True:
+            response = self.client.get('/api/cards/list/', {'cursor': cursor, 'limit': 5})
+            pagination = response.json()['pagination']
+            seen += [card['id'] for card in response.json()['cards']]
+            self.assertEqual(pagination['total'], 12)
+            if not pagination['has_more']:
+                break
+            cursor = pagination['next_cursor']
+
+        # Toutes les cartes, une seule fois, de la plus récente à la plus ancienne
+        self.assertEqual(len(seen), 12)
+        self.assertEqual(seen, sorted(seen, reverse=True))
+
+    def test_api_list_cards_cursor_page_cost(self):
+        # Page suivante : une requête pour les cartes (le total est en cache)
+        first = self.client.get('/api/cards/list/', {'cursor': '', 'limit': 3})
+        with self.assertNumQueries(1):
+            self.client.get('/api/cards/list/', {'cursor': first.json()['pagination']['next_cursor'], 'limit': 3})
+
+    def test_api_list_cards_invalid_cursor(self):
+        response = self.client.get('/api/cards/list/', {'cursor': 'pas-un-curseur'})
+        self.assertEqual(response.status_code, 400)
+
+
+class MemberSearchTests(TestCase):
+    """Recherche multi-mots sur nom, prénom, email et profession."""
+
+    def setUp(self):
+        departement = Departement.objects.create(nom_depart='Informatique')
+        for nom, prenom, profession in [('Dupont', 'Jean', 'Comptable'),
+                                        ('Dupont', 'Marie', 'Ingénieure'),
+                                        ('Ndiaye', 'Jean', 'Infirmier')]:
+            Membres.objects.create(
+                nom=nom, prenom=prenom, departement=departement, telephone='770000000',
+                email=f'{prenom}.{nom}@example.com'.lower(), profession=profession
+            )
+
+    def search(self, query):
+        return sorted(str(m) for m in search_members(Membres.objects.all(), query))
+
+    def test_every_term_must_match(self):
+        self.assertEqual(self.search('jean dupont'), ['Dupont Jean'])
+        self.assertEqual(self.search('JEAN'), ['Dupont Jean', 'Ndiaye Jean'])
+
+    def test_profession_and_email(self):
+        self.assertEqual(self.search('infirm'), ['Ndiaye Jean'])
+        self.assertEqual(self.search('marie.dupont@'), ['Dupont Marie'])
+
+    def test_empty_query_returns_everything(self):
+        self.assertEqual(len(self.search('  ')), 3)
+
+
+class StockIndexTests(TestCase):
+    """Les requêtes courantes sur Stock doivent utiliser les index composites."""
+
+    def test_access_patterns_use_indexes(self):
+        out = StringIO()
+        call_command('explain_stock_indexes', check=True, no_seqscan=True, stdout=out)
+        self.assertNotIn('SANS INDEX', out.getvalue())
+
+
+class DashboardStatsTests(TestCase):
+    """Les compteurs du dashboard suivent les créations et suppressions."""
+
+    def setUp(self):
+        self.stats = stats
+        self.informatique = Departement.objects.create(nom_depart='Informatique')
+        self.design = Departement.objects.create(nom_depart='Design')
+        self.membres = [
+            Membres.objects.create(
+                nom=f'Nom{i}', prenom='Test', departement=self.informatique,
+                telephone='770000000', email=f'membre{i}@example.com', profession='Dev'
+            )
+            for i in range(3)
+        ]
+        for membre in self.membres[:2]:
+            Stock.objects.create(membre=membre)
+
+    def test_counters_match_tables(self):
+        values = self.stats.dashboard_stats()
+        self.assertEqual(values['total_membres'], 3)
+        self.assertEqual(values['total_departements'], 2)
+        self.assertEqual(values['total_cartes'], 2)
+        self.assertEqual(values['cartes_semaine'], 2)
+        self.assertEqual(
+            [(d.nom_depart, d.nombre_membres) for d in values['membres_par_dept']],
+            [('Informatique', 3), ('Design', 0)]
+        )
+
+    def test_updates_and_deletes(self):
+        membre = self.membres[0]
+        membre.departement = self.design
+        membre.save()
+        self.membres[1].delete()  # supprime aussi sa carte
+
+        values = self.stats.dashboard_stats()
+        self.assertEqual(values['total_membres'], 2)
+        self.assertEqual(values['total_cartes'], 1)
+        self.assertEqual(values['cartes_semaine'], 1)
+        self.assertEqual(
+            {d.nom_depart: d.nombre_membres for d in values['membres_par_dept']},
+            {'Informatique': 1, 'Design': 1}
+        )
+        self.assertEqual(self.stats.reconcile(), {})
+
+    def test_save_does_not_reread_previous_values(self):
+        self.stats.reconcile()
+        membre = Membres.objects.get(pk=self.membres[0].pk)
+        stock = Stock.objects.get(membre=self.membres[1])
+        membre.departement = self.design
+
+        # Ancien département et ancienne date gardés à la lecture : aucun SELECT
+        with CaptureQueriesContext(connection) as queries:
+            membre.save()
+            stock.save()
+            membre.departement = self.informatique
+            membre.save()
+        self.assertEqual([q['sql'] for q in queries if q['sql'].startswith('SELECT')], [])
+        self.assertEqual(self.stats.reconcile(), {})
+
+    def test_reconcile_fixes_drift(self):
+        self.stats.reconcile()
+        # Écriture sans signaux
+        Stock.objects.bulk_create([Stock(membre=self.membres[2])])
+        self.assertEqual(self.stats.dashboard_stats()['total_cartes'], 2)
+
+        changes = self.stats.reconcile()
+        self.assertEqual(changes[self.stats.CARTES], (2, 3))
+        self.assertEqual(self.stats.dashboard_stats()['total_cartes'], 3)
+
+    def test_dashboard_query_count_is_constant(self):
+        self.stats.reconcile()
+        # Départements, compteurs, dernières cartes
+        with self.assertNumQueries(3):
+            self.stats.dashboard_stats()
+            list(Stock.objects.select_related('membre__departement', 'template_utilise')[:5])
+
+
+class BulkImportTests(TemporaryMediaMixin, TestCase):
+    """Import de membres et enregistrement des cartes par lots."""
+
+    def members_data(self, count, offset=0):
+        return [
+            {'email': f'lot{i}@example.com', 'first_name': f'P{i}', 'last_name': f'N{i}',
+             'phone': '770000000', 'profession': 'Dev', 'department': f'Dept{i % 3}'}
+            for i in range(offset, offset + count)
+        ]
+
+    def test_query_count_does_not_grow_with_batch(self):
+        # Premier lot : départements et compteurs créés
+        import_members(self.members_data(3))
+
+        counts = []
+        for count, offset in ((5, 100), (40, 200)):
+            with CaptureQueriesContext(connection) as queries:
+                membres, errors = import_members(self.members_data(count, offset))
+            self.assertEqual((len(membres), errors), (count, []))
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_existing_members_and_errors(self):
+        departement = Departement.objects.create(nom_depart='Dept0')
+        existing = Membres.objects.create(
+            nom='Ancien', prenom='Membre', departement=departement,
+            telephone='770000000', email='lot0@example.com', profession='Dev'
+        )
+        stats.reconcile()
+
+        data = self.members_data(3) + [{'first_name': 'Sans email'}, self.members_data(1)[0]]
+        membres, errors = import_members(data)
+
+        self.assertEqual(errors, [(3, "L'email est obligatoire")])
+        self.assertEqual([index for index, _ in membres], [0, 1, 2, 4])
+        self.assertEqual(membres[0][1].pk, existing.pk)
+        self.assertEqual(membres[3][1].pk, existing.pk)
+        self.assertEqual(Departement.objects.filter(nom_depart='Dept0').count(), 1)
+        self.assertEqual(stats.reconcile(), {})
+
+    def test_too_long_fields_fail_only_their_row(self):
+        data = self.members_data(3)
+        data[1]['department'] = 'D' * 80
+        data[2]['first_name'] = 'P' * 40
+
+        membres, errors = import_members(data)
+        self.assertEqual([index for index, _ in membres], [0])
+        self.assertEqual(errors, [(1, 'department : 64 caractères au maximum'),
+                                  (2, 'first_name : 32 caractères au maximum')])
+
+    def test_rejected_batch_retried_one_by_one(self):
+        real_import = bulk_import.import_members
+
+        def reject(members_data, update=False):
+            if len(members_data) > 1 or members_data[0]['email'] == 'lot1@example.com':
+                raise DataError('valeur refusée')
+            return real_import(members_data, update)
+
+        sources = [{'member_data': data} for data in self.members_data(3)]
+        with mock.patch.object(bulk_import, 'import_members', side_effect=reject):
+            membres, errors = rendering.resolve_members(sources)
+
+        self.assertEqual([index for index, _ in membres], [0, 2])
+        self.assertEqual(errors, [(1, 'valeur refusée')])
+
+    def test_store_cards_replaces_old_cards(self):
+        membres = [membre for _, membre in import_members(self.members_data(3))[0]]
+        old = Stock.objects.create(membre=membres[0])
+        stats.reconcile()
+        artefacts = {field: b'contenu' for field, _ in ARTEFACTS}
+
+        stocks = store_cards([(membre, artefacts, 'empreinte') for membre in membres], template=None)
+
+        self.assertFalse(Stock.objects.filter(pk=old.pk).exists())
+        self.assertEqual(
+            set(Stock.objects.values_list('pk', flat=True)), {stock.pk for stock in stocks}
+        )
+        self.assertEqual(stats.reconcile(), {})
+
+
+    def test_store_cards_failure_deletes_written_files(self):
+        membres = [membre for _, membre in import_members(self.members_data(2))[0]]
+        artefacts = {field: b'contenu' for field, _ in ARTEFACTS}
+
+        with mock.patch.object(Stock.objects, 'bulk_create', side_effect=DataError('lot refusé')):
+            with self.assertRaises(DataError):
+                store_cards([(membre, artefacts, '') for membre in membres], template=None)
+        with mock.patch.object(Stock, 'save', side_effect=DataError('carte refusée')):
+            with self.assertRaises(DataError):
+                rendering.store_card(membres[0], None, artefacts)
+
+        self.assertEqual(Stock.objects.count(), 0)
+        self.assertEqual([files for _, _, files in os.walk(self.media) if files], [])
+
+    def test_store_cards_member_listed_twice(self):
+        [(_, membre)], _ = import_members(self.members_data(1))
+        stats.reconcile()
+        first = {field: b'premier' for field, _ in ARTEFACTS}
+        second = {field: b'second' for field, _ in ARTEFACTS}
+
+        stocks = store_cards([(membre, first, ''), (membre, second, '')], template=None)
+
+        self.assertIs(stocks[0], stocks[1])
+        self.assertEqual(list(Stock.objects.values_list('pk', flat=True)), [stocks[0].pk])
+        self.assertEqual(stocks[0].carte_pdf.read(), b'second')
+        self.assertEqual(sum(len(files) for _, _, files in os.walk(self.media)), len(ARTEFACTS))
+        self.assertEqual(stats.reconcile(), {})
+
+
+class ImportMembersCommandTests(TestCase):
+    """Commande import_members : validation, mise à jour et reprise."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, 'membres.csv')
+        with open(self.path, 'w') as f:
+            f.write('first_name,last_name,email,department,phone,profession\n')
+            for i in range(5):
+                f.write(f'P{i},N{i},csv{i}@example.com,Dept{i % 2},770000000,Dev\n')
+            f.write('Sans,Email,,Dept0,,\n')
+
+    def test_import_update_and_resume(self):
+        real_import = bulk_import.import_members
+        calls = []
+
+        def interrupt_second_batch(members_data, update=False):
+            calls.append(len(members_data))
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return real_import(members_data, update)
+
+        out, err = StringIO(), StringIO()
+        with mock.patch.object(import_command, 'import_members', side_effect=interrupt_second_batch), \
+                self.assertRaises(KeyboardInterrupt):
+            call_command('import_members', self.path, batch_size=2, stdout=out, stderr=err)
+        self.assertEqual(Membres.objects.filter(email__startswith='csv').count(), 2)
+
+        # Reprise après le dernier lot enregistré
+        call_command('import_members', self.path, batch_size=2, stdout=out, stderr=err)
+        self.assertIn('Reprise après la ligne 2', out.getvalue())
+        self.assertEqual(Membres.objects.filter(email__startswith='csv').count(), 5)
+        self.assertIn('Ligne 6', err.getvalue())
+
+        # Import terminé : la progression est effacée, une nouvelle exécution relit tout
+        self.assertFalse(os.path.exists(f'{self.path}.progress'))
+        out = StringIO()
+        call_command('import_members', self.path, stdout=out, stderr=StringIO())
+        self.assertNotIn('Reprise', out.getvalue())
+        self.assertIn('5 membre(s) importé(s)', out.getvalue())
+
+        # Mise à jour des membres existants (département tronqué à la longueur de la colonne)
+        with open(self.path, 'w') as f:
+            f.write(f'first_name,last_name,email,department\nNouveau,N0,csv0@example.com,{"D" * 80}\n')
+        call_command('import_members', self.path, update=True, stdout=out, stderr=err)
+        membre = Membres.objects.get(email='csv0@example.com')
+        self.assertEqual((membre.prenom, membre.departement.nom_depart), ('Nouveau', 'D' * 64))
+
+    def test_progress_ignored_for_another_file(self):
+        with open(f'{self.path}.progress', 'w') as f:
+            f.write('{"line": 4, "imported": 4, "cards": 0, "failed": 0, "file": {"size": 1, "mtime_ns": 1}}')
+
+        out = StringIO()
+        call_command('import_members', self.path, stdout=out, stderr=StringIO())
+        self.assertIn('import depuis le début', out.getvalue())
+        self.assertEqual(Membres.objects.filter(email__startswith='csv').count(), 5)
+
+    def test_rejected_batch_reported_per_row(self):
+        real_import = bulk_import.import_members
+
+        def reject_one(members_data, update=False):
+            if members_data[0]['email'] == 'csv1@example.com':
+                raise DataError('valeur refusée')
+            return real_import(members_data, update)
+
+        err = StringIO()
+        with mock.patch.object(import_command, 'import_members', side_effect=DataError('lot refusé')), \
+                mock.patch.object(bulk_import, 'import_members', side_effect=reject_one):
+            call_command('import_members', self.path, stdout=StringIO(), stderr=err)
+
+        self.assertEqual(Membres.objects.filter(email__startswith='csv').count(), 4)
+        self.assertIn('Ligne 2: valeur refusée', err.getvalue())
+        self.assertIn('Ligne 6', err.getvalue())
+
+
+def render_or_crash(membre, template):
+    """Rendu factice (processus de travail) : le processus s'arrête net pour le membre « Crash »."""
+    if membre.nom == 'Crash':
+        os._exit(1)
+    return {'carte_pdf': membre.email.encode()}, None, []
+
+
+class BulkCardRendererTests(TestCase):
+    """Rendu parallèle : résultats dans l'ordre des membres, erreurs isolées par membre."""
+
+    def setUp(self):
+        departement = Departement.objects.create(nom_depart='Informatique')
+        self.membres = [
+            Membres.objects.create(
+                nom=f'Nom{i}', prenom='Rendu', departement=departement,
+                telephone='770000000', email=f'rendu{i}@example.com', profession='Dev'
+            )
+            for i in range(4)
+        ]
+        # Template sans fichiers : faces par défaut, aucun accès à la base dans le pool
+        self.template = CardTemplate(nom='Sans fichiers')
+
+    def test_pool_keeps_order_and_isolates_errors(self):
+        # Sans département, le rendu échoue dans le processus de travail
+        broken = Membres(nom='Sans', prenom='Departement', email='sans@example.com')
+        membres = self.membres[:2] + [broken] + self.membres[2:]
+
+        with mock.patch.object(rendering, 'ProcessPoolExecutor', wraps=rendering.ProcessPoolExecutor) as pool:
+            results = list(BulkCardRenderer(self.template, max_workers=2).render(membres))
+        pool.assert_called_once()
+        self.assertEqual(pool.call_args.kwargs['max_workers'], 2)
+
+        self.assertEqual([membre for membre, _, _ in results], membres)
+        _, artefacts, error = results[2]
+        self.assertIsNone(artefacts)
+        self.assertIsInstance(error, str)
+        for membre, artefacts, error in results[:2] + results[3:]:
+            self.assertIsNone(error)
+            self.assertEqual(set(artefacts), {field for field, _ in ARTEFACTS})
+            self.assertTrue(artefacts['carte_pdf'].startswith(b'%PDF'))
+            self.assertEqual(Image.open(BytesIO(artefacts['carte_recto'])).size, (1011, 638))
+
+    def test_killed_worker_fails_only_its_member(self):
+        crash = Membres(nom='Crash', prenom='Rendu', email='crash@example.com')
+        membres = self.membres[:1] + [crash] + self.membres[1:]
+
+        with mock.patch.object(rendering, '_render_one', render_or_crash):
+            results = list(BulkCardRenderer(self.template, max_workers=2).render(membres))
+
+        self.assertEqual([membre for membre, _, _ in results], membres)
+        self.assertEqual(results[1], (crash, None, rendering.WORKER_CRASHED))
+        for membre, artefacts, error in results[:1] + results[2:]:
+            self.assertIsNone(error)
+            self.assertEqual(artefacts, {'carte_pdf': membre.email.encode()})
+
+    def test_single_worker_renders_in_process(self):
+        def render(membre, template):
+            if membre == self.membres[1]:
+                raise ValueError('rendu impossible')
+            return {'carte_pdf': membre.email.encode()}
+
+        with mock.patch.object(rendering, 'render_card_artefacts', side_effect=render), \
+                mock.patch.object(rendering, 'ProcessPoolExecutor') as pool:
+            results = list(BulkCardRenderer(self.template, max_workers=1).render(self.membres))
+            # Un seul membre : pas de pool, quel que soit le nombre de processus
+            list(BulkCardRenderer(self.template, max_workers=4).render(self.membres[:1]))
+        pool.assert_not_called()
+
+        self.assertEqual(results[1], (self.membres[1], None, 'rendu impossible'))
+        self.assertEqual(
+            [(membre, artefacts) for membre, artefacts, _ in results[:1] + results[2:]],
+            [(membre, {'carte_pdf': membre.email.encode()}) for membre in self.membres if membre != self.membres[1]]
+        )
+
+
+class ResumableBulkGenerationTests(TemporaryMediaMixin, TestCase):
+    """Un lot interrompu reprend aux membres non traités (clé d'idempotence)."""
+
+    def setUp(self):
+        super().setUp()
+        departement = Departement.objects.create(nom_depart='Informatique')
+        self.membres = [
+            Membres.objects.create(
+                nom=f'Nom{i}', prenom='Test', departement=departement,
+                telephone='770000000', email=f'reprise{i}@example.com', profession='Dev'
+            )
+            for i in range(3)
+        ]
+        self.old_cards = [Stock.objects.create(membre=membre) for membre in self.membres]
+        self.rendered = []
+
+    def fake_render(self, membre, template):
+        self.rendered.append(membre.pk)
+        return {field: b'contenu' for field, _ in ARTEFACTS}
+
+    def test_resume_after_crash(self):
+        sources = [{'member_id': membre.pk} for membre in self.membres]
+        store_card = rendering.store_card
+
+        def crash_on_second(membre, *args, **kwargs):
+            if membre == self.membres[1]:
+                raise KeyboardInterrupt
+            return store_card(membre, *args, **kwargs)
+
+        with mock.patch.object(rendering, 'render_card_artefacts', self.fake_render), \
+                mock.patch.object(rendering, 'STORE_BATCH_SIZE', 1), \
+                mock.patch.object(rendering, 'store_cards', side_effect=Exception('lot')):
+            with mock.patch.object(rendering, 'store_card', side_effect=crash_on_second):
+                with self.assertRaises(KeyboardInterrupt):
+                    run_job_now(sources, None, force=True, idempotency_key='lot-1', max_workers=1)
+
+            # Les anciennes cartes des membres non traités sont intactes
+            self.assertFalse(Stock.objects.filter(pk=self.old_cards[0].pk).exists())
+            self.assertTrue(Stock.objects.filter(pk=self.old_cards[1].pk).exists())
+
+            # Tâche commencée depuis longtemps mais toujours active : pas reprise
+            CardJob.objects.update(date_debut=timezone.now() - timedelta(hours=2), date_activite=timezone.now())
+            with self.assertRaises(JobInProgress):
+                run_job_now(sources, None, force=True, idempotency_key='lot-1', max_workers=1)
+
+            # Tâche abandonnée (plus de signe de vie) puis renvoyée avec la même clé
+            CardJob.objects.update(date_activite=CardJob.objects.get().date_activite - timedelta(hours=2))
+            job = run_job_now(sources, None, force=True, idempotency_key='lot-1', max_workers=1)
+
+            with self.assertRaises(IdempotencyConflict):
+                run_job_now(sources[:1], None, force=True, idempotency_key='lot-1', max_workers=1)
+
+        self.assertEqual((job.statut, job.traites, job.echecs), (CardJob.TERMINE, 3, 0))
+        # Seul le membre interrompu est rendu deux fois
+        self.assertEqual(self.rendered, [m.pk for m in self.membres[:2]] + [m.pk for m in self.membres[1:]])
+        self.assertEqual(Stock.objects.count(), 3)
+        self.assertFalse(Stock.objects.filter(pk__in=[stock.pk for stock in self.old_cards]).exists())
+
+    def test_one_checkpoint_per_stored_batch(self):
+        sources = [{'member_id': membre.pk} for membre in self.membres]
+        with mock.patch.object(rendering, 'render_card_artefacts', self.fake_render), \
+                CaptureQueriesContext(connection) as queries:
+            job = run_job_now(sources, None, force=True, max_workers=1)
+
+        self.assertEqual((job.statut, job.traites, job.echecs), (CardJob.TERMINE, 3, 0))
+        progress = [q['sql'] for q in queries if q['sql'].startswith('UPDATE "cryptage_cardjob" SET "traites"')]
+        self.assertEqual(len(progress), 1)
+        self.assertEqual(job.items.filter(statut=CardJobItem.TERMINE, stock__isnull=False).count(), 3)
+
+
+    def test_resent_batch_reports_deleted_cards(self):
+        template = CardTemplate.objects.create(nom='Reprise')
+        body = {'member_ids': [membre.pk for membre in self.membres], 'template_id': template.pk}
+
+        def post():
+            with mock.patch.object(rendering, 'render_card_artefacts', self.fake_render):
+                response = self.client.post(
+                    '/api/cards/generate-bulk/?lazy=false', body,
+                    content_type='application/json', HTTP_IDEMPOTENCY_KEY='lot-api'
+                )
+            self.assertEqual(response.status_code, 201)
+            return response.json()
+
+        self.assertEqual(post()['generated'], 3)
+        Stock.objects.filter(membre=self.membres[0]).delete()
+
+        response = post()
+        self.assertEqual((response['total'], response['generated'], response['failed']), (3, 2, 1))
+        self.assertEqual(response['errors'], [{'member_id': self.membres[0].pk, 'error': 'Carte supprimée'}])
+
+    def test_heartbeat_while_preparing_batch(self):
+        sources = [{'member_id': membre.pk} for membre in self.membres]
+        with mock.patch.object(rendering, 'render_card_artefacts', self.fake_render), \
+                mock.patch.object(rendering, 'STORE_BATCH_SIZE', 1), \
+                mock.patch.object(jobs, 'touch_job', wraps=jobs.touch_job) as touch:
+            job = run_job_now(sources, None, max_workers=1)
+
+        self.assertEqual(job.statut, CardJob.TERMINE)
+        # Membres résolus, une empreinte par paquet de STORE_BATCH_SIZE, cartes réutilisables
+        self.assertEqual(touch.call_count, 1 + len(self.membres) + 1)
+
+
+class AsyncBulkGenerationTests(TemporaryMediaMixin, TestCase):
+    """Génération confiée au worker : tâche planifiée (202), traitement, suivi."""
+
+    def setUp(self):
+        super().setUp()
+        self.template = CardTemplate.objects.create(nom='Async')
+        departement = Departement.objects.create(nom_depart='Informatique')
+        self.membres = [
+            Membres.objects.create(
+                nom=f'Nom{i}', prenom='Async', departement=departement,
+                telephone='770000000', email=f'async{i}@example.com', profession='Dev'
+            )
+            for i in range(2)
+        ]
+        patcher = mock.patch.object(
+            rendering, 'render_card_artefacts',
+            lambda membre, template, fields=None: {field: b'contenu' for field, _ in ARTEFACTS}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def enqueue(self, member_ids):
+        response = self.client.post(
+            '/api/cards/generate-bulk/?async=true',
+            {'member_ids': member_ids, 'template_id': self.template.pk}, content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 202)
+        return response.json()
+
+    def test_enqueue_worker_and_poll(self):
+        missing = max(membre.pk for membre in self.membres) + 1
+        body = self.enqueue([membre.pk for membre in self.membres] + [missing])
+        self.assertTrue(body['job_url'].endswith(f"/api/cards/jobs/{body['job_id']}/"))
+        self.assertEqual(Stock.objects.count(), 0)
+
+        job = self.client.get(body['job_url']).json()['job']
+        self.assertEqual((job['status'], job['processed'], job['progress']), (CardJob.EN_ATTENTE, 0, 0))
+
+        out = StringIO()
+        run_worker(once=True, max_workers=1, stdout=out)
+        self.assertIn('2/3 carte(s) générée(s), 1 échec(s)', out.getvalue())
+
+        body = self.client.get(body['job_url']).json()
+        self.assertEqual(
+            (body['job']['status'], body['job']['generated'], body['job']['failed'], body['job']['progress']),
+            (CardJob.TERMINE, 2, 1, 100)
+        )
+        self.assertEqual(
+            [result['card']['id'] for result in body['results'][:2]],
+            [Stock.objects.get(membre=membre).pk for membre in self.membres]
+        )
+        self.assertEqual(body['errors'], [{'member_id': missing, 'error': body['results'][2]['error']}])
+
+    def test_claim_and_requeue_stale_job(self):
+        first = self.enqueue([self.membres[0].pk])['job_id']
+        second = self.enqueue([self.membres[1].pk])['job_id']
+
+        # Les tâches sont réservées dans l'ordre d'arrivée, une seule fois chacune
+        self.assertEqual(claim_next_job().pk, first)
+        self.assertEqual(claim_next_job().pk, second)
+        self.assertIsNone(claim_next_job())
+
+        # Worker toujours actif : rien n'est repris
+        self.assertEqual(requeue_stale_jobs(), 0)
+        CardJob.objects.filter(pk=first).update(date_activite=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(), 1)
+
+        run_worker(once=True, max_workers=1)
+        self.assertEqual(CardJob.objects.get(pk=first).statut, CardJob.TERMINE)
+        self.assertEqual(CardJob.objects.get(pk=second).statut, CardJob.EN_COURS)
+        self.assertEqual(list(Stock.objects.values_list('membre_id', flat=True)), [self.membres[0].pk])
+
+
+class MetricsTests(TestCase):
+    """Histogrammes des étapes de génération et endpoint Prometheus."""
+
+    def setUp(self):
+        self.metrics = metrics
+        metrics.registry.reset()
+
+    def test_forwarded_stages_are_counted_once_per_call(self):
+        # Processus de rendu : mesures relevées mais pas enregistrées localement
+        with mock.patch.object(self.metrics, 'forward_only', True):
+            with self.metrics.collect() as stages:
+                for _ in range(3):
+                    with self.metrics.timed('png_encode'):
+                        pass
+        self.assertEqual(self.metrics.registry.snapshot(), {})
+
+        # Processus parent
+        self.metrics.record(stages)
+        counts, _, count = self.metrics.registry.snapshot()['png_encode']
+        self.assertEqual((count, sum(counts)), (3, 3))
+
+    def test_prometheus_endpoint(self):
+        with self.metrics.timed('recto'):
+            pass
+
+        response = self.client.get('/api/metrics/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('card_generation_stage_duration_seconds_bucket{stage="recto",le="+Inf"} 1', text)
+        self.assertIn('card_generation_stage_duration_seconds_count{stage="recto"} 1', text)
+        self.assertIn('card_cache_requests_total{cache="template",result="hit"}', text)
+
+    def test_worker_histograms_added_to_endpoint(self):
+        # Processus worker : mesures exportées en base à l'arrêt
+        with self.metrics.timed('recto'):
+            pass
+        with mock.patch.object(self.metrics, 'start_exporter') as start_exporter:
+            call_command('run_card_worker', '--once', stdout=StringIO())
+        start_exporter.assert_called_once()
+        name = start_exporter.call_args.args[0]
+        self.assertEqual(MesuresProcessus.objects.get().processus, name)
+
+        # Processus serveur : ses propres mesures plus celles du worker
+        self.metrics.registry.reset()
+        with self.metrics.timed('recto'):
+            pass
+        text = self.client.get('/api/metrics/').content.decode()
+        self.assertIn('card_generation_stage_duration_seconds_count{stage="recto"} 2', text)
+
+
+@skipUnless(pypdf, 'pypdf requis pour relire les PDF')
+class StreamingPDFWriterTests(TestCase):
+    """PDF écrit au fil de l'eau : relu par un lecteur PDF, images intactes."""
+
+    def png(self, image, **options):
+        buffer = BytesIO()
+        image.save(buffer, 'PNG', **options)
+        return buffer.getvalue()
+
+    def gradient(self, mode='RGB', size=(40, 20)):
+        image = Image.linear_gradient('L').resize(size)
+        return Image.merge('RGB', (image, image.transpose(Image.Transpose.FLIP_LEFT_RIGHT), image)).convert(mode)
+
+    def interlaced_png(self, image):
+        """PNG entrelacé (Adam7) d'une image RGB de 2x2 pixels : Pillow ne sait pas en écrire."""
+        pixel = lambda x, y: image.getpixel((x, y))
+        raw = b''.join(
+            b'\0' + bytes(sum((pixel(x, y) for x, y in row), ()))
+            for row in ([(0, 0)], [(1, 0)], [(0, 1), (1, 1)])  # passes 1, 6 et 7
+        )
+
+        def chunk(kind, data):
+            return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+        return PNG_SIGNATURE + b''.join([
+            chunk(b'IHDR', struct.pack('>IIBBBBB', 2, 2, 8, 2, 0, 0, 1)),
+            chunk(b'IDAT', zlib.compress(raw)),
+            chunk(b'IEND', b''),
+        ])
+
+    def write(self, pages):
+        """PDF d'une image par page, relu par pypdf (octets émis par flush concaténés)."""
+        writer = StreamingPDFWriter(A4)
+        output = [writer.flush()]
+        for data in pages:
+            image = writer.add_image(data)
+            writer.draw_image(image, 50, 400, 300, 200)
+            writer.draw_string(50, 380, 'Légende (é)')
+            writer.show_page()
+            output.append(writer.flush())
+        writer.close()
+        output.append(writer.flush())
+        return pypdf.PdfReader(BytesIO(b''.join(output)), strict=True)
+
+    def page_image(self, page):
+        [xobject] = page['/Resources']['/XObject'].values()
+        [image] = page.images
+        return xobject.get_object(), image.image.convert('RGB')
+
+    def test_pages_and_png_passthrough(self):
+        rgb, gray = self.gradient(), self.gradient('L')
+        reader = self.write([self.png(rgb), self.png(gray, optimize=True), self.png(rgb.rotate(90, expand=True))])
+
+        self.assertEqual(len(reader.pages), 3)
+        self.assertIn('Légende', reader.pages[0].extract_text())
+        for page, expected in zip(reader.pages, [rgb, gray.convert('RGB'), rgb.rotate(90, expand=True)]):
+            xobject, image = self.page_image(page)
+            # Données IDAT intégrées telles quelles (prédicteur PNG)
+            self.assertEqual(xobject['/DecodeParms']['/Predictor'], 15)
+            self.assertEqual(image.tobytes(), expected.tobytes())
+
+    def test_other_formats_are_decoded(self):
+        palette = self.gradient().quantize(16)
+        alpha = self.gradient('RGBA')
+        square = self.gradient(size=(2, 2))
+        sources = [
+            (self.png(palette), palette),
+            (self.png(alpha), alpha),
+            (self.interlaced_png(square), square),
+        ]
+        reader = self.write([data for data, _ in sources])
+
+        self.assertEqual(Image.open(BytesIO(sources[2][0])).convert('RGB').tobytes(), square.tobytes())
+        for page, (_, expected) in zip(reader.pages, sources):
+            xobject, image = self.page_image(page)
+            self.assertNotIn('/DecodeParms', xobject)
+            self.assertEqual(image.tobytes(), expected.convert('RGB').tobytes())
+
+    def test_empty_document_has_one_blank_page(self):
+        reader = self.write([])
+        self.assertEqual(len(reader.pages), 1)
+        self.assertEqual(reader.pages[0].mediabox.width, round(A4[0], 4))
+
+
+@skipUnless(pypdf, 'pypdf requis pour relire les PDF')
+class CardSheetTests(TemporaryMediaMixin, TestCase):
+    """Planche download-all : une image identique n'est écrite qu'une fois dans le PDF."""
+
+    def setUp(self):
+        super().setUp()
+        departement = Departement.objects.create(nom_depart='Informatique')
+        # Même verso pour toutes les cartes, deux cartes au recto identique
+        for i, color in enumerate(['red', 'red', 'blue']):
+            membre = Membres.objects.create(
+                nom=f'Nom{i}', prenom='Planche', departement=departement,
+                telephone='770000000', email=f'planche{i}@example.com', profession='Dev'
+            )
+            stock = Stock(membre=membre)
+            for field, face_color in (('carte_recto', color), ('carte_verso', 'white')):
+                buffer = BytesIO()
+                Image.new('RGB', (101, 64), face_color).save(buffer, 'PNG')
+                getattr(stock, field).save(f'{field}.png', ContentFile(buffer.getvalue()), save=False)
+            stock.save()
+
+    def test_identical_faces_share_one_xobject(self):
+        response = self.client.get('/api/cards/download-all/')
+        self.assertEqual(response.status_code, 200)
+        reader = pypdf.PdfReader(BytesIO(b''.join(response.streaming_content)), strict=True)
+
+        objects = (reader.get_object(number) for number in range(1, reader.trailer['/Size']))
+        images = [obj for obj in objects if hasattr(obj, 'get') and obj.get('/Subtype') == '/Image']
+        # Deux rectos différents et le verso commun
+        self.assertEqual(len(images), 3)
+
+        [page] = reader.pages
+        self.assertEqual(page.extract_text().count('Planche'), 3)
+        self.assertEqual(len(page['/Resources']['/XObject']), 3)
+
+
+class RenderReuseTests(TemporaryMediaMixin, TestCase):
+    """Cartes inchangées réutilisées sans rendu ; template, photo ou ?force relancent le rendu."""
+
+    def setUp(self):
+        super().setUp()
+        self.template = CardTemplate.objects.create(
+            nom='Actif', template_recto=self.image_file('recto.png', 'red'),
+            template_verso=self.image_file('verso.png', 'blue')
+        )
+        departement = Departement.objects.create(nom_depart='Informatique')
+        self.membre = Membres.objects.create(
+            nom='Sarr', prenom='Moussa', departement=departement, telephone='770000000',
+            email='reuse@example.com', profession='Dev', photo=self.image_file('photo.png', 'green')
+        )
+        self.rendered = []
+
+    def image_file(self, name, color):
+        buffer = BytesIO()
+        Image.new('RGB', (40, 40), color).save(buffer, 'PNG')
+        return ContentFile(buffer.getvalue(), name=name)
+
+    def fake_render(self, membre, template, fields=None):
+        self.rendered.append(membre.pk)
+        return {field: b'contenu' for field, _ in ARTEFACTS}
+
+    def rewrite(self, field_file, color):
+        """Remplace le contenu d'un fichier sans changer son nom."""
+        mtime = os.stat(field_file.path).st_mtime_ns
+        Image.new('RGB', (40, 40), color).save(field_file.path)
+        os.utime(field_file.path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+
+    def generate(self, **kwargs):
+        with mock.patch.object(rendering, 'render_card_artefacts', self.fake_render):
+            [(_, stock, error)] = rendering.generate_cards(
+                [{'member_id': self.membre.pk}], self.template, max_workers=1, lazy=False, **kwargs
+            )
+        self.assertIsNone(error)
+        return stock
+
+    def test_unchanged_member_reused_without_render(self):
+        first = self.generate()
+        second = self.generate()
+
+        self.assertEqual(second.pk, first.pk)
+        self.assertEqual(self.rendered, [self.membre.pk])
+        self.assertNotEqual(self.generate(force=True).pk, first.pk)
+        self.assertEqual(self.rendered, [self.membre.pk] * 2)
+
+    def test_template_and_photo_changes_invalidate_fingerprint(self):
+        stock = self.generate()
+        fingerprint = rendering.card_fingerprint(self.membre, self.template)
+        self.assertEqual(stock.empreinte, fingerprint)
+
+        self.rewrite(self.template.template_verso, 'yellow')
+        after_template = rendering.card_fingerprint(self.membre, self.template)
+        self.assertNotEqual(after_template, fingerprint)
+        self.assertEqual(rendering.find_reusable_cards([self.membre], [after_template]), {})
+
+        self.rewrite(self.membre.photo, 'black')
+        after_photo = rendering.card_fingerprint(self.membre, self.template)
+        self.assertNotIn(after_photo, (fingerprint, after_template))
+
+        self.generate()
+        self.assertEqual(self.rendered, [self.membre.pk] * 2)
+
+    def test_regenerate_view_force(self):
+        self.generate()
+        url = f'/regenerate-card/{self.membre.pk}/'
+
+        with mock.patch.object(rendering, 'render_card_artefacts', self.fake_render):
+            self.assertEqual(self.client.get(url).status_code, 302)
+            self.assertEqual((len(self.rendered), Stock.objects.count()), (1, 1))
+
+            self.assertEqual(self.client.get(url, {'force': 1}).status_code, 302)
+            # Nouvelle carte, l'historique est conservé
+            self.assertEqual((len(self.rendered), Stock.objects.count()), (2, 2))
+
+
+class LazyArtefactTests(TemporaryMediaMixin, TestCase):
+    """Cartes enregistrées sans fichiers, chaque fichier rendu à sa première demande."""
+
+    def setUp(self):
+        super().setUp()
+        departement = Departement.objects.create(nom_depart='Informatique')
+        self.membre = Membres.objects.create(
+            nom='Diallo', prenom='Awa', departement=departement,
+            telephone='770000000', email='lazy@example.com', profession='Dev'
+        )
+        self.rendered = []
+
+    def fake_render(self, membre, template, fields=None):
+        self.rendered.append((membre.email, tuple(fields or ())))
+        return {field: b'contenu' for field, _ in ARTEFACTS if fields is None or field in fields}
+
+    def test_artefact_rendered_on_first_access(self):
+        with mock.patch.object(rendering, 'render_card_artefacts', self.fake_render):
+            [(_, stock, error)] = rendering.generate_cards(
+                [{'member_id': self.membre.pk}], None, max_workers=1, lazy=True
+            )
+            self.assertIsNone(error)
+            self.assertEqual(self.rendered, [])
+            self.assertFalse(stock.carte_pdf)
+            self.assertEqual(stock.pdf_url, f'/api/cards/{stock.pk}/pdf/')
+
+            # La fiche du membre a changé depuis : le rendu suit la spec enregistrée
+            Membres.objects.filter(pk=self.membre.pk).update(email='autre@example.com')
+            for _ in range(2):
+                response = self.client.get(stock.pdf_url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(b''.join(response.streaming_content), b'contenu')
+
+        self.assertEqual(self.rendered, [('lazy@example.com', ('carte_pdf',))])
+        stock.refresh_from_db()
+        self.assertTrue(stock.carte_pdf)
+        self.assertFalse(stock.carte_recto)
+        self.assertRegex(stock.pdf_url, rf'^/api/cards/{stock.pk}/pdf/\?v=[0-9a-f]{{16}}$')
+        self.assertEqual(self.client.get(f'/api/cards/{stock.pk}/inconnu/').status_code, 404)
+
+
+    def test_rendered_with_template_of_generation(self):
+        templates = []
+
+        def render(membre, template, fields=None):
+            templates.append(template)
+            return self.fake_render(membre, template, fields)
+
+        with mock.patch.object(rendering, 'render_card_artefacts', render):
+            # Carte générée sans template : pas le template actif au moment du rendu
+            [(_, stock, _)] = rendering.generate_cards(
+                [{'member_id': self.membre.pk}], None, max_workers=1, lazy=True
+            )
+            self.assertEqual(stock.spec['template'], None)
+            CardTemplate.objects.create(nom='Actif depuis')
+            self.assertEqual(rendering.card_fingerprint(self.membre, None), stock.empreinte)
+            self.assertEqual(self.client.get(stock.pdf_url).status_code, 200)
+            self.assertEqual(templates, [None])
+
+            # Template supprimé depuis : le fichier ne peut plus être généré à l'identique
+            template = CardTemplate.objects.create(nom='Supprimé ensuite')
+            [(_, stock, _)] = rendering.generate_cards(
+                [{'member_id': self.membre.pk}], template, max_workers=1, lazy=True, force=True
+            )
+            self.assertEqual(stock.spec['template'], template.pk)
+            template.delete()
+            self.assertEqual(self.client.get(stock.pdf_url).status_code, 404)
+            self.assertEqual(templates, [None])
+
+
+class ConditionalArtefactTests(TemporaryMediaMixin, TestCase):
+    """Fichiers des cartes : ETag, 304, plages d'octets et URL versionnées."""
+
+    def setUp(self):
+        super().setUp()
+        departement = Departement.objects.create(nom_depart='Informatique')
+        membre = Membres.objects.create(
+            nom='Sow', prenom='Ali', departement=departement,
+            telephone='770000000', email='cache@example.com', profession='Dev'
+        )
+        self.stock = Stock(membre=membre)
+        self.stock.carte_pdf.save('carte.pdf', ContentFile(b'0123456789'), save=False)
+        self.stock.save()
+
+    def test_versioned_url_is_immutable_and_revalidates(self):
+        response = self.client.get(self.stock.pdf_url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('immutable', response['Cache-Control'])
+        etag = response['ETag']
+
+        response = self.client.get(self.stock.pdf_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+        # Sans version (ou version périmée) : revalidation à chaque fois
+        response = self.client.get(f'/api/cards/{self.stock.pk}/pdf/?v=ancienne')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        response = self.client.get(
+            f'/download-card/{self.stock.pk}/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']
+        )
+        self.assertEqual(response.status_code, 304)
+
+    def test_byte_ranges(self):
+        url = self.stock.pdf_url
+        response = self.client.get(url, HTTP_RANGE='bytes=2-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(b''.join(response.streaming_content), b'2345')
+
+        response = self.client.get(url, HTTP_RANGE='bytes=-3')
+        self.assertEqual(b''.join(response.streaming_content), b'789')
+
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=20-').status_code, 416)
+
+        # If-Range d'une autre version : fichier entier
+        response = self.client.get(url, HTTP_RANGE='bytes=2-5', HTTP_IF_RANGE='"autre"')
+        self.assertEqual(response.status_code, 200)
+
+
+    def test_recorded_version_avoids_storage(self):
+        [stock] = store_cards(
+            [(self.stock.membre, {field: b'contenu' for field, _ in ARTEFACTS}, '')], template=None
+        )
+        stock = Stock.objects.get(pk=stock.pk)
+        versions = [http_cache.file_version(stock.carte_pdf), http_cache.file_version(stock.carte_recto)]
+
+        # URL construites sans accès au stockage
+        with mock.patch.object(http_cache, 'file_version', side_effect=AssertionError), \
+                mock.patch.object(thumbnails, 'file_version', side_effect=AssertionError):
+            url = stock.pdf_url
+            thumbnail = thumbnail_url(stock, 'recto', 'sm')
+        self.assertEqual(url, f'/api/cards/{stock.pk}/pdf/?v={versions[0]}')
+        self.assertTrue(thumbnail.endswith(f'?v={versions[1]}'))
+        self.assertIn('immutable', self.client.get(url)['Cache-Control'])
+
+
+class ThumbnailTests(TemporaryMediaMixin, TestCase):
+    """Miniatures des images des cartes, générées une fois puis servies depuis le stockage."""
+
+    def setUp(self):
+        super().setUp()
+        departement = Departement.objects.create(nom_depart='Informatique')
+        membre = Membres.objects.create(
+            nom='Ba', prenom='Fatou', departement=departement,
+            telephone='770000000', email='miniature@example.com', profession='Dev'
+        )
+        buffer = BytesIO()
+        Image.new('RGB', (1011, 638), (200, 30, 30)).save(buffer, 'PNG')
+        self.stock = Stock(membre=membre)
+        self.stock.carte_recto.save('recto.png', ContentFile(buffer.getvalue()), save=False)
+        self.stock.save()
+
+    def test_thumbnail_generated_once_and_cached(self):
+        url = thumbnail_url(self.stock, 'recto', 'sm')
+        self.assertRegex(url, rf'^/api/thumbnails/card/{self.stock.pk}/recto/sm\.webp\?v=[0-9a-f]{{16}}$')
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertIn('immutable', response['Cache-Control'])
+        content = b''.join(response.streaming_content)
+        self.assertEqual(Image.open(BytesIO(content)).size, (320, 202))
+        self.assertLess(len(content), os.path.getsize(self.stock.carte_recto.path) / 10)
+
+        response = self.client.get(url.replace('.webp', '.jpg'))
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+        # Deuxième demande : miniature lue dans le stockage
+        with mock.patch.object(thumbnails.Image, 'open', side_effect=AssertionError):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+        self.assertEqual(self.client.get(url.replace('/sm.', '/xl.')).status_code, 404)
+        self.assertIsNone(thumbnail_url(self.stock, 'verso', 'sm'))
+
+
+class ReencodeMediaTests(TemporaryMediaMixin, TestCase):
+    """Ré-encodage des images déjà stockées (commande reencode_media)."""
+
+    def setUp(self):
+        super().setUp()
+        settings = override_settings(
+            CARD_IMAGE_ENCODING={'qr_code': ('png-palette', 9), 'carte_recto': ('webp-lossless', 1)},
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+        departement = Departement.objects.create(nom_depart='Informatique')
+        membre = Membres.objects.create(
+            nom='Ndiaye', prenom='Omar', departement=departement,
+            telephone='770000000', email='encodage@example.com', profession='Dev'
+        )
+        qr = Image.new('RGB', (630, 630), 'white')
+        draw = ImageDraw.Draw(qr)
+        for i in range(0, 630, 30):
+            draw.rectangle((i, (i * 7) % 600, i + 15, (i * 7) % 600 + 15), fill='black')
+        buffer = BytesIO()
+        qr.save(buffer, 'PNG', compress_level=1)
+        self.stock = Stock(membre=membre)
+        self.stock.qr_code.save('qr.png', ContentFile(buffer.getvalue()), save=False)
+        self.stock.save()
+
+    def test_reencode_in_place(self):
+        old_name, old_size = self.stock.qr_code.name, self.stock.qr_code.size
+
+        call_command('reencode_media', '--dry-run', stdout=StringIO())
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.qr_code.name, old_name)
+
+        out = StringIO()
+        call_command('reencode_media', stdout=out)
+        self.assertIn('1 fichier(s) ré-encodé(s)', out.getvalue())
+        self.stock.refresh_from_db()
+        self.assertNotEqual(self.stock.qr_code.name, old_name)
+        self.assertFalse(self.stock.qr_code.storage.exists(old_name))
+        self.assertLess(self.stock.qr_code.size, old_size)
+        with self.stock.qr_code.open('rb') as f:
+            self.assertEqual(Image.open(BytesIO(f.read())).mode, 'P')
+
+        # Déjà encodé : rien à gagner
+        out = StringIO()
+        call_command('reencode_media', stdout=out)
+        self.assertIn('0 fichier(s) ré-encodé(s), 1 inchangé(s)', out.getvalue())
+
+
+class MediaGarbageCollectionTests(TemporaryMediaMixin, TestCase):
+    """Fichiers supprimés avec leur carte, orphelins ramassés par gc_media."""
+
+    def setUp(self):
+        super().setUp()
+        departement = Departement.objects.create(nom_depart='Informatique')
+        self.membre = Membres.objects.create(
+            nom='Fall', prenom='Binta', departement=departement,
+            telephone='770000000', email='gc@example.com', profession='Dev'
+        )
+
+        def card(**fields):
+            stock = Stock(membre=self.membre, **fields)
+            stock.carte_pdf.save('carte.pdf', ContentFile(b'pdf'), save=False)
+            stock.qr_code.save('qr.png', ContentFile(b'png'), save=False)
+            stock.save()
+            return stock
+
+        self.card = card
+
+    def test_files_deleted_with_card_after_commit(self):
+        stock = self.card()
+        names = [stock.carte_pdf.name, stock.qr_code.name]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Stock.objects.filter(pk=stock.pk).delete()
+        for name in names:
+            self.assertFalse(stock.carte_pdf.storage.exists(name))
+
+    def test_gc_media(self):
+        kept = self.card()
+        orphan = default_storage.save('cartes/pdf/orpheline.pdf', ContentFile(b'x' * 100))
+        recent = default_storage.save('cartes/pdf/en_cours.pdf', ContentFile(b'x'))
+        old = os.path.getmtime(default_storage.path(orphan)) - 2 * 3600
+        for name in (orphan, kept.carte_pdf.name, kept.qr_code.name):
+            os.utime(default_storage.path(name), (old, old))
+
+        out = StringIO()
+        call_command('gc_media', '--dry-run', stdout=out)
+        self.assertIn(orphan, out.getvalue())
+        self.assertTrue(default_storage.exists(orphan))
+
+        call_command('gc_media', stdout=StringIO())
+        self.assertFalse(default_storage.exists(orphan))
+        self.assertTrue(default_storage.exists(recent))
+        self.assertTrue(default_storage.exists(kept.carte_pdf.name))
+        self.assertTrue(default_storage.exists(kept.qr_code.name))
+
+    def test_prune_history_keeps_latest_card(self):
+        spec = {'nom': 'Fall'}
+        previous, latest = self.card(spec=spec), self.card(spec=spec)
+        previous_name = previous.carte_pdf.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('gc_media', '--prune-history', stdout=StringIO())
+        previous.refresh_from_db()
+        latest.refresh_from_db()
+        self.assertFalse(previous.carte_pdf)
+        self.assertFalse(previous.carte_pdf.storage.exists(previous_name))
+        self.assertTrue(latest.carte_pdf)
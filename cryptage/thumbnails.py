@@ -0,0 +1,112 @@
+"""
+Miniatures des images des cartes (QR code, recto, verso) et des templates.
+
+Les pages de liste et l'administration affichent les images en petit : au
+lieu des PNG en pleine résolution, elles chargent une miniature WebP ou JPEG
+à l'une des tailles de THUMBNAIL_SIZES. Chaque miniature est générée à la
+première demande puis gardée dans le stockage (dossier thumbnails/), sous un
+nom tiré de la version de l'image source : une source modifiée donne une
+nouvelle miniature, jamais une miniature périmée.
+"""
+from collections import namedtuple
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.urls import reverse
+from PIL import Image
+
+from cryptage.http_cache import file_info, file_version
+from cryptage.metrics import timed
+
+
+# Largeurs des miniatures (pixels), la hauteur suit les proportions de l'image
+THUMBNAIL_SIZES = {
+    'xs': 120,
+    'sm': 320,
+    'md': 640,
+}
+
+# Format dans l'URL : (format Pillow, options d'encodage)
+THUMBNAIL_FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+# Images disponibles en miniature, par source
+SOURCE_IMAGES = {
+    'card': {'qr': 'qr_code', 'recto': 'carte_recto', 'verso': 'carte_verso'},
+    'template': {'recto': 'template_recto', 'verso': 'template_verso'},
+}
+
+THUMBNAIL_DIR = 'thumbnails'
+
+# Fichier du stockage (même interface que FieldFile pour http_cache)
+StoredFile = namedtuple('StoredFile', ['storage', 'name'])
+
+
+def thumbnail_url(obj, image, size, fmt='webp'):
+    """
+    URL de la miniature d'une image de carte (Stock) ou de template (CardTemplate).
+    L'URL porte la version de l'image source : elle peut être mise en cache
+    indéfiniment.
+
+    Args:
+        obj: Instance Stock ou CardTemplate
+        image: 'qr', 'recto' ou 'verso' (pas de QR code pour un template)
+        size: Clé de THUMBNAIL_SIZES
+        fmt: Clé de THUMBNAIL_FORMATS
+
+    Returns:
+        URL relative, ou None si l'image n'existe pas
+    """
+    from cryptage.models import Stock
+
+    source = 'card' if isinstance(obj, Stock) else 'template'
+    field = getattr(obj, SOURCE_IMAGES[source][image])
+    if obj.pk is None:
+        return None
+    # Carte enregistrée sans ses fichiers : l'image sera générée à la demande
+    if not field and not (source == 'card' and obj.spec is not None):
+        return None
+
+    url = reverse('api:thumbnail', args=[source, obj.pk, image, size, fmt])
+    # Carte : version enregistrée avec le fichier, sans accès au stockage
+    version = obj.artefact_version(SOURCE_IMAGES[source][image]) if source == 'card' else file_version(field)
+    return f'{url}?v={version}' if version else url
+
+
+def get_thumbnail(source_file, size, fmt):
+    """
+    Renvoie la miniature d'une image, générée et stockée si elle n'existe pas encore.
+
+    Args:
+        source_file: FieldFile de l'image source (existant)
+        size: Clé de THUMBNAIL_SIZES
+        fmt: Clé de THUMBNAIL_FORMATS
+
+    Returns:
+        StoredFile de la miniature
+    """
+    version = file_info(source_file)[0]
+    name = f"{THUMBNAIL_DIR}/{version[:2]}/{version[:32]}_{size}.{fmt}"
+    if default_storage.exists(name):
+        return StoredFile(default_storage, name)
+
+    with timed('thumbnail'):
+        pil_format, options = THUMBNAIL_FORMATS[fmt]
+        width = THUMBNAIL_SIZES[size]
+        with source_file.storage.open(source_file.name, 'rb') as f:
+            image = Image.open(f)
+            # draft() : décodage JPEG directement à une résolution réduite
+            image.draft('RGB', (width, width))
+            image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') and pil_format == 'WEBP' else 'RGB')
+        image.thumbnail((width, width * 4), Image.Resampling.LANCZOS)
+
+        buffer = BytesIO()
+        image.save(buffer, pil_format, **options)
+
+    # Deux requêtes simultanées peuvent générer la même miniature : le
+    # stockage renomme la seconde, le nom enregistré est renvoyé
+    name = default_storage.save(name, ContentFile(buffer.getvalue()))
+    return StoredFile(default_storage, name)
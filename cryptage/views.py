@@ -1,13 +1,12 @@
 from django.http import JsonResponse
 from django.shortcuts import render, redirect
 from PIL import Image
-import random as rd
 import os
 from io import BytesIO
 from django.contrib import messages
+from django.core.paginator import Paginator
 
 from cryptage.models import Departement, Stock, Membres
-from django.core.files.base import ContentFile
 
 
 def home(request):
@@ -45,61 +44,22 @@ def home(request):
             )
             membre_cjp.save()
             
-            # Importer le générateur de cartes
-            from cryptage.card_generator import CardGenerator
+            # Importer le moteur de rendu des cartes
             from cryptage.models import CardTemplate
+            from cryptage.rendering import card_fingerprint, render_card_artefacts, store_card
             
             # Récupérer le template actif
             active_template = CardTemplate.get_active_template()
             
-            # Créer une instance du générateur (utilisera le template actif automatiquement)
-            generator = CardGenerator(membre_cjp, template=active_template)
+            # Générer le QR code, le recto, le verso et le PDF
+            artefacts = render_card_artefacts(membre_cjp, active_template)
             
-            # Générer le QR code
-            qr_img = generator.generate_qr_code()
-            
-            # Générer la carte recto
-            carte_recto = generator.generate_card_front()
-            
-            # Générer la carte verso avec QR code
-            carte_verso = generator.generate_card_back()
-            
-            # Générer le PDF
-            pdf_buffer = generator.generate_pdf()
-            
-            # Créer l'entrée Stock
-            table = Stock()
-            table.membre = membre_cjp
-            table.template_utilise = active_template  # Sauvegarder le template utilisé
-            
-            # Sauvegarder le QR code
-            qr_buffer = generator.save_to_bytes(qr_img)
-            table.qr_code.save(
-                f"{prenom}_{nom}_qr_{rd.randint(1,1000)}.png", 
-                ContentFile(qr_buffer.read())
-            )
-            
-            # Sauvegarder la carte recto
-            recto_buffer = generator.save_to_bytes(carte_recto)
-            table.carte_recto.save(
-                f"{prenom}_{nom}_recto_{rd.randint(1,1000)}.png", 
-                ContentFile(recto_buffer.read())
+            # Créer l'entrée Stock avec ses fichiers
+            store_card(
+                membre_cjp, active_template, artefacts,
+                fingerprint=card_fingerprint(membre_cjp, active_template),
+                replace=False
             )
-            
-            # Sauvegarder la carte verso
-            verso_buffer = generator.save_to_bytes(carte_verso)
-            table.carte_verso.save(
-                f"{prenom}_{nom}_verso_{rd.randint(1,1000)}.png", 
-                ContentFile(verso_buffer.read())
-            )
-            
-            # Sauvegarder le PDF
-            table.carte_pdf.save(
-                f"{prenom}_{nom}_carte_{rd.randint(1,1000)}.pdf", 
-                ContentFile(pdf_buffer.read())
-            )
-            
-            table.save()
             messages.success(request, "La carte de membre a été générée avec succès !")
   
         error_messages = messages.get_messages(request)
@@ -113,23 +73,36 @@ def home(request):
 
 
 
+# Cartes par page de l'historique : chaque carte affichée charge ses miniatures
+# (et génère les fichiers d'une carte enregistrée sans eux)
+LIST_PAGE_SIZE = 24
+
+
 def list(request):
-    images = Stock.objects.all()
-    return render(request, 'cryptage/list.html', {'images': images})
+    images = Stock.objects.select_related('membre__departement')
+    page = Paginator(images, LIST_PAGE_SIZE).get_page(request.GET.get('page'))
+    return render(request, 'cryptage/list.html', {'images': page, 'page': page})
 
 
 def download_card_pdf(request, stock_id):
     """
     Télécharge la carte en format PDF.
+    Réponse revalidée par le navigateur (ETag / Last-Modified) : un PDF
+    inchangé n'est pas renvoyé (304).
     """
-    from django.http import FileResponse, Http404
+    from django.http import Http404
+    
+    from cryptage.http_cache import serve_file
+    from cryptage.rendering import ensure_artefact
     
     try:
-        stock = Stock.objects.get(id=stock_id)
-        if stock.carte_pdf:
-            response = FileResponse(stock.carte_pdf.open('rb'), content_type='application/pdf')
-            response['Content-Disposition'] = f'attachment; filename="{stock.membre.prenom}_{stock.membre.nom}_carte.pdf"'
-            return response
+        stock = Stock.objects.select_related('membre').get(id=stock_id)
+        # PDF généré ici à la première demande (carte enregistrée sans fichiers)
+        if stock.pdf_url:
+            return serve_file(
+                request, ensure_artefact(stock, 'carte_pdf'), as_attachment=True,
+                filename=f"{stock.membre.prenom}_{stock.membre.nom}_carte.pdf"
+            )
         else:
             raise Http404("PDF non disponible")
     except Stock.DoesNotExist:
@@ -159,61 +132,26 @@ def regenerate_card(request, membre_id):
     try:
         membre = Membres.objects.get(id=membre_id)
         
-        # Importer le générateur de cartes
-        from cryptage.card_generator import CardGenerator
+        # Importer le moteur de rendu des cartes
         from cryptage.models import CardTemplate
+        from cryptage.rendering import (
+            card_fingerprint, find_reusable_cards, render_card_artefacts, store_card
+        )
         
         # Récupérer le template actif
         active_template = CardTemplate.get_active_template()
         
-        # Créer une instance du générateur
-        generator = CardGenerator(membre, template=active_template)
-        
-        # Générer le QR code
-        qr_img = generator.generate_qr_code()
-        
-        # Générer la carte recto
-        carte_recto = generator.generate_card_front()
-        
-        # Générer la carte verso avec QR code
-        carte_verso = generator.generate_card_back()
-        
-        # Générer le PDF
-        pdf_buffer = generator.generate_pdf()
-        
-        # Créer une nouvelle entrée Stock
-        table = Stock()
-        table.membre = membre
-        table.template_utilise = active_template
+        # Rien n'a changé depuis la dernière génération : garder la carte (sauf ?force=1)
+        fingerprint = card_fingerprint(membre, active_template)
+        if not request.GET.get('force') and find_reusable_cards([membre], [fingerprint]):
+            messages.success(request, "La carte est déjà à jour.")
+            return redirect('list')
         
-        # Sauvegarder le QR code
-        qr_buffer = generator.save_to_bytes(qr_img)
-        table.qr_code.save(
-            f"{membre.prenom}_{membre.nom}_qr_{rd.randint(1,1000)}.png", 
-            ContentFile(qr_buffer.read())
-        )
-        
-        # Sauvegarder la carte recto
-        recto_buffer = generator.save_to_bytes(carte_recto)
-        table.carte_recto.save(
-            f"{membre.prenom}_{membre.nom}_recto_{rd.randint(1,1000)}.png", 
-            ContentFile(recto_buffer.read())
-        )
-        
-        # Sauvegarder la carte verso
-        verso_buffer = generator.save_to_bytes(carte_verso)
-        table.carte_verso.save(
-            f"{membre.prenom}_{membre.nom}_verso_{rd.randint(1,1000)}.png", 
-            ContentFile(verso_buffer.read())
-        )
-        
-        # Sauvegarder le PDF
-        table.carte_pdf.save(
-            f"{membre.prenom}_{membre.nom}_carte_{rd.randint(1,1000)}.pdf", 
-            ContentFile(pdf_buffer.read())
-        )
+        # Générer le QR code, le recto, le verso et le PDF
+        artefacts = render_card_artefacts(membre, active_template)
         
-        table.save()
+        # Créer une nouvelle entrée Stock (l'historique est conservé)
+        store_card(membre, active_template, artefacts, fingerprint=fingerprint, replace=False)
         messages.success(request, "La carte a été régénérée avec succès !")
         return redirect('list')
         
@@ -2,40 +2,19 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.db.models import Count
 from cryptage.models import Membres, Departement, Stock, CardTemplate
-from datetime import datetime, timedelta
+from cryptage.search import search_members
+from cryptage.stats import dashboard_stats
 
 
 def admin_dashboard(request):
     """
     Dashboard principal de l'administration.
     """
-    # Statistiques
-    total_membres = Membres.objects.count()
-    total_departements = Departement.objects.count()
-    total_cartes = Stock.objects.count()
-    total_templates = CardTemplate.objects.count()
-    
-    # Cartes générées cette semaine
-    une_semaine = datetime.now() - timedelta(days=7)
-    cartes_semaine = Stock.objects.filter(date_generation__gte=une_semaine).count()
+    # Statistiques (compteurs tenus à jour par les signaux, voir cryptage/stats.py)
+    context = dashboard_stats()
     
     # Dernières cartes générées
-    dernieres_cartes = Stock.objects.select_related('membre', 'template_utilise').order_by('-date_generation')[:5]
-    
-    # Membres par département
-    membres_par_dept = Departement.objects.annotate(
-        nombre_membres=Count('membres')
-    ).order_by('-nombre_membres')
-    
-    context = {
-        'total_membres': total_membres,
-        'total_departements': total_departements,
-        'total_cartes': total_cartes,
-        'total_templates': total_templates,
-        'cartes_semaine': cartes_semaine,
-        'dernieres_cartes': dernieres_cartes,
-        'membres_par_dept': membres_par_dept,
-    }
+    context['dernieres_cartes'] = Stock.objects.select_related('membre__departement', 'template_utilise').order_by('-date_generation')[:5]
     
     return render(request, 'cryptage/admin/dashboard.html', context)
 
@@ -50,13 +29,7 @@ def admin_membres_list(request):
     # Recherche
     search = request.GET.get('search', '')
     if search:
-        membres = membres.filter(
-            nom__icontains=search
-        ) | membres.filter(
-            prenom__icontains=search
-        ) | membres.filter(
-            email__icontains=search
-        )
+        membres = search_members(membres, search)
     
     # Filtre par département
     dept_filter = request.GET.get('departement', '')
@@ -251,7 +224,7 @@ def admin_cartes_list(request):
     """
     Liste toutes les cartes générées.
     """
-    cartes = Stock.objects.select_related('membre', 'template_utilise').order_by('-date_generation')
+    cartes = Stock.objects.select_related('membre__departement', 'template_utilise').order_by('-date_generation')
     
     # Filtre par membre
     membre_filter = request.GET.get('membre', '')
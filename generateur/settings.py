@@ -208,6 +208,53 @@ SIMPLE_JWT = {
     'USER_ID_CLAIM': 'user_id',
 }
 
+# ============================================
+# CARD GENERATION
+# ============================================
+
+# Nombre de processus pour le rendu des cartes en masse (0 = un par CPU)
+CARD_RENDER_WORKERS = config('CARD_RENDER_WORKERS', default=0, cast=int)
+
+# Génération en masse sans rendu : chaque fichier (QR code, recto, verso, PDF)
+# est généré à sa première demande
+CARD_LAZY_ARTEFACTS = config('CARD_LAZY_ARTEFACTS', default=False, cast=bool)
+
+# Encodage des images stockées : png, png-palette, png-1bit ou webp-lossless,
+# et niveau d'optimisation de 0 (rapide) à 9 (compact) (voir cryptage/image_encoding.py)
+CARD_QR_ENCODING = config('CARD_QR_ENCODING', default='png-palette')
+CARD_FACE_ENCODING = config('CARD_FACE_ENCODING', default='png')
+CARD_IMAGE_ENCODING = {
+    'qr_code': (CARD_QR_ENCODING, config('CARD_QR_OPTIMIZE', default=9, cast=int)),
+    'carte_recto': (CARD_FACE_ENCODING, config('CARD_FACE_OPTIMIZE', default=6, cast=int)),
+    'carte_verso': (CARD_FACE_ENCODING, config('CARD_FACE_OPTIMIZE', default=6, cast=int)),
+}
+
+# Intervalle (secondes) d'export en base des durées mesurées par le worker,
+# additionnées par /api/metrics/ à celles du serveur (0 = pas d'export)
+CARD_METRICS_EXPORT_INTERVAL = config('CARD_METRICS_EXPORT_INTERVAL', default=15, cast=int)
+
+# ============================================
+# LOGGING
+# ============================================
+
+# Lignes JSON des durées de génération (logger cryptage.metrics, une par carte)
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'cryptage.metrics': {
+            'handlers': ['console'],
+            'level': config('CARD_METRICS_LOG_LEVEL', default='INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 # ============================================
 # CORS CONFIGURATION
 # ============================================